@@ -1,5 +1,33 @@
 from sqlalchemy.orm import Session
 from . import models, schemas
+from .services.country_cube import refresh_country_cube
+from .services.detection_engine import refresh_actor_matches
+from .services.risk_state import apply_actor_move
+
+
+def invalidate_collection_cache(actor):
+    actor.vt_collection_id = None
+    actor.vt_collection_status = None
+    actor.vt_collection_resolved_at = None
+
+
+def _commit_actor_change(db: Session, actor, previous_country: str | None, previous_active: bool):
+    # país o estado del actor cambian qué casos de uso cumple y el riesgo por país (misma transacción) y el cubo por país
+    db.flush()
+    refresh_actor_matches(db, actor.id)
+    apply_actor_move(
+        db,
+        actor.id,
+        previous_country if previous_active else None,
+        actor.country if actor.active else None
+    )
+    db.commit()
+    refresh_country_cube(db, {actor.country, previous_country})
+
+
+def _identity_changed(actor, name: str, gti_id: str) -> bool:
+    return actor.name != name or actor.gti_id != gti_id
+
 
 def create_actor(db: Session, actor: schemas.ActorCreate):
 
@@ -9,12 +37,15 @@ def create_actor(db: Session, actor: schemas.ActorCreate):
 
     if existing:
         # actualizar datos (ej: nuevo país monitoreado)
+        if _identity_changed(existing, actor.name, actor.gti_id):
+            invalidate_collection_cache(existing)
+        previous_country, previous_active = existing.country, existing.active
         existing.name = actor.name
         existing.country = actor.country
         existing.aliases = actor.aliases
         existing.source = actor.source
         existing.active = True
-        db.commit()
+        _commit_actor_change(db, existing, previous_country, previous_active)
         db.refresh(existing)
         return existing
 
@@ -36,8 +67,9 @@ def deactivate_actor(db: Session, actor_id: int):
     actor = db.query(models.ThreatActor).filter(models.ThreatActor.id == actor_id).first()
     if not actor:
         return None
+    previous_active = actor.active
     actor.active = False
-    db.commit()
+    _commit_actor_change(db, actor, actor.country, previous_active)
     db.refresh(actor)
     return actor
 
@@ -46,12 +78,15 @@ def update_actor(db: Session, actor_id: int, actor: schemas.ActorCreate):
     existing = db.query(models.ThreatActor).filter(models.ThreatActor.id == actor_id).first()
     if not existing:
         return None
+    if _identity_changed(existing, actor.name, actor.gti_id):
+        invalidate_collection_cache(existing)
+    previous_country = existing.country
     existing.name = actor.name
     existing.gti_id = actor.gti_id
     existing.country = actor.country
     existing.aliases = actor.aliases
     existing.source = actor.source
-    db.commit()
+    _commit_actor_change(db, existing, previous_country, existing.active)
     db.refresh(existing)
     return existing
 
@@ -60,7 +95,8 @@ def set_actor_active(db: Session, actor_id: int, active: bool):
     actor = db.query(models.ThreatActor).filter(models.ThreatActor.id == actor_id).first()
     if not actor:
         return None
+    previous_active = actor.active
     actor.active = active
-    db.commit()
+    _commit_actor_change(db, actor, actor.country, previous_active)
     db.refresh(actor)
     return actor
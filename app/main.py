@@ -1,9 +1,17 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request
 from fastapi import Body
 from sqlalchemy.orm import Session
 from .database import engine, Base, get_db, SessionLocal
 from . import crud, schemas, models
-from app.services.gti_collector import run_collection, update_actor_ttps, get_confirmation_thresholds
+from app.services.gti_collector import resume_collection, update_actor_ttps, get_confirmation_thresholds, process_collection_tasks, evaluate_country_risk
+from app.services.collection_queue import (
+    COLLECTION_COORDINATOR_LEASE_SECONDS,
+    cancel_tasks,
+    claimable_job_ids,
+    coordinator_lost,
+    release_coordinator,
+    renew_coordinator,
+)
 from app.services.intel_service import get_actor_timeline
 from app.schemas import TimelineEvent
 from app.services.heatmap_service import get_heatmap
@@ -22,10 +30,26 @@ from app.services.misp_sync import sync_misp_attributes
 from app.services.opencti_sync import sync_opencti_actors
 from app.services.threat_profile import build_country_profile
 from app.services.predictor import predict_next_techniques
-from datetime import datetime, timedelta, timezone
+from app.services.http_client import connector_client
+from app.services.risk_state import apply_actor_move, rebuild_risk_state, sweep_risk_state
+from app.services.job_progress import job_progress
+from app.services.technique_catalog import get_catalog
+from app.services.technique_tactics import ensure_technique_tactics, technique_ids_for_tactic
+from app.services.country_cube import ensure_country_cube, refresh_country_cube, tactic_totals
+from app.services.event_rollup import local_today, rebuild_event_rollup, rollup_is_empty
+from app.services.tactic_first_seen import first_seen_is_empty, rebuild_tactic_first_seen
+from app.services.detection_engine import match_use_cases, rebuild_detection_matches, refresh_actor_matches, refresh_use_case_matches, stored_matches
+from app.services.event_bus import event_bus, notify
+from app.services.job_executor import job_executor, JobCancelled
+from app.services.scheduler import Scheduler, SCHEDULER_ENABLED, ensure_default_schedules, parse_days, reschedule
+from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import asyncio
-from sqlalchemy import func
+import base64
+import os
+import threading
+from contextlib import contextmanager
+from sqlalchemy import func, tuple_
 from sqlalchemy import case
 from sqlalchemy.exc import IntegrityError
 from fastapi.responses import StreamingResponse
@@ -54,14 +78,37 @@ def utc_to_bogota(dt):
 # =====================================================
 # BACKGROUND SCHEDULER (NO CRON)
 # =====================================================
-_scheduler_lock = asyncio.Lock()
-_mitre_lock = asyncio.Lock()
+# cada proceso (worker de uvicorn / réplica) ayuda a drenar las corridas del collector
+COLLECTION_WORKER_ENABLED = os.getenv("COLLECTION_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+COLLECTION_WORKER_POLL_SECONDS = float(os.getenv("COLLECTION_WORKER_POLL_SECONDS", "5"))
+# corridas sin lease de coordinador (anteriores al heartbeat): sin progreso durante este tiempo = coordinador caído
+COLLECTION_RESUME_STALE_SECONDS = int(os.getenv("COLLECTION_RESUME_STALE_SECONDS", "900"))
+
+
+def _json_or_none(raw: str | None):
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except Exception:
+        return None
 
 
 def _job_to_response(job: models.JobRun):
+    processed_items = job.processed_items
+    total_items = job.total_items
+    details = job.details
+
+    # progreso en vivo si el job corre en este proceso (job_runs se actualiza con retraso)
+    live = job_progress.get(job.id) if job.status == "RUNNING" else None
+    if live:
+        processed_items = live["processed_items"] if live["processed_items"] is not None else processed_items
+        total_items = live["total_items"] if live["total_items"] is not None else total_items
+        details = live["details"] if live["details"] is not None else details
+
     progress = None
-    if (job.total_items or 0) > 0:
-        progress = round((job.processed_items / job.total_items) * 100, 2)
+    if (total_items or 0) > 0:
+        progress = round(((processed_items or 0) / total_items) * 100, 2)
 
     return {
         "id": job.id,
@@ -70,11 +117,14 @@ def _job_to_response(job: models.JobRun):
         "status": job.status,
         "actor_id": job.actor_id,
         "actor_name": job.actor_name,
-        "total_items": job.total_items,
-        "processed_items": job.processed_items,
+        "total_items": total_items,
+        "processed_items": processed_items,
         "progress_pct": progress,
-        "details": job.details,
+        "details": details,
         "error": job.error,
+        "params": _json_or_none(job.params),
+        "result": _json_or_none(job.result),
+        "cancel_requested": bool(job.cancel_requested),
         "started_at": utc_to_bogota(job.started_at).isoformat() if job.started_at else None,
         "finished_at": utc_to_bogota(job.finished_at).isoformat() if job.finished_at else None,
         "updated_at": utc_to_bogota(job.updated_at).isoformat() if job.updated_at else None,
@@ -163,31 +213,6 @@ def _report_history_to_response(row: models.IntelReport, include_payload: bool =
     }
 
 
-def _start_job(
-    db: Session,
-    job_type: str,
-    trigger: str = "manual",
-    actor_id: int | None = None,
-    actor_name: str | None = None,
-    total_items: int = 0
-):
-    job = models.JobRun(
-        job_type=job_type,
-        trigger=trigger,
-        status="RUNNING",
-        actor_id=actor_id,
-        actor_name=actor_name,
-        total_items=total_items,
-        processed_items=0,
-        started_at=datetime.utcnow(),
-        updated_at=datetime.utcnow(),
-    )
-    db.add(job)
-    db.commit()
-    db.refresh(job)
-    return job
-
-
 def _update_job(db: Session, job_id: int, processed_items: int | None = None, total_items: int | None = None, details: str | None = None):
     job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
     if not job:
@@ -199,22 +224,34 @@ def _update_job(db: Session, job_id: int, processed_items: int | None = None, to
     if details is not None:
         job.details = details
     job.updated_at = datetime.utcnow()
+    notify(db, "jobs.progress", {
+        "job_id": job.id,
+        "processed_items": job.processed_items,
+        "total_items": job.total_items,
+        "details": job.details,
+        "updated_at": job.updated_at
+    })
     db.commit()
 
 
-def _finish_job_success(db: Session, job_id: int, details: str | None = None):
+def _finish_job_success(db: Session, job_id: int, details: str | None = None, result: dict | None = None):
+    job_progress.finish(job_id)
     job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
     if not job:
         return
     job.status = "SUCCESS"
     if details is not None:
         job.details = details
+    if result is not None:
+        job.result = json.dumps(result, default=str)
     job.finished_at = datetime.utcnow()
     job.updated_at = datetime.utcnow()
+    notify(db, "jobs.finished", _job_to_response(job))
     db.commit()
 
 
 def _finish_job_error(db: Session, job_id: int, error: str):
+    job_progress.finish(job_id)
     job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
     if not job:
         return
@@ -222,6 +259,19 @@ def _finish_job_error(db: Session, job_id: int, error: str):
     job.error = error[:1000]
     job.finished_at = datetime.utcnow()
     job.updated_at = datetime.utcnow()
+    notify(db, "jobs.finished", _job_to_response(job))
+    db.commit()
+
+
+def _finish_job_cancelled(db: Session, job_id: int):
+    job_progress.finish(job_id)
+    job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+    if not job:
+        return
+    job.status = "CANCELLED"
+    job.finished_at = datetime.utcnow()
+    job.updated_at = datetime.utcnow()
+    notify(db, "jobs.finished", _job_to_response(job))
     db.commit()
 
 def _parse_time_hhmm(value: str):
@@ -237,77 +287,98 @@ def _parse_time_hhmm(value: str):
     except Exception:
         return None
 
-def _run_collection_job():
-    db = SessionLocal()
-    job = None
-    try:
-        actor_count = db.query(models.ThreatActor).filter_by(active=True).count()
-        job = _start_job(
-            db,
-            job_type="collector",
-            trigger="scheduler",
-            total_items=actor_count
-        )
+def _collection_details(summary: dict) -> str:
+    return f"scanned={summary.get('scanned')} skipped={summary.get('skipped')} errors={summary.get('errors')}"
 
-        summary = run_collection(
-            db,
-            progress_callback=lambda processed_items, total_items, details: _update_job(
-                db,
-                job.id,
-                processed_items=processed_items,
-                total_items=total_items,
-                details=details
-            )
-        )
 
-        _finish_job_success(db, job.id, details=f"scanned={summary.get('scanned')} skipped={summary.get('skipped')} errors={summary.get('errors')}")
-        cfg = db.query(models.ScheduleConfig).first()
-        if cfg:
-            cfg.last_run_at = datetime.utcnow()
-            cfg.running = False
-            cfg.lock_until = None
-            db.commit()
-    except Exception as e:
-        if job:
-            _finish_job_error(db, job.id, str(e))
-        cfg = db.query(models.ScheduleConfig).first()
-        if cfg:
-            cfg.running = False
-            cfg.lock_until = None
-            db.commit()
+def _take_over_collection_job(db: Session, job_id: int, allow_error: bool = False, status: str = "RUNNING") -> bool:
+    """
+    Toma la coordinación de una corrida interrumpida: RUNNING con el lease del coordinador
+    vencido (o ERROR, si se pide). El UPDATE condicional evita que dos procesos la reanuden a la vez.
+    Con status=PENDING la corrida queda lista para encolarla en el job_executor.
+    Si ya hay otro collector activo, pasar ERROR a activo choca con uq_job_runs_active_dedup:
+    se hace rollback y se propaga el IntegrityError.
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=COLLECTION_RESUME_STALE_SECONDS)
+    resumable = coordinator_lost(now, stale_before)
+    if allow_error:
+        resumable = resumable | (models.JobRun.status == "ERROR")
+
+    try:
+        updated = db.query(models.JobRun)\
+            .filter(models.JobRun.id == job_id)\
+            .filter(models.JobRun.job_type == "collector")\
+            .filter(resumable)\
+            .update({
+                "status": status,
+                "error": None,
+                "finished_at": None,
+                "coordinator": None,
+                "coordinator_lease_until": None,
+                "details": "resume",
+                "updated_at": now
+            }, synchronize_session=False)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
         raise
+    return updated == 1
+
+
+@contextmanager
+def _coordinator_heartbeat(db: Session, job_id: int):
+    """
+    Este proceso coordina la corrida: toma el lease y lo renueva desde un hilo aparte mientras
+    dure, aunque un actor lento no reporte progreso. Al salir lo libera.
+    """
+    renew_coordinator(db, job_id)
+    stop = threading.Event()
+
+    def _beat():
+        while not stop.wait(COLLECTION_COORDINATOR_LEASE_SECONDS / 3):
+            beat_db = SessionLocal()
+            try:
+                if not renew_coordinator(beat_db, job_id):
+                    print("Collector coordinator lease lost:", job_id)
+                    return
+            except Exception as e:
+                print("Collector heartbeat error:", job_id, e)
+            finally:
+                beat_db.close()
+
+    thread = threading.Thread(target=_beat, name=f"collector-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
     finally:
-        db.close()
+        stop.set()
+        thread.join(timeout=5)
+        release_coordinator(db, job_id)
 
 
-def _run_mitre_sync_job():
+def _recover_collection_runs():
+    """Corridas cuyo coordinador murió (lease vencido): vuelven a PENDING y se encolan en el job_executor."""
     db = SessionLocal()
-    job = None
     try:
-        job = _start_job(db, job_type="mitre_sync", trigger="scheduler", total_items=2)
-        _update_job(db, job.id, processed_items=0, total_items=2, details="load_mitre:start")
-
-        # Load MITRE (legacy) then sync from GitHub STIX
-        load_mitre(db)
-        _update_job(db, job.id, processed_items=1, total_items=2, details="sync_mitre_from_github:start")
-        sync_mitre_from_github(db)
-        _finish_job_success(db, job.id, details="mitre sync completed")
-
-        cfg = db.query(models.MitreSyncConfig).first()
-        if cfg:
-            cfg.last_run_at = datetime.utcnow()
-            cfg.running = False
-            cfg.lock_until = None
-            db.commit()
-    except Exception as e:
-        if job:
-            _finish_job_error(db, job.id, str(e))
-        cfg = db.query(models.MitreSyncConfig).first()
-        if cfg:
-            cfg.running = False
-            cfg.lock_until = None
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=COLLECTION_RESUME_STALE_SECONDS)
+        stale_ids = [
+            job_id
+            for (job_id,) in db.query(models.JobRun.id)
+            .filter(models.JobRun.job_type == "collector")
+            .filter(coordinator_lost(now, stale_before))
+            .order_by(models.JobRun.id)
+            .all()
+        ]
+        for job_id in stale_ids:
+            if not _take_over_collection_job(db, job_id, status="PENDING"):
+                continue
+            print("Collector coordinator lost, re-queueing run:", job_id)
+            job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+            notify(db, "jobs.queued", _job_to_response(job))
             db.commit()
-        raise
+            job_executor.enqueue(job_id, "collector")
     finally:
         db.close()
 
@@ -316,153 +387,316 @@ def _ensure_mitre_seeded():
     db = SessionLocal()
     try:
         existing = db.query(models.Technique.id).limit(1).first()
-        if existing:
+        if not existing:
+            print("MITRE bootstrap: techniques table empty. Running initial sync...")
+            try:
+                result = sync_mitre_from_github(db)
+                print("MITRE bootstrap completed:", result)
+            except Exception as e:
+                print("MITRE bootstrap sync failed, trying legacy loader:", e)
+                load_mitre(db)
+
+        # backfill de technique_tactics en BDs que ya tenían catálogo
+        backfilled = ensure_technique_tactics(db)
+        if backfilled:
+            print(f"MITRE: technique_tactics reconstruida ({backfilled} filas)")
+    finally:
+        db.close()
+
+
+# -------------------------------------------------
+# Jobs encolados desde /admin/* (job_executor)
+# -------------------------------------------------
+def _collector_job(db: Session, job: models.JobRun, params: dict):
+    try:
+        # corrida nueva (sin tareas): planifica y encola; reanudada desde
+        # /admin/run-collector/{job_id}/resume: sigue desde sus checkpoints
+        with _coordinator_heartbeat(db, job.id):
+            summary = resume_collection(
+                db,
+                job.id,
+                progress_callback=job_progress.callback(job.id)
+            )
+    except JobCancelled:
+        db.rollback()
+        cancel_tasks(db, job.id)
+        raise
+    return _collection_details(summary), summary
+
+
+def _actor_scan_job(db: Session, job: models.JobRun, params: dict):
+    actor = db.query(models.ThreatActor).filter(models.ThreatActor.id == params.get("actor_id")).first()
+    if not actor:
+        raise ValueError("actor not found")
+    _update_job(db, job.id, processed_items=0, total_items=1, details=f"scan:{actor.name}:start")
+    result = update_actor_ttps(db, actor)
+    _update_job(db, job.id, processed_items=1, total_items=1, details=f"scan:{actor.name}:{result.get('status')}")
+    if result.get("status") != "ok":
+        raise RuntimeError(str(result.get("error") or "actor scan error"))
+    if actor.active:
+        refresh_country_cube(db, [actor.country])
+    return f"source={result.get('source')} total={result.get('total')}", result
+
+
+def _mitre_sync_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=2, details="load_mitre:start")
+    load_mitre(db)
+    job_executor.raise_if_cancelled(job.id)
+    _update_job(db, job.id, processed_items=1, total_items=2, details="sync_mitre_from_github:start")
+    result = sync_mitre_from_github(db)
+    # las tácticas de las técnicas pueden haber cambiado
+    refresh_country_cube(db)
+    rebuild_tactic_first_seen(db)
+    _update_job(db, job.id, processed_items=2, total_items=2, details="mitre sync done")
+    return f"updated={result.get('updated', 0)} created={result.get('created', 0)}", result
+
+
+def _opencti_sync_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=1, details="opencti_sync:start")
+    result = sync_opencti_actors(db, limit=params.get("limit", 200))
+    _update_job(
+        db,
+        job.id,
+        processed_items=1,
+        total_items=1,
+        details=f"fetched={result.get('fetched', 0)} created={result.get('created', 0)} updated={result.get('updated', 0)}"
+    )
+    return (
+        f"created={result.get('created', 0)} updated={result.get('updated', 0)} unchanged={result.get('unchanged', 0)} skipped={result.get('skipped', 0)}",
+        result
+    )
+
+
+def _misp_sync_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=1, details="misp_sync:start")
+    days = params.get("days")
+    result = sync_misp_attributes(
+        db,
+        limit=params.get("limit", 5000),
+        page_size=params.get("page_size", 500),
+        days=days if days and days > 0 else None
+    )
+    _update_job(db, job.id, processed_items=1, total_items=1, details="misp sync done")
+    return (
+        f"fetched={result.get('fetched', 0)} created={result.get('created', 0)} updated={result.get('updated', 0)}",
+        result
+    )
+
+
+def _risk_snapshot_job(db: Session, job: models.JobRun, params: dict):
+    countries = [
+        c for (c,) in db.query(models.ThreatActor.country)
+        .filter(models.ThreatActor.active == True)
+        .filter(models.ThreatActor.country != None)
+        .distinct()
+        .all()
+    ]
+    _update_job(db, job.id, processed_items=0, total_items=len(countries), details="risk_snapshot:start")
+    evaluate_country_risk(db, countries)
+    db.commit()
+    _update_job(db, job.id, processed_items=len(countries), total_items=len(countries), details="risk_snapshot:done")
+    return f"countries={len(countries)}", {"countries": countries}
+
+
+def _tactic_first_seen_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=1, details="tactic_first_seen:start")
+    rows = rebuild_tactic_first_seen(db)
+    _update_job(db, job.id, processed_items=1, total_items=1, details="tactic_first_seen:done")
+    return f"tactics={rows}", {"tactics": rows}
+
+
+def _risk_state_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=1, details="risk_state:start")
+    rebuild_risk_state(db)
+    _update_job(db, job.id, processed_items=1, total_items=1, details="risk_state:done")
+    return "risk state rebuilt", {"status": "ok"}
+
+
+def _risk_state_sweep_job(db: Session, job: models.JobRun, params: dict):
+    _update_job(db, job.id, processed_items=0, total_items=1, details="risk_state_sweep:start")
+    aged = sweep_risk_state(db)
+    _update_job(db, job.id, processed_items=1, total_items=1, details="risk_state_sweep:done")
+    return f"aged={aged}", {"aged": aged}
+
+
+def _event_rollup_job(db: Session, job: models.JobRun, params: dict):
+    days = params.get("days")
+    _update_job(db, job.id, processed_items=0, total_items=1, details="event_rollup:start")
+    rows = rebuild_event_rollup(db, days=days)
+    _update_job(db, job.id, processed_items=1, total_items=1, details="event_rollup:done")
+    return f"rows={rows} days={days or 'all'}", {"rows": rows, "days": days}
+
+
+_JOB_HANDLERS = {
+    "collector": _collector_job,
+    "actor_scan": _actor_scan_job,
+    "mitre_sync": _mitre_sync_job,
+    "opencti_sync": _opencti_sync_job,
+    "misp_sync": _misp_sync_job,
+    "risk_snapshot": _risk_snapshot_job,
+    "event_rollup": _event_rollup_job,
+    "risk_state": _risk_state_job,
+    "risk_state_sweep": _risk_state_sweep_job,
+    "tactic_first_seen": _tactic_first_seen_job,
+}
+
+
+def _execute_job(job_id: int):
+    """Corre un JobRun PENDING en un hilo del executor; el UPDATE condicional evita correrlo dos veces."""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        claimed = db.query(models.JobRun)\
+            .filter(models.JobRun.id == job_id)\
+            .filter(models.JobRun.status == "PENDING")\
+            .update({"status": "RUNNING", "started_at": now, "updated_at": now}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            # cancelado mientras esperaba, o ya lo tomó otro proceso
             return
 
-        print("MITRE bootstrap: techniques table empty. Running initial sync...")
+        job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+        notify(db, "jobs.started", _job_to_response(job))
+        db.commit()
+
+        handler = _JOB_HANDLERS.get(job.job_type)
         try:
-            result = sync_mitre_from_github(db)
-            print("MITRE bootstrap completed:", result)
+            if handler is None:
+                raise ValueError(f"unknown job type: {job.job_type}")
+            details, result = handler(db, job, _json_or_none(job.params) or {})
+            _finish_job_success(db, job_id, details=details, result=result)
+        except JobCancelled:
+            db.rollback()
+            _finish_job_cancelled(db, job_id)
         except Exception as e:
-            print("MITRE bootstrap sync failed, trying legacy loader:", e)
-            load_mitre(db)
+            db.rollback()
+            print("Job error:", job.job_type, job_id, e)
+            _finish_job_error(db, job_id, str(e))
     finally:
         db.close()
 
 
-def _run_opencti_sync_job(limit: int = 200):
+job_executor.configure(_execute_job)
+
+
+def _enqueue_job(db: Session, job_type: str, params: dict, **kwargs):
+    job, deduplicated = job_executor.submit(db, job_type, params, **kwargs)
+    if not deduplicated:
+        notify(db, "jobs.queued", _job_to_response(job))
+        db.commit()
+    return {
+        "status": "already_queued" if deduplicated else "queued",
+        "job_id": job.id,
+        "job_status": job.status,
+    }
+
+
+def _fire_scheduled_job(db: Session, entry: models.ScheduledJob):
+    """Disparo del scheduler: encola el job (si ya hay uno idéntico activo, no se duplica)."""
+    total_items = 0
+    if entry.job_type == "collector":
+        total_items = db.query(models.ThreatActor).filter_by(active=True).count()
+    job, deduplicated = job_executor.submit(
+        db,
+        entry.job_type,
+        _json_or_none(entry.params) or {},
+        trigger="scheduler",
+        total_items=total_items
+    )
+    if not deduplicated:
+        notify(db, "jobs.queued", _job_to_response(job))
+    return job
+
+
+scheduler = Scheduler(_fire_scheduled_job)
+
+
+def _ensure_schedules():
     db = SessionLocal()
-    job = None
     try:
-        job = _start_job(db, job_type="opencti_sync", trigger="manual", total_items=1)
-        _update_job(db, job.id, processed_items=0, total_items=1, details="opencti_sync:start")
-        result = sync_opencti_actors(db, limit=limit)
-        _update_job(
-            db,
-            job.id,
-            processed_items=1,
-            total_items=1,
-            details=f"fetched={result.get('fetched', 0)} created={result.get('created', 0)} updated={result.get('updated', 0)}"
-        )
-        _finish_job_success(
-            db,
-            job.id,
-            details=f"created={result.get('created', 0)} updated={result.get('updated', 0)} unchanged={result.get('unchanged', 0)} skipped={result.get('skipped', 0)}"
-        )
-        return {"job_id": job.id, **result}
-    except Exception as e:
-        if job:
-            _finish_job_error(db, job.id, str(e))
-        raise
+        ensure_default_schedules(db)
     finally:
         db.close()
 
-async def _scheduler_loop():
-    await asyncio.sleep(3)
-    while True:
-        try:
-            db = SessionLocal()
-            try:
-                cfg = db.query(models.ScheduleConfig).first()
-                if cfg and cfg.enabled and cfg.time_hhmm:
-                    now = datetime.now(BOGOTA_TZ)
-                    today_key = ["mon","tue","wed","thu","fri","sat","sun"][now.weekday()]
-                    days = [d for d in (cfg.days or "").split(",") if d]
-                    time_hhmm = _parse_time_hhmm(cfg.time_hhmm)
-
-                    if time_hhmm and today_key in days and now.strftime("%H:%M") == time_hhmm:
-                        already_ran = False
-                        if cfg.last_run_at:
-                            last_run_bogota = utc_to_bogota(cfg.last_run_at)
-                            already_ran = (
-                                last_run_bogota.date() == now.date() and
-                                last_run_bogota.strftime("%H:%M") == time_hhmm
-                            )
-
-                        if not already_ran:
-                            # Acquire DB lease to avoid duplicate runs across workers
-                            lock_until = datetime.utcnow() + timedelta(minutes=30)
-                            updated = db.query(models.ScheduleConfig)\
-                                .filter(models.ScheduleConfig.id == cfg.id)\
-                                .filter(
-                                    (models.ScheduleConfig.running == False) |
-                                    (models.ScheduleConfig.lock_until == None) |
-                                    (models.ScheduleConfig.lock_until < now)
-                                )\
-                                .update({
-                                    "running": True,
-                                    "lock_until": lock_until
-                                }, synchronize_session=False)
-                            db.commit()
-
-                            if updated == 1 and not _scheduler_lock.locked():
-                                async with _scheduler_lock:
-                                    await asyncio.to_thread(_run_collection_job)
-            finally:
-                db.close()
-        except Exception as e:
-            print("Scheduler error:", e)
 
-        await asyncio.sleep(30)
+def _ensure_country_cube():
+    db = SessionLocal()
+    try:
+        rows = ensure_country_cube(db)
+        if rows:
+            print(f"Cubo país × técnica reconstruido ({rows} filas)")
+    finally:
+        db.close()
+
+
+def _ensure_event_rollup():
+    # BD migrada con eventos previos: los backfills (rollup diario, primera vez por táctica) corren como jobs
+    db = SessionLocal()
+    try:
+        if rollup_is_empty(db):
+            print("Rollup diario vacío: encolando backfill")
+            _enqueue_job(db, "event_rollup", {}, trigger="startup", total_items=1)
+        if first_seen_is_empty(db):
+            print("tactic_first_seen vacía: encolando reconstrucción")
+            _enqueue_job(db, "tactic_first_seen", {}, trigger="startup", total_items=1)
+    finally:
+        db.close()
+
+
+def _refresh_stale_detections():
+    # casos de uso sin evaluar (recién migrados o editados en un proceso que cayó)
+    db = SessionLocal()
+    try:
+        changes = rebuild_detection_matches(db, only_stale=True)
+        if changes:
+            print(f"Detecciones: {len(changes)} cambios al reevaluar casos de uso pendientes")
+    finally:
+        db.close()
+
+
+def _resubmit_pending_jobs():
+    db = SessionLocal()
+    try:
+        count = job_executor.resubmit_pending(db)
+        if count:
+            print(f"Job executor: {count} pending jobs re-queued")
+    finally:
+        db.close()
+
+def _run_collection_worker():
+    db = SessionLocal()
+    try:
+        for job_id in claimable_job_ids(db):
+            while process_collection_tasks(db, job_id):
+                pass
+    finally:
+        db.close()
 
 
-async def _mitre_scheduler_loop():
-    await asyncio.sleep(5)
+async def _collection_worker_loop():
+    await asyncio.sleep(7)
     while True:
         try:
-            db = SessionLocal()
-            try:
-                cfg = db.query(models.MitreSyncConfig).first()
-                if not cfg:
-                    cfg = models.MitreSyncConfig(day_of_week="sun", time_hhmm="03:00", enabled=True)
-                    db.add(cfg)
-                    db.commit()
-                    db.refresh(cfg)
-
-                if cfg.enabled and cfg.time_hhmm:
-                    now = datetime.now(BOGOTA_TZ)
-                    today_key = ["mon","tue","wed","thu","fri","sat","sun"][now.weekday()]
-                    time_hhmm = _parse_time_hhmm(cfg.time_hhmm)
-
-                    if time_hhmm and today_key == (cfg.day_of_week or "sun").lower() and now.strftime("%H:%M") == time_hhmm:
-                        already_ran = False
-                        if cfg.last_run_at:
-                            last_run_bogota = utc_to_bogota(cfg.last_run_at)
-                            already_ran = (
-                                last_run_bogota.date() == now.date() and
-                                last_run_bogota.strftime("%H:%M") == time_hhmm
-                            )
-
-                        if not already_ran:
-                            lock_until = datetime.utcnow() + timedelta(minutes=60)
-                            updated = db.query(models.MitreSyncConfig)\
-                                .filter(models.MitreSyncConfig.id == cfg.id)\
-                                .filter(
-                                    (models.MitreSyncConfig.running == False) |
-                                    (models.MitreSyncConfig.lock_until == None) |
-                                    (models.MitreSyncConfig.lock_until < datetime.utcnow())
-                                )\
-                                .update({
-                                    "running": True,
-                                    "lock_until": lock_until
-                                }, synchronize_session=False)
-                            db.commit()
-
-                            if updated == 1 and not _mitre_lock.locked():
-                                async with _mitre_lock:
-                                    await asyncio.to_thread(_run_mitre_sync_job)
-            finally:
-                db.close()
+            await asyncio.to_thread(_recover_collection_runs)
+            await asyncio.to_thread(_run_collection_worker)
         except Exception as e:
-            print("MITRE scheduler error:", e)
+            print("Collection worker error:", e)
+
+        await asyncio.sleep(COLLECTION_WORKER_POLL_SECONDS)
 
-        await asyncio.sleep(60)
 
 @app.on_event("startup")
 async def start_scheduler():
     await asyncio.to_thread(_ensure_mitre_seeded)
-    asyncio.create_task(_scheduler_loop())
-    asyncio.create_task(_mitre_scheduler_loop())
+    await asyncio.to_thread(_resubmit_pending_jobs)
+    await asyncio.to_thread(_ensure_schedules)
+    await asyncio.to_thread(_refresh_stale_detections)
+    await asyncio.to_thread(_ensure_country_cube)
+    await asyncio.to_thread(_ensure_event_rollup)
+    if SCHEDULER_ENABLED:
+        asyncio.create_task(scheduler.run_forever())
+    if COLLECTION_WORKER_ENABLED:
+        asyncio.create_task(_collection_worker_loop())
 
 
 @app.get("/")
@@ -497,6 +731,82 @@ def get_job(job_id: int, db: Session = Depends(get_db)):
     return _job_to_response(row)
 
 
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    """PENDING: se cancela ya. RUNNING: se detiene en su próximo punto de progreso."""
+    row = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="job not found")
+    if row.status not in ("PENDING", "RUNNING"):
+        raise HTTPException(status_code=409, detail=f"job is already {row.status}")
+
+    row = job_executor.cancel(db, job_id)
+    if row.status == "CANCELLED":
+        notify(db, "jobs.finished", _job_to_response(row))
+        db.commit()
+    return _job_to_response(row)
+
+
+@app.get("/events/stream")
+async def event_stream(request: Request, topics: str | None = None):
+    """
+    Server-Sent Events: jobs.queued / jobs.started / jobs.progress / jobs.finished y alerts.created.
+    topics=jobs,alerts filtra por prefijo. Todas las conexiones del proceso comparten un LISTEN.
+    """
+    wanted = {t.strip() for t in (topics or "").split(",") if t.strip()} or None
+    queue = event_bus.subscribe(asyncio.get_running_loop(), wanted)
+
+    async def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # keep-alive para proxies que cortan conexiones inactivas
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event.get('type', 'message')}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/jobs/{job_id}/progress")
+def get_job_progress(job_id: int, db: Session = Depends(get_db)):
+    live = job_progress.get(job_id)
+    if live:
+        processed_items = live["processed_items"] or 0
+        total_items = live["total_items"] or 0
+        details = live["details"]
+        updated_at = live["updated_at"]
+    else:
+        row = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="job not found")
+        processed_items = row.processed_items or 0
+        total_items = row.total_items or 0
+        details = row.details
+        updated_at = row.updated_at
+
+    return {
+        "job_id": job_id,
+        "live": live is not None,
+        "processed_items": processed_items,
+        "total_items": total_items,
+        "progress_pct": round((processed_items / total_items) * 100, 2) if total_items else None,
+        "details": details,
+        "updated_at": utc_to_bogota(updated_at).isoformat() if updated_at else None,
+    }
+
+
 @app.get("/intel/report-templates", response_model=list[schemas.IntelReportTemplateOut])
 def list_report_templates(db: Session = Depends(get_db)):
     rows = (
@@ -733,7 +1043,8 @@ def list_actors(include_inactive: bool = False, db: Session = Depends(get_db)):
 
     rows = query.all()
     result = []
-    for actor, last_scan_at in rows:
+    for actor, last_collected in rows:
+        last_scan_at = actor.last_scanned_at or last_collected
         result.append({
             "id": actor.id,
             "name": actor.name,
@@ -742,6 +1053,9 @@ def list_actors(include_inactive: bool = False, db: Session = Depends(get_db)):
             "active": actor.active,
             "aliases": actor.aliases,
             "last_scan_at": utc_to_bogota(last_scan_at).isoformat() if last_scan_at else None,
+            "last_scan_status": actor.last_scan_status,
+            "last_scan_decision": actor.last_scan_decision,
+            "last_scan_reason": actor.last_scan_reason,
             "source": actor.source
         })
     return result
@@ -811,6 +1125,8 @@ def import_actors(file: UploadFile = File(...), db: Session = Depends(get_db)):
     updated = 0
     skipped = 0
     conflicts = []
+    # actor -> (país, activo) antes del import; solo los que cambian de país o estado mueven riesgo y casos de uso
+    previous_state = {}
 
     def _cell(row: dict, key: str) -> str:
         original_key = header_by_normalized.get(key)
@@ -840,6 +1156,9 @@ def import_actors(file: UploadFile = File(...), db: Session = Depends(get_db)):
 
         existing = existing_by_gti or existing_by_name
         if existing is not None:
+            if existing.name != name or existing.gti_id != gti_id:
+                crud.invalidate_collection_cache(existing)
+            previous_state.setdefault(existing, (existing.country, existing.active))
             existing.name = name
             existing.gti_id = gti_id
             existing.country = country
@@ -847,16 +1166,32 @@ def import_actors(file: UploadFile = File(...), db: Session = Depends(get_db)):
             existing.active = active
             updated += 1
         else:
-            db.add(models.ThreatActor(
+            actor = models.ThreatActor(
                 name=name,
                 gti_id=gti_id,
                 country=country,
                 aliases=aliases,
                 active=active
-            ))
+            )
+            db.add(actor)
+            previous_state[actor] = (None, False)
             created += 1
 
     try:
+        db.flush()
+        affected_countries = set()
+        for actor, (previous_country, previous_active) in previous_state.items():
+            if (previous_country, previous_active) == (actor.country, actor.active):
+                continue
+            # igual que crud._commit_actor_change, en la misma transacción del import
+            refresh_actor_matches(db, actor.id)
+            apply_actor_move(
+                db,
+                actor.id,
+                previous_country if previous_active else None,
+                actor.country if actor.active else None
+            )
+            affected_countries.update({previous_country, actor.country})
         db.commit()
     except IntegrityError:
         db.rollback()
@@ -864,6 +1199,7 @@ def import_actors(file: UploadFile = File(...), db: Session = Depends(get_db)):
             status_code=400,
             detail="CSV contains duplicated unique values (name or gti_id). Check repeated rows."
         )
+    refresh_country_cube(db, affected_countries)
 
     return {
         "status": "ok",
@@ -1270,26 +1606,15 @@ def scan_actor(actor_id: int, db: Session = Depends(get_db)):
     actor = db.query(models.ThreatActor).filter(models.ThreatActor.id == actor_id).first()
     if not actor:
         return {"error": "actor not found"}
-    job = _start_job(
+    queued = _enqueue_job(
         db,
-        job_type="actor_scan",
-        trigger="manual",
+        "actor_scan",
+        {"actor_id": actor.id},
         actor_id=actor.id,
         actor_name=actor.name,
         total_items=1
     )
-    _update_job(db, job.id, processed_items=0, total_items=1, details=f"scan:{actor.name}:start")
-    try:
-        result = update_actor_ttps(db, actor)
-        _update_job(db, job.id, processed_items=1, total_items=1, details=f"scan:{actor.name}:{result.get('status')}")
-        if result.get("status") == "ok":
-            _finish_job_success(db, job.id, details=f"source={result.get('source')} total={result.get('total')}")
-        else:
-            _finish_job_error(db, job.id, str(result.get("error") or "actor scan error"))
-        return {"status": "ok", "actor_id": actor.id, "job_id": job.id, "result": result}
-    except Exception as e:
-        _finish_job_error(db, job.id, str(e))
-        raise
+    return {**queued, "actor_id": actor.id}
 
 
 @app.post("/admin/load-mitre")
@@ -1300,28 +1625,44 @@ def load_mitre_endpoint(db: Session = Depends(get_db)):
 @app.post("/admin/run-collector")
 def run_collector(db: Session = Depends(get_db)):
     actor_count = db.query(models.ThreatActor).filter_by(active=True).count()
-    job = _start_job(
-        db,
-        job_type="collector",
-        trigger="manual",
-        total_items=actor_count
-    )
+    return _enqueue_job(db, "collector", {}, total_items=actor_count)
+
+
+@app.post("/admin/run-collector/{job_id}/resume")
+def resume_collector(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+    if not job or job.job_type != "collector":
+        raise HTTPException(status_code=404, detail="collector job not found")
     try:
-        summary = run_collection(
-            db,
-            progress_callback=lambda processed_items, total_items, details: _update_job(
-                db,
-                job.id,
-                processed_items=processed_items,
-                total_items=total_items,
-                details=details
-            )
-        )
-        _finish_job_success(db, job.id, details=f"scanned={summary.get('scanned')} skipped={summary.get('skipped')} errors={summary.get('errors')}")
-        return {"status": "collection completed", "job_id": job.id, "summary": summary}
-    except Exception as e:
-        _finish_job_error(db, job.id, str(e))
-        raise
+        taken = _take_over_collection_job(db, job_id, allow_error=True, status="PENDING")
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="another collector job is already active")
+    if not taken:
+        raise HTTPException(status_code=409, detail="collector job is not interrupted")
+
+    job = db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+    notify(db, "jobs.queued", _job_to_response(job))
+    db.commit()
+    job_executor.enqueue(job_id, "collector")
+    return JSONResponse(
+        status_code=202,
+        content={"status": "queued", "job_id": job_id, "job_status": "PENDING"}
+    )
+
+
+@app.post("/admin/rebuild-risk-state")
+def rebuild_risk_state_endpoint(db: Session = Depends(get_db)):
+    return _enqueue_job(db, "risk_state", {}, total_items=1)
+
+
+@app.get("/admin/jobs/executor")
+def job_executor_stats():
+    return job_executor.stats()
+
+
+@app.get("/admin/connectors/stats")
+def connector_stats():
+    return connector_client.stats()
 
 
 @app.post("/admin/run-alerts")
@@ -1365,77 +1706,168 @@ def timeline(actor: str, db: Session = Depends(get_db)):
     return get_actor_timeline(db, actor)
 
 
+def _encode_alert_cursor(created_at: datetime, alert_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{alert_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_alert_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_raw, id_raw = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_raw), int(id_raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+def _bogota_day_start_utc(value: date):
+    local = datetime(value.year, value.month, value.day, tzinfo=BOGOTA_TZ)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _csv_values(value: str | None, upper: bool = False):
+    items = [x.strip() for x in (value or "").split(",") if x.strip()]
+    return [x.upper() for x in items] if upper else items
+
+
 @app.get("/alerts")
-def get_alerts(db: Session = Depends(get_db)):
+def get_alerts(
+    limit: int = 100,
+    cursor: str | None = None,
+    severity: str | None = None,
+    actor_id: int | None = None,
+    technique: str | None = None,
+    tactic: str | None = None,
+    event_type: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Alertas más recientes primero, paginadas por (created_at, id): `next_cursor` se pasa
+    como `cursor` para la página siguiente. El enriquecimiento (ActorTechnique, evidencias,
+    umbrales) se arma con un número fijo de consultas por página.
+    """
+    limit = max(1, min(int(limit), 500))
+    catalog = get_catalog(db)
 
-    alerts = db.query(models.Alert)\
-        .order_by(models.Alert.created_at.desc())\
-        .limit(100)\
-        .all()
+    query = (
+        db.query(
+            models.Alert,
+            models.ThreatActor.name,
+            models.Technique.tech_id,
+            models.Technique.name,
+            models.Technique.tactic
+        )
+        .outerjoin(models.ThreatActor, models.ThreatActor.id == models.Alert.actor_id)
+        .outerjoin(models.Technique, models.Technique.id == models.Alert.technique_id)
+    )
 
-    response = []
+    severities = _csv_values(severity, upper=True)
+    if severities:
+        query = query.filter(models.Alert.severity.in_(severities))
+    if actor_id is not None:
+        query = query.filter(models.Alert.actor_id == actor_id)
+    event_types = _csv_values(event_type, upper=True)
+    if event_types:
+        query = query.filter(models.Alert.event_type.in_(event_types))
+
+    technique_ids = None
+    codes = _csv_values(technique, upper=True)
+    if codes:
+        technique_ids = {e.id for e in (catalog.get(c) for c in codes) if e}
+    if technique_ids is not None:
+        if not technique_ids:
+            return {"items": [], "next_cursor": None}
+        query = query.filter(models.Alert.technique_id.in_(sorted(technique_ids)))
+    if tactic and tactic.strip():
+        query = query.filter(models.Alert.technique_id.in_(technique_ids_for_tactic(db, tactic)))
+
+    if date_from:
+        query = query.filter(models.Alert.created_at >= _bogota_day_start_utc(date_from))
+    if date_to:
+        query = query.filter(models.Alert.created_at < _bogota_day_start_utc(date_to + timedelta(days=1)))
+
+    if cursor:
+        cursor_created_at, cursor_id = _decode_alert_cursor(cursor)
+        query = query.filter(
+            (models.Alert.created_at < cursor_created_at) |
+            ((models.Alert.created_at == cursor_created_at) & (models.Alert.id < cursor_id))
+        )
 
-    for a in alerts:
+    rows = (
+        query
+        .filter(models.Alert.created_at != None)
+        .order_by(models.Alert.created_at.desc(), models.Alert.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    pairs = sorted({(a.actor_id, a.technique_id) for a, *_ in rows if a.actor_id and a.technique_id})
+
+    actor_techniques = {}
+    evidence = {}
+    if pairs:
+        pair_filter = tuple_(models.ActorTechnique.actor_id, models.ActorTechnique.technique_id).in_(pairs)
+        for at in db.query(models.ActorTechnique).filter(pair_filter).all():
+            actor_techniques.setdefault((at.actor_id, at.technique_id), at)
+
+        # top 3 evidencias por (actor, técnica) en una sola consulta
+        ranked = (
+            db.query(
+                models.TechniqueEvidence.actor_id,
+                models.TechniqueEvidence.technique_id,
+                models.TechniqueEvidence.sample_hash,
+                func.row_number().over(
+                    partition_by=(models.TechniqueEvidence.actor_id, models.TechniqueEvidence.technique_id),
+                    order_by=models.TechniqueEvidence.observed_at.desc()
+                ).label("rn")
+            )
+            .filter(tuple_(models.TechniqueEvidence.actor_id, models.TechniqueEvidence.technique_id).in_(pairs))
+            .subquery()
+        )
+        evidence_rows = (
+            db.query(ranked.c.actor_id, ranked.c.technique_id, ranked.c.sample_hash)
+            .filter(ranked.c.rn <= 3)
+            .order_by(ranked.c.actor_id, ranked.c.technique_id, ranked.c.rn)
+            .all()
+        )
+        for ev_actor_id, ev_technique_id, sample_hash in evidence_rows:
+            if sample_hash:
+                evidence.setdefault((ev_actor_id, ev_technique_id), []).append(sample_hash)
 
-        actor_name = a.actor.name if a.actor else None
-        technique_id = a.technique.tech_id if a.technique else None
-        technique_name = a.technique.name if a.technique else None
-        technique_tactic = a.technique.tactic if a.technique else None
+    items = []
+    for a, actor_name, tech_id, technique_name, technique_tactic in rows:
+        key = (a.actor_id, a.technique_id)
+        actor_technique = actor_techniques.get(key)
 
-        actor_technique = None
-        evidence_hashes = []
         first_seen = None
         last_seen = None
         sightings = 0
         seen_days = 0
         thresholds = {"sightings": None, "days": None, "reason": None}
-        event_type = None
-
-        if a.actor_id and a.technique_id:
-            actor_technique = (
-                db.query(models.ActorTechnique)
-                .filter(models.ActorTechnique.actor_id == a.actor_id)
-                .filter(models.ActorTechnique.technique_id == a.technique_id)
-                .first()
-            )
-            if actor_technique:
-                first_seen = utc_to_bogota(actor_technique.first_seen).isoformat() if actor_technique.first_seen else None
-                last_seen = utc_to_bogota(actor_technique.last_seen).isoformat() if actor_technique.last_seen else None
-                sightings = int(actor_technique.sightings_count or 0)
-                seen_days = int(actor_technique.seen_days_count or 0)
-                min_s, min_d, reason = get_confirmation_thresholds(a.technique, technique_id)
-                thresholds = {"sightings": min_s, "days": min_d, "reason": reason}
-
-            ev = (
-                db.query(models.IntelligenceEvent)
-                .filter(models.IntelligenceEvent.actor_id == a.actor_id)
-                .filter(models.IntelligenceEvent.technique_id == a.technique_id)
-                .filter(models.IntelligenceEvent.created_at <= a.created_at)
-                .order_by(models.IntelligenceEvent.created_at.desc())
-                .first()
-            )
-            event_type = ev.event_type if ev else None
-
-            evidence_rows = (
-                db.query(models.TechniqueEvidence.sample_hash)
-                .filter(models.TechniqueEvidence.actor_id == a.actor_id)
-                .filter(models.TechniqueEvidence.technique_id == a.technique_id)
-                .order_by(models.TechniqueEvidence.observed_at.desc())
-                .limit(3)
-                .all()
-            )
-            evidence_hashes = [x[0] for x in evidence_rows if x and x[0]]
+        if actor_technique:
+            first_seen = utc_to_bogota(actor_technique.first_seen).isoformat() if actor_technique.first_seen else None
+            last_seen = utc_to_bogota(actor_technique.last_seen).isoformat() if actor_technique.last_seen else None
+            sightings = int(actor_technique.sightings_count or 0)
+            seen_days = int(actor_technique.seen_days_count or 0)
+            min_s, min_d, reason = get_confirmation_thresholds(catalog.get_by_id(a.technique_id), tech_id)
+            thresholds = {"sightings": min_s, "days": min_d, "reason": reason}
 
-        response.append({
+        items.append({
+            "id": a.id,
+            "actor_id": a.actor_id,
             "actor": actor_name,
-            "technique": technique_id,
+            "technique": tech_id,
             "technique_name": technique_name,
             "tactic": technique_tactic,
             "title": a.title,
             "description": a.description,
             "severity": a.severity,
             "created_at": utc_to_bogota(a.created_at).isoformat() if a.created_at else None,
-            "event_type": event_type,
+            "event_type": a.event_type,
             "first_seen": first_seen,
             "last_seen": last_seen,
             "sightings_count": sightings,
@@ -1443,13 +1875,15 @@ def get_alerts(db: Session = Depends(get_db)):
             "threshold_sightings": thresholds["sightings"],
             "threshold_days": thresholds["days"],
             "threshold_reason": thresholds["reason"],
-            "evidence_hashes": evidence_hashes
+            "evidence_hashes": evidence.get(key, [])
         })
 
-    return response
-
-
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1][0]
+        next_cursor = _encode_alert_cursor(last.created_at, last.id)
 
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @app.get("/intel/adversaries")
@@ -1549,49 +1983,36 @@ def dashboard_attackers_by_label(db: Session = Depends(get_db)):
 
 @app.get("/dashboard/weekly-comparison")
 def weekly_comparison(db: Session = Depends(get_db)):
-    now = datetime.utcnow()
-    start_this = now - timedelta(days=7)
-    start_prev = now - timedelta(days=14)
+    # semanas por día local (Bogotá): últimos 7 días incluyendo hoy vs. los 7 anteriores
+    today = local_today()
+    start_this = today - timedelta(days=6)
+    start_prev = start_this - timedelta(days=7)
+    Daily = models.IntelEventDaily
+
+    def _new_events(start, end):
+        return int(
+            db.query(func.coalesce(func.sum(Daily.events), 0))
+            .filter(Daily.event_type == "NEW")
+            .filter(Daily.day >= start)
+            .filter(Daily.day <= end)
+            .scalar() or 0
+        )
 
-    this_week_new = (
-        db.query(models.IntelligenceEvent)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
-        .filter(models.IntelligenceEvent.created_at >= start_this)
-        .count()
-    )
-    prev_week_new = (
-        db.query(models.IntelligenceEvent)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
-        .filter(models.IntelligenceEvent.created_at >= start_prev)
-        .filter(models.IntelligenceEvent.created_at < start_this)
-        .count()
-    )
+    this_week_new = _new_events(start_this, today)
+    prev_week_new = _new_events(start_prev, start_this - timedelta(days=1))
 
-    tactic_rows_this = (
-        db.query(models.Technique.tactic)
-        .join(models.IntelligenceEvent, models.IntelligenceEvent.technique_id == models.Technique.id)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
-        .filter(models.IntelligenceEvent.created_at >= start_this)
-        .all()
-    )
-    tactic_rows_prev = (
-        db.query(models.Technique.tactic)
-        .join(models.IntelligenceEvent, models.IntelligenceEvent.technique_id == models.Technique.id)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
-        .filter(models.IntelligenceEvent.created_at >= start_prev)
-        .filter(models.IntelligenceEvent.created_at < start_this)
-        .all()
-    )
-
-    def _count_tactics(rows):
-        counter = {}
-        for (tactic_str,) in rows:
-            for t in [x.strip().lower() for x in (tactic_str or "").split(",") if x.strip()]:
-                counter[t] = counter.get(t, 0) + 1
-        return counter
+    def _count_tactics(start, end):
+        query = (
+            db.query(models.TechniqueTactic.tactic, func.sum(Daily.events))
+            .join(Daily, Daily.technique_id == models.TechniqueTactic.technique_id)
+            .filter(Daily.event_type == "NEW")
+            .filter(Daily.day >= start)
+            .filter(Daily.day <= end)
+        )
+        return {t: int(c or 0) for t, c in query.group_by(models.TechniqueTactic.tactic).all()}
 
-    this_counter = _count_tactics(tactic_rows_this)
-    prev_counter = _count_tactics(tactic_rows_prev)
+    this_counter = _count_tactics(start_this, today)
+    prev_counter = _count_tactics(start_prev, start_this - timedelta(days=1))
     all_tactics = sorted(set(this_counter.keys()) | set(prev_counter.keys()))
 
     by_tactic = [
@@ -1619,24 +2040,29 @@ def tactic_chains(days: int = 7, db: Session = Depends(get_db)):
     since = datetime.utcnow() - timedelta(days=days)
     critical = {"initial-access", "privilege-escalation", "command-and-control", "lateral-movement"}
 
+    # una fila por (actor, táctica)
     rows = (
-        db.query(models.ThreatActor.name, models.Technique.tactic, models.ActorTechnique.last_seen)
+        db.query(
+            models.ThreatActor.name,
+            models.TechniqueTactic.tactic,
+            func.max(models.ActorTechnique.last_seen)
+        )
         .join(models.ActorTechnique, models.ActorTechnique.actor_id == models.ThreatActor.id)
-        .join(models.Technique, models.Technique.id == models.ActorTechnique.technique_id)
+        .join(models.TechniqueTactic, models.TechniqueTactic.technique_id == models.ActorTechnique.technique_id)
         .filter(models.ThreatActor.active == True)
         .filter(models.ActorTechnique.active == True)
         .filter(models.ActorTechnique.last_seen >= since)
+        .group_by(models.ThreatActor.name, models.TechniqueTactic.tactic)
         .all()
     )
 
     by_actor = {}
-    for actor_name, tactic_str, last_seen in rows:
+    for actor_name, tactic, last_seen in rows:
         if actor_name not in by_actor:
             by_actor[actor_name] = {"tactics": set(), "last_seen": last_seen}
         if last_seen and (by_actor[actor_name]["last_seen"] is None or last_seen > by_actor[actor_name]["last_seen"]):
             by_actor[actor_name]["last_seen"] = last_seen
-        for t in [x.strip().lower() for x in (tactic_str or "").split(",") if x.strip()]:
-            by_actor[actor_name]["tactics"].add(t)
+        by_actor[actor_name]["tactics"].add(tactic)
 
     chains = []
     for actor_name, info in by_actor.items():
@@ -1709,79 +2135,67 @@ def new_tactics_today(limit: int = 20, db: Session = Depends(get_db)):
     limit = max(1, min(int(limit), 100))
 
     now_bogota = datetime.now(BOGOTA_TZ)
+    today = now_bogota.date()
     start_bogota = now_bogota.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_bogota = start_bogota + timedelta(days=1)
-
     start_utc = start_bogota.astimezone(timezone.utc).replace(tzinfo=None)
-    end_utc = end_bogota.astimezone(timezone.utc).replace(tzinfo=None)
-
-    # Todas las detecciones NEW para construir primera vez histórica por táctica
-    historical_rows = (
-        db.query(models.Technique.tactic, models.IntelligenceEvent.created_at)
-        .join(models.IntelligenceEvent, models.IntelligenceEvent.technique_id == models.Technique.id)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
+    end_utc = (start_bogota + timedelta(days=1)).astimezone(timezone.utc).replace(tzinfo=None)
+    Daily = models.IntelEventDaily
+
+    # Tácticas cuya primera detección NEW histórica cae hoy (índice tactic_first_seen.first_seen_at)
+    first_rows = (
+        db.query(models.TacticFirstSeen, models.ThreatActor.name, models.Technique.tech_id)
+        .outerjoin(models.ThreatActor, models.ThreatActor.id == models.TacticFirstSeen.actor_id)
+        .outerjoin(models.Technique, models.Technique.id == models.TacticFirstSeen.technique_id)
+        .filter(models.TacticFirstSeen.first_seen_at >= start_utc)
+        .filter(models.TacticFirstSeen.first_seen_at < end_utc)
         .all()
     )
-
-    first_seen_by_tactic = {}
-    for tactic_str, created_at in historical_rows:
-        if not tactic_str or not created_at:
-            continue
-        tactics = [t.strip().lower() for t in tactic_str.split(",") if t.strip()]
-        for t in tactics:
-            prev = first_seen_by_tactic.get(t)
-            if prev is None or created_at < prev:
-                first_seen_by_tactic[t] = created_at
-
-    # Detecciones NEW solo de hoy (hora Bogotá)
-    today_rows = (
-        db.query(
-            models.Technique.tactic,
-            models.Technique.tech_id,
-            models.Technique.name,
-            models.ThreatActor.name,
-            models.IntelligenceEvent.created_at
+    first_seen_by_tactic = {fs.tactic: (fs, actor_name, tech_id) for fs, actor_name, tech_id in first_rows}
+
+    new_events_today = (
+        db.query(func.coalesce(func.sum(Daily.events), 0))
+        .filter(Daily.event_type == "NEW")
+        .filter(Daily.day == today)
+        .scalar()
+    ) or 0
+
+    # Filas NEW de hoy (actor × técnica), solo de esas tácticas
+    today_rows = []
+    if first_seen_by_tactic:
+        today_rows = (
+            db.query(
+                models.TechniqueTactic.tactic,
+                models.Technique.tech_id,
+                models.Technique.name,
+                models.ThreatActor.name,
+                Daily.first_at
+            )
+            .join(models.Technique, models.Technique.id == models.TechniqueTactic.technique_id)
+            .join(Daily, Daily.technique_id == models.Technique.id)
+            .join(models.ThreatActor, models.ThreatActor.id == Daily.actor_id)
+            .filter(models.TechniqueTactic.tactic.in_(list(first_seen_by_tactic)))
+            .filter(Daily.event_type == "NEW")
+            .filter(Daily.day == today)
+            .all()
         )
-        .join(models.IntelligenceEvent, models.IntelligenceEvent.technique_id == models.Technique.id)
-        .join(models.ThreatActor, models.ThreatActor.id == models.IntelligenceEvent.actor_id)
-        .filter(models.IntelligenceEvent.event_type == "NEW")
-        .filter(models.IntelligenceEvent.created_at >= start_utc)
-        .filter(models.IntelligenceEvent.created_at < end_utc)
-        .all()
-    )
 
     by_tactic = {}
-    for tactic_str, tech_id, tech_name, actor_name, created_at in today_rows:
-        if not tactic_str:
-            continue
-        tactics = [t.strip().lower() for t in tactic_str.split(",") if t.strip()]
-        for t in tactics:
-            if t not in by_tactic:
-                by_tactic[t] = {
-                    "tactic": t,
-                    "first_seen_at": created_at,
-                    "actors": set(),
-                    "techniques": {},
-                }
-            by_tactic[t]["actors"].add(actor_name)
-            if tech_id:
-                by_tactic[t]["techniques"][tech_id] = tech_name
-            if created_at and created_at < by_tactic[t]["first_seen_at"]:
-                by_tactic[t]["first_seen_at"] = created_at
+    for t, tech_id, tech_name, actor_name, _ in today_rows:
+        if t not in by_tactic:
+            by_tactic[t] = {"tactic": t, "actors": set(), "techniques": {}}
+        by_tactic[t]["actors"].add(actor_name)
+        if tech_id:
+            by_tactic[t]["techniques"][tech_id] = tech_name
 
     items = []
     for tactic, data in by_tactic.items():
-        first_seen = first_seen_by_tactic.get(tactic)
-        if not first_seen:
-            continue
-        # Solo tácticas que históricamente aparecen por primera vez hoy
-        if not (start_utc <= first_seen < end_utc):
-            continue
-
+        first_seen, first_actor, first_technique = first_seen_by_tactic[tactic]
         items.append({
             "tactic": tactic,
             "label": " ".join([w.capitalize() for w in tactic.split("-")]),
-            "first_seen_at": utc_to_bogota(data["first_seen_at"]).isoformat() if data["first_seen_at"] else None,
+            "first_seen_at": utc_to_bogota(first_seen.first_seen_at).isoformat() if first_seen.first_seen_at else None,
+            "first_actor": first_actor,
+            "first_technique": first_technique,
             "actor_count": len(data["actors"]),
             "technique_count": len(data["techniques"]),
             "actors": sorted(list(data["actors"]))[:5],
@@ -1797,7 +2211,7 @@ def new_tactics_today(limit: int = 20, db: Session = Depends(get_db)):
     return {
         "date": now_bogota.strftime("%Y-%m-%d"),
         "new_tactics_count": len(items),
-        "new_events_today": len(today_rows),
+        "new_events_today": int(new_events_today),
         "items": items
     }
 
@@ -1844,24 +2258,22 @@ def risk_trend(db: Session = Depends(get_db)):
 
 @app.get("/dashboard/timeline")
 def dashboard_timeline(days: int = 30, db: Session = Depends(get_db)):
-    since = datetime.utcnow() - timedelta(days=max(1, days))
-    events = (
-        db.query(models.IntelligenceEvent)
-        .filter(models.IntelligenceEvent.created_at >= since)
-        .order_by(models.IntelligenceEvent.created_at.asc())
+    # rango de días locales sobre el rollup (days=30 son 30 buckets, hoy incluido): ~3 filas por día tras el GROUP BY
+    since_day = local_today() - timedelta(days=max(1, days) - 1)
+    rows = (
+        db.query(models.IntelEventDaily.day, models.IntelEventDaily.event_type, func.sum(models.IntelEventDaily.events))
+        .filter(models.IntelEventDaily.day >= since_day)
+        .group_by(models.IntelEventDaily.day, models.IntelEventDaily.event_type)
         .all()
     )
 
     buckets = {}
-    for e in events:
-        dt = utc_to_bogota(e.created_at)
-        if not dt:
-            continue
-        key = dt.strftime("%Y-%m-%d")
+    for day, event_type, count in rows:
+        key = day.strftime("%Y-%m-%d")
         if key not in buckets:
             buckets[key] = {"date": key, "NEW": 0, "REACTIVATED": 0, "DISAPPEARED": 0}
-        if e.event_type in buckets[key]:
-            buckets[key][e.event_type] += 1
+        if event_type in buckets[key]:
+            buckets[key][event_type] += int(count or 0)
 
     return [buckets[k] for k in sorted(buckets.keys())]
 
@@ -1928,20 +2340,41 @@ def ttp_scatter(days: int = 30, limit: int = 200, db: Session = Depends(get_db))
 # =====================================================
 # SCHEDULE CONFIG (GLOBAL)
 # =====================================================
+def _get_scheduled_job(db: Session, name: str):
+    entry = db.query(models.ScheduledJob).filter(models.ScheduledJob.name == name).first()
+    if not entry:
+        ensure_default_schedules(db)
+        entry = db.query(models.ScheduledJob).filter(models.ScheduledJob.name == name).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="schedule not found")
+    return entry
+
+
+def _scheduled_job_to_response(entry: models.ScheduledJob):
+    return {
+        "name": entry.name,
+        "job_type": entry.job_type,
+        "params": _json_or_none(entry.params) or {},
+        "days": parse_days(entry.days),
+        "time_hhmm": entry.time_hhmm,
+        "interval_minutes": entry.interval_minutes,
+        "enabled": entry.enabled,
+        "catch_up": entry.catch_up,
+        "next_run_at": utc_to_bogota(entry.next_run_at).isoformat() if entry.next_run_at else None,
+        "last_run_at": utc_to_bogota(entry.last_run_at).isoformat() if entry.last_run_at else None,
+        "last_job_id": entry.last_job_id,
+    }
+
+
 @app.get("/schedule")
 def get_schedule(db: Session = Depends(get_db)):
-    cfg = db.query(models.ScheduleConfig).first()
-    if not cfg:
-        cfg = models.ScheduleConfig(time_hhmm="06:00", days="mon,tue,wed,thu,fri", enabled=True)
-        db.add(cfg)
-        db.commit()
-        db.refresh(cfg)
-    days = [d for d in (cfg.days or "").split(",") if d]
+    entry = _get_scheduled_job(db, "collector")
     return {
-        "time_hhmm": cfg.time_hhmm,
-        "days": days,
-        "enabled": cfg.enabled,
-        "last_run_at": utc_to_bogota(cfg.last_run_at).isoformat() if cfg.last_run_at else None
+        "time_hhmm": entry.time_hhmm,
+        "days": parse_days(entry.days),
+        "enabled": entry.enabled,
+        "last_run_at": utc_to_bogota(entry.last_run_at).isoformat() if entry.last_run_at else None,
+        "next_run_at": utc_to_bogota(entry.next_run_at).isoformat() if entry.next_run_at else None
     }
 
 
@@ -1950,17 +2383,12 @@ def update_schedule(payload: schemas.ScheduleUpdate, db: Session = Depends(get_d
     time_hhmm = _parse_time_hhmm((payload.time_hhmm or "").strip())
     if not time_hhmm:
         raise HTTPException(status_code=400, detail="time_hhmm must be in HH:MM 24h format")
-    days = ",".join([d.lower() for d in payload.days])
 
-    cfg = db.query(models.ScheduleConfig).first()
-    if not cfg:
-        cfg = models.ScheduleConfig()
-        db.add(cfg)
-
-    cfg.time_hhmm = time_hhmm
-    cfg.days = days
-    cfg.enabled = bool(payload.enabled)
-    cfg.updated_at = datetime.utcnow()
+    entry = _get_scheduled_job(db, "collector")
+    entry.time_hhmm = time_hhmm
+    entry.days = ",".join([d.lower() for d in payload.days])
+    entry.enabled = bool(payload.enabled)
+    reschedule(db, entry)
     db.commit()
 
     return {"status": "ok"}
@@ -1971,17 +2399,14 @@ def update_schedule(payload: schemas.ScheduleUpdate, db: Session = Depends(get_d
 # =====================================================
 @app.get("/mitre/schedule")
 def get_mitre_schedule(db: Session = Depends(get_db)):
-    cfg = db.query(models.MitreSyncConfig).first()
-    if not cfg:
-        cfg = models.MitreSyncConfig(day_of_week="sun", time_hhmm="03:00", enabled=True)
-        db.add(cfg)
-        db.commit()
-        db.refresh(cfg)
+    entry = _get_scheduled_job(db, "mitre_sync")
+    days = parse_days(entry.days)
     return {
-        "day_of_week": cfg.day_of_week,
-        "time_hhmm": cfg.time_hhmm,
-        "enabled": cfg.enabled,
-        "last_run_at": utc_to_bogota(cfg.last_run_at).isoformat() if cfg.last_run_at else None
+        "day_of_week": days[0] if days else "sun",
+        "time_hhmm": entry.time_hhmm,
+        "enabled": entry.enabled,
+        "last_run_at": utc_to_bogota(entry.last_run_at).isoformat() if entry.last_run_at else None,
+        "next_run_at": utc_to_bogota(entry.next_run_at).isoformat() if entry.next_run_at else None
     }
 
 
@@ -1994,41 +2419,79 @@ def update_mitre_schedule(day_of_week: str, time_hhmm: str, enabled: bool = True
     if not time_hhmm:
         raise HTTPException(status_code=400, detail="time_hhmm must be in HH:MM 24h format")
 
-    cfg = db.query(models.MitreSyncConfig).first()
-    if not cfg:
-        cfg = models.MitreSyncConfig()
-        db.add(cfg)
-
-    cfg.day_of_week = day
-    cfg.time_hhmm = time_hhmm
-    cfg.enabled = bool(enabled)
-    cfg.updated_at = datetime.utcnow()
+    entry = _get_scheduled_job(db, "mitre_sync")
+    entry.days = day
+    entry.time_hhmm = time_hhmm
+    entry.enabled = bool(enabled)
+    reschedule(db, entry)
     db.commit()
 
     return {"status": "ok"}
 
 
+# =====================================================
+# SCHEDULED JOBS (todas las programaciones)
+# =====================================================
+@app.get("/schedules")
+def list_schedules(db: Session = Depends(get_db)):
+    ensure_default_schedules(db)
+    rows = db.query(models.ScheduledJob).order_by(models.ScheduledJob.name).all()
+    return [_scheduled_job_to_response(r) for r in rows]
+
+
+@app.put("/schedules/{name}")
+def update_scheduled_job(name: str, payload: schemas.ScheduledJobUpdate, db: Session = Depends(get_db)):
+    entry = _get_scheduled_job(db, name)
+
+    if payload.time_hhmm is not None:
+        time_hhmm = _parse_time_hhmm(payload.time_hhmm.strip())
+        if not time_hhmm:
+            raise HTTPException(status_code=400, detail="time_hhmm must be in HH:MM 24h format")
+        entry.time_hhmm = time_hhmm
+    if payload.days is not None:
+        days = [d.lower() for d in payload.days]
+        if any(d not in ["mon","tue","wed","thu","fri","sat","sun"] for d in days):
+            raise HTTPException(status_code=400, detail="days must be mon..sun")
+        entry.days = ",".join(days)
+    if payload.interval_minutes is not None:
+        if payload.interval_minutes < 0:
+            raise HTTPException(status_code=400, detail="interval_minutes must be >= 0")
+        # 0 vuelve al disparo diario a time_hhmm
+        entry.interval_minutes = payload.interval_minutes or None
+    if payload.enabled is not None:
+        entry.enabled = bool(payload.enabled)
+    if payload.catch_up is not None:
+        entry.catch_up = bool(payload.catch_up)
+    if payload.params is not None:
+        entry.params = json.dumps(payload.params)
+
+    reschedule(db, entry)
+    db.commit()
+    db.refresh(entry)
+    return _scheduled_job_to_response(entry)
+
+
+@app.post("/admin/rebuild-event-rollup")
+def rebuild_event_rollup_now(days: int | None = None, db: Session = Depends(get_db)):
+    """Backfill de intel_event_daily (days=None: todo el historial)."""
+    params = {"days": max(0, int(days))} if days is not None else {}
+    return _enqueue_job(db, "event_rollup", params, total_items=1)
+
+
+@app.post("/admin/rebuild-tactic-first-seen")
+def rebuild_tactic_first_seen_now(db: Session = Depends(get_db)):
+    return _enqueue_job(db, "tactic_first_seen", {}, total_items=1)
+
+
 @app.post("/admin/update-mitre")
 def update_mitre_now(db: Session = Depends(get_db)):
-    job = _start_job(db, job_type="mitre_sync", trigger="manual", total_items=2)
-    try:
-        _update_job(db, job.id, processed_items=0, total_items=2, details="load_mitre:start")
-        load_mitre(db)
-        _update_job(db, job.id, processed_items=1, total_items=2, details="sync_mitre_from_github:start")
-        result = sync_mitre_from_github(db)
-        _update_job(db, job.id, processed_items=2, total_items=2, details="mitre sync done")
-        _finish_job_success(db, job.id, details=f"updated={result.get('updated', 0)} created={result.get('created', 0)}")
-        return {"status": "ok", "job_id": job.id, **result}
-    except Exception as e:
-        _finish_job_error(db, job.id, str(e))
-        raise
+    return _enqueue_job(db, "mitre_sync", {}, total_items=2)
 
 
 @app.post("/admin/sync-opencti")
-def sync_opencti_now(limit: int = 200):
+def sync_opencti_now(limit: int = 200, db: Session = Depends(get_db)):
     limit = max(1, min(int(limit), 1000))
-    result = _run_opencti_sync_job(limit=limit)
-    return {"status": "ok", **result}
+    return _enqueue_job(db, "opencti_sync", {"limit": limit}, total_items=1)
 
 
 @app.post("/admin/sync-misp")
@@ -2044,13 +2507,7 @@ def sync_misp_now(
     if days < 0:
         raise HTTPException(status_code=400, detail="days must be >= 0")
 
-    result = sync_misp_attributes(
-        db,
-        limit=limit,
-        page_size=page_size,
-        days=days if days > 0 else None
-    )
-    return {"status": "ok", **result}
+    return _enqueue_job(db, "misp_sync", {"limit": limit, "days": days, "page_size": page_size}, total_items=1)
 
 
 _IOC_SOURCE_ORDER = ["TweetFeed", "GTI/Mandiant", "AlertaDeInteligenciaDeAmenazas", "Otro"]
@@ -2178,11 +2635,22 @@ def top_ttps(limit: int = 10, recency_days: int = 30, suppress_noise: bool = Tru
         "resource-development": 0.50
     }
 
+    # peso de la técnica = máximo entre sus tácticas, resuelto en BD
+    weight_by_technique = (
+        db.query(
+            models.TechniqueTactic.technique_id.label("technique_id"),
+            func.max(case(tactic_weights, value=models.TechniqueTactic.tactic, else_=0.60)).label("tactic_weight")
+        )
+        .group_by(models.TechniqueTactic.technique_id)
+        .subquery()
+    )
+
     rows = (
         db.query(
             models.Technique.tech_id,
             models.Technique.name,
             models.Technique.tactic,
+            weight_by_technique.c.tactic_weight,
             func.count(func.distinct(models.ActorTechnique.actor_id)).label("actor_count"),
             func.sum(
                 case(
@@ -2198,18 +2666,24 @@ def top_ttps(limit: int = 10, recency_days: int = 30, suppress_noise: bool = Tru
             func.max(models.ActorTechnique.last_seen).label("last_seen"),
         )
         .join(models.ActorTechnique, models.ActorTechnique.technique_id == models.Technique.id)
+        .outerjoin(weight_by_technique, weight_by_technique.c.technique_id == models.Technique.id)
         .filter(models.ActorTechnique.active == True)
-        .group_by(models.Technique.id, models.Technique.tech_id, models.Technique.name, models.Technique.tactic)
+        .group_by(
+            models.Technique.id,
+            models.Technique.tech_id,
+            models.Technique.name,
+            models.Technique.tactic,
+            weight_by_technique.c.tactic_weight
+        )
         .all()
     )
 
     ranked = []
-    for tech_id, name, tactic, actor_count, stable_actor_count, observations, last_seen in rows:
+    for tech_id, name, tactic, tactic_weight, actor_count, stable_actor_count, observations, last_seen in rows:
         if suppress_noise and int(stable_actor_count or 0) == 0:
             continue
 
-        tactic_names = [t.strip().lower() for t in (tactic or "").split(",") if t.strip()]
-        tactic_weight = max([tactic_weights.get(t, 0.60) for t in tactic_names], default=0.60)
+        tactic_weight = float(tactic_weight) if tactic_weight is not None else 0.60
 
         if last_seen:
             days_since_seen = (datetime.utcnow() - last_seen).days
@@ -2267,36 +2741,7 @@ def risk_timeline(country: str = "CO", db: Session = Depends(get_db)):
 @app.get("/dashboard/tactics")
 def tactics_distribution(country: str = "CO", db: Session = Depends(get_db)):
 
-    actors = db.query(models.ThreatActor)\
-        .filter_by(country=country, active=True)\
-        .all()
-
-    actor_ids = [a.id for a in actors]
-
-    rows = db.query(models.Technique.tactic)\
-        .join(models.ActorTechnique, models.ActorTechnique.technique_id == models.Technique.id)\
-        .filter(models.ActorTechnique.actor_id.in_(actor_ids))\
-        .filter(models.ActorTechnique.active == True)\
-        .all()
-
-    counter = {}
-
-    for (tactic_str,) in rows:
-
-        if not tactic_str:
-            continue
-
-        tactics = tactic_str.split(",")
-
-        for t in tactics:
-            t = t.strip()
-
-            if t not in counter:
-                counter[t] = 0
-
-            counter[t] += 1
-
-    return counter
+    return tactic_totals(db, country)
 
 # =====================================================
 # MITRE MATRIX (GLOBAL / BY ACTOR)
@@ -2305,41 +2750,43 @@ def tactics_distribution(country: str = "CO", db: Session = Depends(get_db)):
 def mitre_matrix(actor_id: int | None = None, limit: int = 200, db: Session = Depends(get_db)):
     limit = max(1, min(int(limit), 500))
 
+    actor_count = func.count(func.distinct(models.ActorTechnique.actor_id))
     query = (
         db.query(
-            models.Technique,
-            func.count(func.distinct(models.ActorTechnique.actor_id)).label("actor_count")
+            models.ActorTechnique.technique_id.label("technique_id"),
+            actor_count.label("actor_count")
         )
-        .join(models.ActorTechnique, models.ActorTechnique.technique_id == models.Technique.id)
         .filter(models.ActorTechnique.active == True)
     )
 
     if actor_id:
         query = query.filter(models.ActorTechnique.actor_id == actor_id)
 
-    rows = (
-        query.group_by(models.Technique.id)
-        .order_by(func.count(func.distinct(models.ActorTechnique.actor_id)).desc())
+    # top técnicas primero, luego una fila por cada táctica de esas técnicas
+    top = (
+        query.group_by(models.ActorTechnique.technique_id)
+        .order_by(actor_count.desc())
         .limit(limit)
+        .subquery()
+    )
+    rows = (
+        db.query(models.TechniqueTactic.tactic, models.Technique.tech_id, models.Technique.name, top.c.actor_count)
+        .join(models.TechniqueTactic, models.TechniqueTactic.technique_id == top.c.technique_id)
+        .join(models.Technique, models.Technique.id == top.c.technique_id)
+        .order_by(top.c.actor_count.desc(), models.Technique.tech_id, models.TechniqueTactic.tactic)
         .all()
     )
 
-    items = []
-    for technique, actor_count in rows:
-        tactics = (technique.tactic or "").split(",")
-        for t in tactics:
-            t = t.strip().lower()
-            if not t:
-                continue
-            items.append({
-                "tactic": t,
-                "technique": technique.tech_id,
-                "name": technique.name,
-                "count": int(actor_count),
-                "actor_count": int(actor_count)
-            })
-
-    return items
+    return [
+        {
+            "tactic": tactic,
+            "technique": tech_id,
+            "name": name,
+            "count": int(count),
+            "actor_count": int(count)
+        }
+        for tactic, tech_id, name, count in rows
+    ]
 
 
 @app.get("/techniques/{tech_id}")
@@ -2439,6 +2886,8 @@ def create_use_case(payload: dict = Body(...), db: Session = Depends(get_db)):
         updated_at=datetime.utcnow()
     )
     db.add(uc)
+    db.flush()
+    refresh_use_case_matches(db, uc.id)
     db.commit()
     db.refresh(uc)
     return {"status": "ok", "id": uc.id}
@@ -2474,6 +2923,8 @@ def update_use_case(use_case_id: int, payload: dict = Body(...), db: Session = D
         uc.country_scope = (payload.get("country_scope") or "").strip() or None
 
     uc.updated_at = datetime.utcnow()
+    db.flush()
+    refresh_use_case_matches(db, use_case_id)
     db.commit()
     return {"status": "ok"}
 
@@ -2485,6 +2936,9 @@ def delete_use_case(use_case_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="use case not found")
 
     db.query(models.DetectionCondition).filter(models.DetectionCondition.use_case_id == use_case_id).delete(synchronize_session=False)
+    # sin condiciones no queda ningún match: se borran y quedan como LEFT en el feed
+    refresh_use_case_matches(db, use_case_id)
+    db.flush()
     db.delete(uc)
     db.commit()
     return {"status": "ok"}
@@ -2551,6 +3005,8 @@ def create_condition(use_case_id: int, payload: dict = Body(...), db: Session =
     )
     db.add(cond)
     uc.updated_at = datetime.utcnow()
+    db.flush()
+    refresh_use_case_matches(db, use_case_id)
     db.commit()
     db.refresh(cond)
     return {"status": "ok", "id": cond.id}
@@ -2581,6 +3037,8 @@ def update_condition(condition_id: int, payload: dict = Body(...), db: Session =
     uc = db.query(models.DetectionUseCase).filter(models.DetectionUseCase.id == cond.use_case_id).first()
     if uc:
         uc.updated_at = datetime.utcnow()
+    db.flush()
+    refresh_use_case_matches(db, cond.use_case_id)
     db.commit()
     return {"status": "ok"}
 
@@ -2591,87 +3049,109 @@ def delete_condition(condition_id: int, db: Session = Depends(get_db)):
     if not cond:
         raise HTTPException(status_code=404, detail="condition not found")
     uc = db.query(models.DetectionUseCase).filter(models.DetectionUseCase.id == cond.use_case_id).first()
+    use_case_id = cond.use_case_id
     db.delete(cond)
     if uc:
         uc.updated_at = datetime.utcnow()
+    db.flush()
+    refresh_use_case_matches(db, use_case_id)
     db.commit()
     return {"status": "ok"}
 
 
+def _isoformat_bogota(dt):
+    return utc_to_bogota(dt).isoformat() if dt else None
+
+
 @app.get("/detections/use-cases/{use_case_id}/matches")
 def use_case_matches(use_case_id: int, db: Session = Depends(get_db)):
     uc = db.query(models.DetectionUseCase).filter(models.DetectionUseCase.id == use_case_id).first()
     if not uc:
         raise HTTPException(status_code=404, detail="use case not found")
 
-    conditions = db.query(models.DetectionCondition).filter(models.DetectionCondition.use_case_id == use_case_id).all()
-    if not conditions:
-        return {"use_case_id": use_case_id, "matches": []}
-
-    actors_query = db.query(models.ThreatActor).filter(models.ThreatActor.active == True)
-    if uc.country_scope:
-        actors_query = actors_query.filter(models.ThreatActor.country == uc.country_scope)
-    actors = actors_query.all()
-
-    matches = []
-    for actor in actors:
-        passed = []
-        for cond in conditions:
-            q = (
-                db.query(models.ActorTechnique, models.Technique)
-                .join(models.Technique, models.Technique.id == models.ActorTechnique.technique_id)
-                .filter(models.ActorTechnique.actor_id == actor.id)
-                .filter(models.ActorTechnique.active == True)
-            )
-            if cond.technique_id:
-                q = q.filter(models.ActorTechnique.technique_id == cond.technique_id)
-            if cond.tactic:
-                q = q.filter(models.Technique.tactic.ilike(f"%{cond.tactic}%"))
-            if cond.procedure:
-                proc = f"%{cond.procedure}%"
-                q = q.filter(
-                    (models.Technique.name.ilike(proc)) |
-                    (models.Technique.description.ilike(proc))
-                )
+    if not uc.enabled:
+        # deshabilitado: no tiene matches persistidos, se evalúa en vivo como vista previa
+        results = match_use_cases(db, use_case_ids=[use_case_id], to_local=_isoformat_bogota)
+        matches = results[0]["matches"] if results else []
+    else:
+        _ensure_matches_fresh(db, [uc])
+        matches = stored_matches(db, [use_case_id])[use_case_id]
+    return {"use_case_id": uc.id, "use_case_name": uc.name, "matches": matches}
 
-            rows = q.all()
-            ok_rows = []
-            for at, t in rows:
-                sightings = int(at.sightings_count or 0)
-                days = int(at.seen_days_count or 0)
-                if sightings >= cond.min_sightings and days >= cond.min_days:
-                    ok_rows.append({
-                        "technique": t.tech_id if t else None,
-                        "technique_name": t.name if t else None,
-                        "tactic": t.tactic if t else None,
-                        "sightings_count": sightings,
-                        "seen_days_count": days,
-                        "last_seen": utc_to_bogota(at.last_seen).isoformat() if at.last_seen else None
-                    })
-
-            if ok_rows:
-                passed.append({
-                    "condition_id": cond.id,
-                    "tactic": cond.tactic,
-                    "technique_id": cond.technique_id,
-                    "procedure": cond.procedure,
-                    "min_sightings": cond.min_sightings,
-                    "min_days": cond.min_days,
-                    "evidence": ok_rows[:5]
-                })
-
-        if len(passed) == len(conditions):
-            matches.append({
-                "actor_id": actor.id,
-                "actor": actor.name,
-                "country": actor.country,
-                "matched_conditions": len(passed),
-                "total_conditions": len(conditions),
-                "details": passed
-            })
 
-    matches.sort(key=lambda x: x["matched_conditions"], reverse=True)
-    return {"use_case_id": uc.id, "use_case_name": uc.name, "matches": matches}
+def _ensure_matches_fresh(db: Session, use_cases):
+    # casos de uso nunca evaluados o editados sin reevaluar (p. ej. justo después de migrar)
+    stale = [
+        uc.id for uc in use_cases
+        if not uc.matches_refreshed_at or (uc.updated_at and uc.matches_refreshed_at < uc.updated_at)
+    ]
+    for use_case_id in stale:
+        refresh_use_case_matches(db, use_case_id)
+    if stale:
+        db.commit()
+
+
+@app.get("/detections/matches")
+def all_use_case_matches(include_disabled: bool = False, db: Session = Depends(get_db)):
+    """Matches de todos los casos de uso leídos de detection_matches (los deshabilitados, en vivo)."""
+    use_cases = db.query(models.DetectionUseCase).order_by(models.DetectionUseCase.id).all()
+    enabled = [uc for uc in use_cases if uc.enabled]
+    _ensure_matches_fresh(db, enabled)
+    stored = stored_matches(db, [uc.id for uc in enabled])
+
+    live = {}
+    disabled_ids = [uc.id for uc in use_cases if not uc.enabled]
+    if include_disabled and disabled_ids:
+        live = {
+            r["use_case_id"]: r["matches"]
+            for r in match_use_cases(db, use_case_ids=disabled_ids, to_local=_isoformat_bogota)
+        }
+
+    return [
+        {
+            "use_case_id": uc.id,
+            "use_case_name": uc.name,
+            "severity": uc.severity,
+            "matches": stored.get(uc.id, []) if uc.enabled else live.get(uc.id, [])
+        }
+        for uc in use_cases
+        if uc.enabled or include_disabled
+    ]
+
+
+@app.get("/detections/changes")
+def detection_changes(after_id: int = 0, use_case_id: int | None = None, limit: int = 200, db: Session = Depends(get_db)):
+    """Feed de actores que entran (ENTERED) o salen (LEFT) de un caso de uso, paginado por id."""
+    limit = max(1, min(limit, 1000))
+    query = (
+        db.query(models.DetectionMatchEvent, models.DetectionUseCase.name, models.ThreatActor.name)
+        .outerjoin(models.DetectionUseCase, models.DetectionUseCase.id == models.DetectionMatchEvent.use_case_id)
+        .outerjoin(models.ThreatActor, models.ThreatActor.id == models.DetectionMatchEvent.actor_id)
+        .filter(models.DetectionMatchEvent.id > after_id)
+    )
+    if use_case_id is not None:
+        query = query.filter(models.DetectionMatchEvent.use_case_id == use_case_id)
+    rows = query.order_by(models.DetectionMatchEvent.id.asc()).limit(limit).all()
+
+    items = [
+        {
+            "id": e.id,
+            "use_case_id": e.use_case_id,
+            "use_case_name": use_case_name,
+            "actor_id": e.actor_id,
+            "actor": actor_name,
+            "change": e.change,
+            "created_at": _isoformat_bogota(e.created_at)
+        }
+        for e, use_case_name, actor_name in rows
+    ]
+    return {"items": items, "last_id": items[-1]["id"] if items else after_id}
+
+
+@app.post("/admin/rebuild-detection-matches")
+def rebuild_detection_matches_endpoint(db: Session = Depends(get_db)):
+    changes = rebuild_detection_matches(db)
+    return {"status": "ok", "changes": len(changes)}
 
 # ---------------------------------------------------------
 # TOP TECHNIQUES (últimas 24h)
@@ -2735,7 +3215,6 @@ def actor_details(name: str, db: Session = Depends(get_db)):
 
     last_seen = None
     result = []
-    tactics_summary = {}
 
     for at, t in rows:
         if at.last_seen and (last_seen is None or at.last_seen > last_seen):
@@ -2752,28 +3231,29 @@ def actor_details(name: str, db: Session = Depends(get_db)):
             "seen_days_count": int(at.seen_days_count or 0),
         })
 
-        for tactic in [x.strip().lower() for x in (t.tactic or "").split(",") if x.strip()]:
-            if tactic not in tactics_summary:
-                tactics_summary[tactic] = {
-                    "tactic": tactic,
-                    "first_seen": at.first_seen,
-                    "last_seen": at.last_seen,
-                    "techniques": set(),
-                }
-            if at.first_seen and (tactics_summary[tactic]["first_seen"] is None or at.first_seen < tactics_summary[tactic]["first_seen"]):
-                tactics_summary[tactic]["first_seen"] = at.first_seen
-            if at.last_seen and (tactics_summary[tactic]["last_seen"] is None or at.last_seen > tactics_summary[tactic]["last_seen"]):
-                tactics_summary[tactic]["last_seen"] = at.last_seen
-            tactics_summary[tactic]["techniques"].add(t.tech_id)
-
-    tactics_items = []
-    for _, v in tactics_summary.items():
-        tactics_items.append({
-            "tactic": v["tactic"],
-            "first_seen": utc_to_bogota(v["first_seen"]).isoformat() if v["first_seen"] else None,
-            "last_seen": utc_to_bogota(v["last_seen"]).isoformat() if v["last_seen"] else None,
-            "technique_count": len(v["techniques"])
-        })
+    tactic_rows = (
+        db.query(
+            models.TechniqueTactic.tactic,
+            func.min(models.ActorTechnique.first_seen),
+            func.max(models.ActorTechnique.last_seen),
+            func.count(func.distinct(models.ActorTechnique.technique_id))
+        )
+        .join(models.ActorTechnique, models.ActorTechnique.technique_id == models.TechniqueTactic.technique_id)
+        .filter(models.ActorTechnique.actor_id == actor.id)
+        .filter(models.ActorTechnique.active == True)
+        .group_by(models.TechniqueTactic.tactic)
+        .all()
+    )
+
+    tactics_items = [
+        {
+            "tactic": tactic,
+            "first_seen": utc_to_bogota(first_seen).isoformat() if first_seen else None,
+            "last_seen": utc_to_bogota(tactic_last_seen).isoformat() if tactic_last_seen else None,
+            "technique_count": int(technique_count or 0)
+        }
+        for tactic, first_seen, tactic_last_seen, technique_count in tactic_rows
+    ]
 
     tactics_items.sort(key=lambda x: x["last_seen"] or "", reverse=True)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Float, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Float, Text, UniqueConstraint, Index, text
 from datetime import datetime
 from .database import Base
 
@@ -15,6 +15,17 @@ class ThreatActor(Base):
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # cache de resolución de la collection VT/GTI del actor
+    vt_collection_id = Column(String, nullable=True)
+    vt_collection_status = Column(String, nullable=True)  # FOUND | NOT_FOUND
+    vt_collection_resolved_at = Column(DateTime, nullable=True)
+
+    # último escaneo GTI y decisión del planificador de la corrida
+    last_scanned_at = Column(DateTime, nullable=True, index=True)
+    last_scan_status = Column(String, nullable=True)  # ok | error
+    last_scan_decision = Column(String, nullable=True)  # SCAN | SKIP | DEFERRED
+    last_scan_reason = Column(String, nullable=True)
+
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
 
@@ -25,9 +36,18 @@ class Technique(Base):
     id = Column(Integer, primary_key=True)
     tech_id = Column(String, unique=True, index=True)  # T1059
     name = Column(String)
-    tactic = Column(String, index=True)
+    tactic = Column(String, index=True)  # "defense-evasion,privilege-escalation" (legible; para filtrar usar technique_tactics)
     description = Column(String)
 
+
+class TechniqueTactic(Base):
+    """Relación normalizada técnica ↔ táctica (una fila por táctica), mantenida por el sync de MITRE."""
+    __tablename__ = "technique_tactics"
+    __table_args__ = (Index("ix_technique_tactics_tactic_technique", "tactic", "technique_id"),)
+
+    technique_id = Column(Integer, ForeignKey("techniques.id"), primary_key=True)
+    tactic = Column(String, primary_key=True)
+
 class ActorTechnique(Base):
     __tablename__ = "actor_techniques"
 
@@ -61,8 +81,42 @@ class IntelligenceEvent(Base):
     technique = relationship("Technique")
 
 
+class IntelEventDaily(Base):
+    """Rollup diario de intelligence_events por día local de Bogotá; lo mantiene el collector."""
+    __tablename__ = "intel_event_daily"
+    __table_args__ = (Index("ix_intel_event_daily_type_day", "event_type", "day"),)
+
+    day = Column(Date, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), primary_key=True)
+    technique_id = Column(Integer, ForeignKey("techniques.id"), primary_key=True)
+
+    events = Column(Integer, default=0)
+    first_at = Column(DateTime)  # UTC, primer evento del día
+    last_at = Column(DateTime)   # UTC, último evento del día
+
+
+class TacticFirstSeen(Base):
+    """Primera detección NEW histórica de cada táctica (quién y con qué técnica)."""
+    __tablename__ = "tactic_first_seen"
+
+    tactic = Column(String, primary_key=True)
+    first_seen_at = Column(DateTime, index=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), nullable=True)
+    technique_id = Column(Integer, ForeignKey("techniques.id"), nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Alert(Base):
     __tablename__ = "alerts"
+    __table_args__ = (
+        # paginación por (created_at, id) y filtros de /alerts
+        Index("ix_alerts_created_id", "created_at", "id"),
+        Index("ix_alerts_severity_created_id", "severity", "created_at", "id"),
+        Index("ix_alerts_actor_created_id", "actor_id", "created_at", "id"),
+        Index("ix_alerts_technique_created_id", "technique_id", "created_at", "id"),
+        Index("ix_alerts_event_type_created_id", "event_type", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -72,6 +126,7 @@ class Alert(Base):
     title = Column(String)
     description = Column(String)
     severity = Column(String)
+    event_type = Column(String, nullable=True)  # NEW | REACTIVATED | DISAPPEARED | RISK_CHANGE
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -80,6 +135,7 @@ class Alert(Base):
 
 class AlertState(Base):
     __tablename__ = "alert_state"
+    __table_args__ = (UniqueConstraint("actor_id", "technique_id", "event_type", name="uq_alert_state"),)
 
     id = Column(Integer, primary_key=True)
 
@@ -128,13 +184,47 @@ class MitreSyncConfig(Base):
     lock_until = Column(DateTime, nullable=True)
 
 
+class ScheduledJob(Base):
+    """Programación de jobs recurrentes (collector, MITRE, MISP, OpenCTI, snapshots, barrido de riesgo)."""
+    __tablename__ = "scheduled_jobs"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, index=True)
+    job_type = Column(String)  # collector | mitre_sync | misp_sync | opencti_sync | risk_snapshot | risk_state_sweep
+    params = Column(Text, nullable=True)  # JSON con los parámetros del job
+    days = Column(String, default="mon,tue,wed,thu,fri,sat,sun")
+    time_hhmm = Column(String, default="06:00")  # hora America/Bogota
+    interval_minutes = Column(Integer, nullable=True)  # si está, corre cada N minutos (en los días indicados) en vez de a time_hhmm
+    enabled = Column(Boolean, default=True)
+    catch_up = Column(Boolean, default=True)  # si se perdió la hora (backend caído), correr al volver
+
+    next_run_at = Column(DateTime, nullable=True, index=True)  # UTC
+    last_run_at = Column(DateTime, nullable=True)
+    last_job_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class JobRun(Base):
     __tablename__ = "job_runs"
+    __table_args__ = (
+        # un solo job activo por tipo+parámetros (dedup de /admin/* y del scheduler)
+        Index(
+            "uq_job_runs_active_dedup",
+            "dedup_key",
+            unique=True,
+            postgresql_where=text("status IN ('PENDING', 'RUNNING')")
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
-    job_type = Column(String, index=True)  # collector | actor_scan | mitre_sync
+    job_type = Column(String, index=True)  # collector | actor_scan | mitre_sync | misp_sync | opencti_sync
     trigger = Column(String, default="manual")  # manual | scheduler
-    status = Column(String, default="RUNNING", index=True)  # RUNNING | SUCCESS | ERROR
+    status = Column(String, default="RUNNING", index=True)  # PENDING | RUNNING | SUCCESS | ERROR | CANCELLED
+
+    params = Column(Text, nullable=True)  # JSON con los parámetros del job
+    result = Column(Text, nullable=True)  # JSON con el resultado (lo que antes devolvía el endpoint)
+    dedup_key = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
 
     actor_id = Column(Integer, ForeignKey("threat_actors.id"), nullable=True)
     actor_name = Column(String, nullable=True)
@@ -145,6 +235,10 @@ class JobRun(Base):
     details = Column(String, nullable=True)
     error = Column(String, nullable=True)
 
+    # proceso que coordina una corrida del collector (host:pid) y hasta cuándo; lo renueva un heartbeat
+    coordinator = Column(String, nullable=True)
+    coordinator_lease_until = Column(DateTime, nullable=True)
+
     started_at = Column(DateTime, default=datetime.utcnow, index=True)
     finished_at = Column(DateTime, nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow)
@@ -152,6 +246,7 @@ class JobRun(Base):
 
 class TechniqueEvidence(Base):
     __tablename__ = "technique_evidence"
+    __table_args__ = (UniqueConstraint("actor_id", "technique_id", "sample_hash", name="uq_technique_evidence"),)
 
     id = Column(Integer, primary_key=True)
     actor_id = Column(Integer, ForeignKey("threat_actors.id"), index=True)
@@ -172,6 +267,8 @@ class DetectionUseCase(Base):
     country_scope = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow)
+    # última evaluación completa de detection_matches (NULL = nunca evaluado)
+    matches_refreshed_at = Column(DateTime, nullable=True)
 
 
 class DetectionCondition(Base):
@@ -189,6 +286,33 @@ class DetectionCondition(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class DetectionMatch(Base):
+    """Resultado persistido: el actor cumple hoy todas las condiciones del caso de uso."""
+    __tablename__ = "detection_matches"
+    __table_args__ = (UniqueConstraint("use_case_id", "actor_id", name="uq_detection_match"),)
+
+    id = Column(Integer, primary_key=True)
+    use_case_id = Column(Integer, ForeignKey("detection_use_cases.id"), index=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), index=True)
+    matched_conditions = Column(Integer, default=0)
+    total_conditions = Column(Integer, default=0)
+    details = Column(Text, nullable=True)  # JSON: condiciones con evidencias
+    matched_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DetectionMatchEvent(Base):
+    """Feed de cambios: un actor entra (ENTERED) o sale (LEFT) de un caso de uso."""
+    __tablename__ = "detection_match_events"
+
+    id = Column(Integer, primary_key=True)
+    # sin FK: el feed sobrevive al borrado del caso de uso
+    use_case_id = Column(Integer, index=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), index=True)
+    change = Column(String)  # ENTERED | LEFT
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
 class Client(Base):
     __tablename__ = "clients"
 
@@ -283,3 +407,117 @@ class IntelReport(Base):
     payload_json = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class FileBehaviourCache(Base):
+    __tablename__ = "file_behaviour_cache"
+
+    id = Column(Integer, primary_key=True)
+    sample_hash = Column(String, unique=True, index=True)
+    techniques = Column(Text, default="")  # T1059,T1105 (vacío = sample sin técnicas)
+    fetched_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class TechniqueRiskState(Base):
+    __tablename__ = "technique_risk_state"
+
+    id = Column(Integer, primary_key=True)
+    technique_id = Column(Integer, ForeignKey("techniques.id"), unique=True, index=True)
+
+    new_7d = Column(Integer, default=0)
+    reactivated_7d = Column(Integer, default=0)
+    # filas activas en actor_techniques y suma de first_seen (epoch) para la persistencia promedio
+    active_rows = Column(Integer, default=0)
+    first_seen_epoch_sum = Column(Float, default=0.0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CountryTechniqueRiskState(Base):
+    __tablename__ = "country_technique_risk_state"
+    __table_args__ = (UniqueConstraint("country", "technique_id", name="uq_country_technique_risk"),)
+
+    id = Column(Integer, primary_key=True)
+    country = Column(String, index=True)
+    technique_id = Column(Integer, ForeignKey("techniques.id"), index=True)
+
+    actors_using = Column(Integer, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CountryTechniqueStats(Base):
+    """
+    Cubo país × técnica × táctica de las TTPs activas de actores activos. Lo reconstruye
+    el collector al cerrar cada corrida; tactic = '' para técnicas sin táctica.
+    """
+    __tablename__ = "country_technique_stats"
+    __table_args__ = (Index("ix_country_technique_stats_country_tactic", "country", "tactic"),)
+
+    country = Column(String, primary_key=True)
+    technique_id = Column(Integer, ForeignKey("techniques.id"), primary_key=True)
+    tactic = Column(String, primary_key=True, default="")
+
+    actors_using = Column(Integer, default=0)
+    sightings = Column(Integer, default=0)
+    last_seen = Column(DateTime, nullable=True)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ActorRiskState(Base):
+    __tablename__ = "actor_risk_state"
+
+    id = Column(Integer, primary_key=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), unique=True, index=True)
+
+    active_ttps = Column(Integer, default=0)
+    new_7d = Column(Integer, default=0)
+    reactivated_7d = Column(Integer, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RiskStateWindow(Base):
+    """Una sola fila: desde cuándo cuentan los eventos en new_7d/reactivated_7d (lo ya descontado por el barrido)."""
+    __tablename__ = "risk_state_window"
+
+    id = Column(Integer, primary_key=True)
+    window_start = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CollectionTask(Base):
+    __tablename__ = "collection_tasks"
+    __table_args__ = (UniqueConstraint("job_id", "actor_id", name="uq_collection_task"),)
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("job_runs.id"), index=True)
+    actor_id = Column(Integer, ForeignKey("threat_actors.id"), index=True)
+
+    priority = Column(Float, default=0.0)
+    status = Column(String, default="PENDING", index=True)  # PENDING | RUNNING | DONE | ERROR | DEFERRED | SKIPPED | CANCELLED
+    reason = Column(String, nullable=True)  # motivo del planificador (scan/skip)
+    attempts = Column(Integer, default=0)
+    locked_by = Column(String, nullable=True)  # host:pid del worker
+    lease_until = Column(DateTime, nullable=True, index=True)
+
+    result_status = Column(String, nullable=True)  # ok | error
+    result_source = Column(String, nullable=True)
+    result_total = Column(Integer, nullable=True)
+    requests_used = Column(Integer, default=0)
+    requests_reserved = Column(Integer, default=0)  # reservado al reclamar; cuenta contra el presupuesto mientras corre
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class RateLimitBucket(Base):
+    """Token bucket compartido por todos los procesos (ver SharedTokenBucket)."""
+    __tablename__ = "rate_limit_buckets"
+
+    name = Column(String, primary_key=True)
+    tokens = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
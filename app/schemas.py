@@ -20,6 +20,9 @@ class ActorOut(BaseModel):
     active: bool = True
     aliases: str | None = None
     last_scan_at: datetime | None = None
+    last_scan_status: str | None = None
+    last_scan_decision: str | None = None
+    last_scan_reason: str | None = None
     source: str | None = None
 
     class Config:
@@ -51,6 +54,15 @@ class ScheduleUpdate(BaseModel):
     enabled: bool = True
 
 
+class ScheduledJobUpdate(BaseModel):
+    time_hhmm: str | None = None
+    days: list[str] | None = None
+    interval_minutes: int | None = None
+    enabled: bool | None = None
+    catch_up: bool | None = None
+    params: dict | None = None
+
+
 class ClientCreate(BaseModel):
     name: str
 
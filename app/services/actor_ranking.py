@@ -1,41 +1,27 @@
-from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from app import models
 
 
 def calculate_actor_ranking(db: Session, country: str):
 
-    since_7 = datetime.utcnow() - timedelta(days=7)
-
-    actors = db.query(models.ThreatActor)\
+    rows = db.query(
+        models.ThreatActor.name,
+        models.ActorRiskState.active_ttps,
+        models.ActorRiskState.new_7d,
+        models.ActorRiskState.reactivated_7d
+    )\
+        .outerjoin(models.ActorRiskState, models.ActorRiskState.actor_id == models.ThreatActor.id)\
         .filter(models.ThreatActor.country == country)\
         .filter(models.ThreatActor.active == True)\
         .all()
 
     results = []
 
-    for actor in actors:
-
-        # TTPs activas
-        active_ttps = db.query(func.count(models.ActorTechnique.id))\
-            .filter(models.ActorTechnique.actor_id == actor.id)\
-            .filter(models.ActorTechnique.active == True)\
-            .scalar() or 0
+    for name, active_ttps, new_7, reactivated in rows:
 
-        # nuevas en 7 días
-        new_7 = db.query(func.count(models.IntelligenceEvent.id))\
-            .filter(models.IntelligenceEvent.actor_id == actor.id)\
-            .filter(models.IntelligenceEvent.event_type == "NEW")\
-            .filter(models.IntelligenceEvent.created_at >= since_7)\
-            .scalar() or 0
-
-        # reactivadas
-        reactivated = db.query(func.count(models.IntelligenceEvent.id))\
-            .filter(models.IntelligenceEvent.actor_id == actor.id)\
-            .filter(models.IntelligenceEvent.event_type == "REACTIVATED")\
-            .filter(models.IntelligenceEvent.created_at >= since_7)\
-            .scalar() or 0
+        active_ttps = int(active_ttps or 0)
+        new_7 = int(new_7 or 0)
+        reactivated = int(reactivated or 0)
 
         # score
         risk = (
@@ -54,7 +40,7 @@ def calculate_actor_ranking(db: Session, country: str):
             level = "LOW"
 
         results.append({
-            "actor": actor.name,
+            "actor": name,
             "risk": round(risk, 2),
             "active_ttps": active_ttps,
             "new_ttps_7d": new_7,
@@ -62,4 +48,3 @@ def calculate_actor_ranking(db: Session, country: str):
         })
 
     return sorted(results, key=lambda x: x["risk"], reverse=True)
-
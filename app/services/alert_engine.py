@@ -1,8 +1,16 @@
 from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
 from app import models
+from app.services.event_bus import notify
 
 ALERT_WINDOW_HOURS = 24
 
+SEVERITY_MAP = {
+    "NEW": "HIGH",
+    "REACTIVATED": "MEDIUM",
+    "DISAPPEARED": "LOW"
+}
+
 
 # -------------------------------------------------
 # Controla spam de alertas
@@ -37,27 +45,107 @@ def should_alert(db, actor, technique, event_type):
     return False
 
 
+# -------------------------------------------------
+# Supresión y alertas en bloque (un escaneo de actor)
+# -------------------------------------------------
+class AlertBatch:
+    """
+    Carga una vez el estado de supresión del actor y acumula alertas y estados
+    nuevos para escribirlos con pocas sentencias al final del escaneo.
+    """
+
+    def __init__(self, db, actor_id: int):
+        self.actor_id = actor_id
+        rows = db.query(
+            models.AlertState.technique_id,
+            models.AlertState.event_type,
+            models.AlertState.last_alert_at
+        )\
+            .filter(models.AlertState.actor_id == actor_id)\
+            .all()
+        self.states = {(technique_id, event_type): last_alert_at for technique_id, event_type, last_alert_at in rows}
+        self.pending_states = {}
+        self.alerts = []
+
+    def should_alert(self, technique_id: int, event_type: str, now: datetime) -> bool:
+        key = (technique_id, event_type)
+        last_alert_at = self.states.get(key)
+
+        # ventana de silencio
+        if last_alert_at and now - last_alert_at <= timedelta(hours=ALERT_WINDOW_HOURS):
+            return False
+
+        self.states[key] = now
+        self.pending_states[key] = now
+        return True
+
+    def add(self, alert: dict):
+        self.alerts.append(alert)
+
+    def flush(self, db):
+        """Upsert de alert_state + insert de alertas. No hace commit."""
+        if self.pending_states:
+            stmt = insert(models.AlertState).values([
+                {
+                    "actor_id": self.actor_id,
+                    "technique_id": technique_id,
+                    "event_type": event_type,
+                    "last_alert_at": last_alert_at
+                }
+                for (technique_id, event_type), last_alert_at in self.pending_states.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[
+                    models.AlertState.actor_id,
+                    models.AlertState.technique_id,
+                    models.AlertState.event_type
+                ],
+                set_={"last_alert_at": stmt.excluded.last_alert_at}
+            )
+            db.execute(stmt)
+            self.pending_states = {}
+
+        if self.alerts:
+            rows = db.execute(
+                insert(models.Alert).values(self.alerts).returning(models.Alert.id)
+            ).fetchall()
+            # se entrega a los clientes SSE cuando el collector hace commit
+            notify(db, "alerts.created", {
+                "actor_id": self.actor_id,
+                "count": len(rows),
+                "alert_ids": [r[0] for r in rows][:200]
+            })
+            self.alerts = []
+
+
 # -------------------------------------------------
 # Crear alerta
 # -------------------------------------------------
-def generate_alert(db, actor, technique, event_type, context: str | None = None):
+def generate_alert(db, actor, technique, event_type, context: str | None = None, batch: AlertBatch | None = None):
+
+    now = datetime.utcnow()
 
-    if not should_alert(db, actor, technique, event_type):
+    if batch is not None:
+        if not batch.should_alert(technique.id, event_type, now):
+            return
+    elif not should_alert(db, actor, technique, event_type):
         return
 
-    severity_map = {
-        "NEW": "HIGH",
-        "REACTIVATED": "MEDIUM",
-        "DISAPPEARED": "LOW"
+    alert = {
+        "actor_id": actor.id,
+        "technique_id": technique.id,
+        "title": f"{actor.name} using {technique.tech_id}",
+        "description": (context or f"{event_type} technique detected in monitored region"),
+        "severity": SEVERITY_MAP.get(event_type, "LOW"),
+        "event_type": event_type,
+        "created_at": now
     }
 
-    alert = models.Alert(
-        actor_id=actor.id,
-        technique_id=technique.id,
-        title=f"{actor.name} using {technique.tech_id}",
-        description=(context or f"{event_type} technique detected in monitored region"),
-        severity=severity_map.get(event_type, "LOW"),
-        created_at=datetime.utcnow()
-    )
+    if batch is not None:
+        batch.add(alert)
+        return
 
-    db.add(alert)
+    row = models.Alert(**alert)
+    db.add(row)
+    db.flush()
+    notify(db, "alerts.created", {"actor_id": actor.id, "count": 1, "alert_ids": [row.id]})
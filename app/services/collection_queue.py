@@ -0,0 +1,289 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+
+# cada escaneo de actor de una corrida del collector es una tarea reclamable;
+# varios procesos (workers de uvicorn / réplicas) drenan la misma corrida
+COLLECTION_TASK_LEASE_SECONDS = int(os.getenv("COLLECTION_TASK_LEASE_SECONDS", "600"))
+COLLECTION_TASK_MAX_ATTEMPTS = max(1, int(os.getenv("COLLECTION_TASK_MAX_ATTEMPTS", "3")))
+# requests reservadas por tarea al reclamarla mientras la corrida no tenga tareas terminadas
+# (después se usa el promedio real de la corrida)
+COLLECTION_TASK_REQUEST_RESERVE = max(1, int(os.getenv("COLLECTION_TASK_REQUEST_RESERVE", "10")))
+# lease del coordinador de una corrida; un heartbeat lo renueva cada tercio de este tiempo
+COLLECTION_COORDINATOR_LEASE_SECONDS = max(15, int(os.getenv("COLLECTION_COORDINATOR_LEASE_SECONDS", "120")))
+
+
+def worker_id() -> str:
+    # se calcula en cada llamada: los workers pueden venir de un fork
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def renew_coordinator(db: Session, job_id: int, worker: str | None = None) -> bool:
+    """
+    Toma o renueva el lease de coordinador de la corrida. False si la corrida ya no está
+    RUNNING o si otro proceso la tomó (este dejó de ser el coordinador).
+    """
+    worker = worker or worker_id()
+    now = datetime.utcnow()
+    renewed = db.query(models.JobRun)\
+        .filter(models.JobRun.id == job_id)\
+        .filter(models.JobRun.status == "RUNNING")\
+        .filter(or_(models.JobRun.coordinator == None, models.JobRun.coordinator == worker))\
+        .update({
+            "coordinator": worker,
+            "coordinator_lease_until": now + timedelta(seconds=COLLECTION_COORDINATOR_LEASE_SECONDS)
+        }, synchronize_session=False)
+    db.commit()
+    return renewed == 1
+
+
+def release_coordinator(db: Session, job_id: int, worker: str | None = None):
+    worker = worker or worker_id()
+    db.query(models.JobRun)\
+        .filter(models.JobRun.id == job_id)\
+        .filter(models.JobRun.coordinator == worker)\
+        .update({"coordinator": None, "coordinator_lease_until": None}, synchronize_session=False)
+    db.commit()
+
+
+def coordinator_lost(now: datetime, stale_before: datetime):
+    """Corrida RUNNING cuyo coordinador murió: lease vencido (o, sin lease, sin progreso desde stale_before)."""
+    return (models.JobRun.status == "RUNNING") & or_(
+        models.JobRun.coordinator_lease_until < now,
+        and_(models.JobRun.coordinator_lease_until == None, models.JobRun.updated_at < stale_before)
+    )
+
+
+def _claimable(now: datetime):
+    # pendientes, o en curso con el lease vencido (worker caído)
+    return or_(
+        models.CollectionTask.status == "PENDING",
+        and_(models.CollectionTask.status == "RUNNING", models.CollectionTask.lease_until < now)
+    )
+
+
+def enqueue_tasks(db: Session, job_id: int, items: list[dict]):
+    """
+    items = [{"actor_id", "priority", "reason", "status"}]; status PENDING (a escanear)
+    o SKIPPED (decisión del planificador). Idempotente por (job_id, actor_id).
+    """
+    if not items:
+        return
+    now = datetime.utcnow()
+    stmt = insert(models.CollectionTask).values([
+        {
+            "job_id": job_id,
+            "actor_id": item["actor_id"],
+            "priority": item.get("priority") or 0.0,
+            "reason": item.get("reason"),
+            "status": item.get("status") or "PENDING",
+            "attempts": 0,
+            "requests_used": 0,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": now if item.get("status") == "SKIPPED" else None
+        }
+        for item in items
+    ]).on_conflict_do_nothing(index_elements=[models.CollectionTask.job_id, models.CollectionTask.actor_id])
+    db.execute(stmt)
+    db.commit()
+
+
+def claimable_job_ids(db: Session) -> list[int]:
+    now = datetime.utcnow()
+    rows = (
+        db.query(models.CollectionTask.job_id)
+        .join(models.JobRun, models.JobRun.id == models.CollectionTask.job_id)
+        .filter(models.JobRun.status == "RUNNING")
+        .filter(_claimable(now))
+        .distinct()
+        .all()
+    )
+    return sorted(job_id for (job_id,) in rows)
+
+
+def _request_reserve(db: Session, job_id: int) -> int:
+    average = (
+        db.query(func.avg(models.CollectionTask.requests_used))
+        .filter(models.CollectionTask.job_id == job_id)
+        .filter(models.CollectionTask.status.in_(["DONE", "ERROR"]))
+        .scalar()
+    )
+    if average is None:
+        return COLLECTION_TASK_REQUEST_RESERVE
+    return max(1, int(round(float(average))))
+
+
+def claim_tasks(db: Session, job_id: int, limit: int, worker: str | None = None, budget: int = 0) -> list[models.CollectionTask]:
+    """
+    Reclama hasta `limit` tareas de la corrida con FOR UPDATE SKIP LOCKED:
+    dos workers nunca toman la misma fila y ninguno espera al otro.
+    Con budget > 0 cada tarea reserva requests al reclamarla; los reclamos de la corrida se
+    serializan con FOR UPDATE sobre su job_run para que los workers no sobrepasen juntos el presupuesto.
+    """
+    worker = worker or worker_id()
+    now = datetime.utcnow()
+
+    reserve = 0
+    if budget > 0:
+        db.query(models.JobRun.id).filter(models.JobRun.id == job_id).with_for_update().first()
+        remaining = budget - requests_used(db, job_id)
+        if remaining <= 0:
+            db.commit()
+            return []
+        reserve = _request_reserve(db, job_id)
+        # el último reclamo puede quedar con menos de una reserva completa
+        limit = min(limit, max(1, remaining // reserve))
+
+    rows = (
+        db.query(models.CollectionTask)
+        .filter(models.CollectionTask.job_id == job_id)
+        .filter(_claimable(now))
+        .order_by(models.CollectionTask.priority.desc(), models.CollectionTask.id)
+        .with_for_update(skip_locked=True)
+        .limit(limit)
+        .all()
+    )
+
+    claimed = []
+    for task in rows:
+        if (task.attempts or 0) >= COLLECTION_TASK_MAX_ATTEMPTS:
+            task.status = "ERROR"
+            task.error = task.error or "MAX_ATTEMPTS_EXCEEDED"
+            task.lease_until = None
+            task.finished_at = now
+            task.updated_at = now
+            continue
+        task.status = "RUNNING"
+        task.attempts = (task.attempts or 0) + 1
+        task.locked_by = worker
+        task.lease_until = now + timedelta(seconds=COLLECTION_TASK_LEASE_SECONDS)
+        task.requests_reserved = reserve
+        task.updated_at = now
+        claimed.append(task)
+
+    db.commit()
+    return claimed
+
+
+def finish_task(db: Session, task_id: int, result: dict, worker: str | None = None):
+    worker = worker or worker_id()
+    now = datetime.utcnow()
+    status = "DONE" if result.get("status") == "ok" else "ERROR"
+    db.query(models.CollectionTask)\
+        .filter(models.CollectionTask.id == task_id)\
+        .filter(models.CollectionTask.locked_by == worker)\
+        .update({
+            "status": status,
+            "result_status": result.get("status"),
+            "result_source": result.get("source"),
+            "result_total": result.get("total"),
+            "requests_used": result.get("requests") or 0,
+            "requests_reserved": 0,
+            "error": (str(result.get("error"))[:1000] if result.get("error") else None),
+            "lease_until": None,
+            "finished_at": now,
+            "updated_at": now
+        }, synchronize_session=False)
+    db.commit()
+
+
+def release_task(db: Session, task_id: int, worker: str | None = None):
+    """Devuelve a PENDING una tarea reclamada que no se alcanzó a lanzar (no cuenta como intento)."""
+    worker = worker or worker_id()
+    db.query(models.CollectionTask)\
+        .filter(models.CollectionTask.id == task_id)\
+        .filter(models.CollectionTask.locked_by == worker)\
+        .filter(models.CollectionTask.status == "RUNNING")\
+        .update({
+            "status": "PENDING",
+            "attempts": func.greatest(models.CollectionTask.attempts - 1, 0),
+            "locked_by": None,
+            "lease_until": None,
+            "requests_reserved": 0,
+            "updated_at": datetime.utcnow()
+        }, synchronize_session=False)
+    db.commit()
+
+
+def release_expired(db: Session, job_id: int) -> int:
+    """Tareas RUNNING con el lease vencido (worker caído) vuelven a PENDING."""
+    now = datetime.utcnow()
+    released = db.query(models.CollectionTask)\
+        .filter(models.CollectionTask.job_id == job_id)\
+        .filter(models.CollectionTask.status == "RUNNING")\
+        .filter(models.CollectionTask.lease_until < now)\
+        .update({
+            "status": "PENDING",
+            "locked_by": None,
+            "lease_until": None,
+            "requests_reserved": 0,
+            "updated_at": now
+        }, synchronize_session=False)
+    db.commit()
+    return released
+
+
+def task_counts(db: Session, job_id: int) -> dict[str, int]:
+    rows = (
+        db.query(models.CollectionTask.status, func.count(models.CollectionTask.id))
+        .filter(models.CollectionTask.job_id == job_id)
+        .group_by(models.CollectionTask.status)
+        .all()
+    )
+    counts = {"PENDING": 0, "RUNNING": 0, "DONE": 0, "ERROR": 0, "DEFERRED": 0, "SKIPPED": 0, "CANCELLED": 0}
+    counts.update({status: int(count or 0) for status, count in rows})
+    return counts
+
+
+def requests_used(db: Session, job_id: int) -> int:
+    """Requests gastadas por las tareas terminadas más las reservadas por las que están en curso."""
+    value = (
+        db.query(func.sum(
+            func.coalesce(models.CollectionTask.requests_used, 0)
+            + case(
+                (models.CollectionTask.status == "RUNNING", func.coalesce(models.CollectionTask.requests_reserved, 0)),
+                else_=0
+            )
+        ))
+        .filter(models.CollectionTask.job_id == job_id)
+        .scalar()
+    )
+    return int(value or 0)
+
+
+def defer_pending(db: Session, job_id: int) -> list[int]:
+    """Marca DEFERRED las tareas que quedaron sin lanzar (presupuesto agotado). Sin commit."""
+    rows = (
+        db.query(models.CollectionTask)
+        .filter(models.CollectionTask.job_id == job_id)
+        .filter(models.CollectionTask.status == "PENDING")
+        .all()
+    )
+    now = datetime.utcnow()
+    for task in rows:
+        task.status = "DEFERRED"
+        task.updated_at = now
+    return [task.actor_id for task in rows]
+
+
+def cancel_tasks(db: Session, job_id: int) -> int:
+    """Corrida cancelada: lo que no terminó pasa a CANCELLED y ningún worker lo vuelve a reclamar."""
+    now = datetime.utcnow()
+    cancelled = db.query(models.CollectionTask)\
+        .filter(models.CollectionTask.job_id == job_id)\
+        .filter(models.CollectionTask.status.in_(["PENDING", "RUNNING"]))\
+        .update({
+            "status": "CANCELLED",
+            "locked_by": None,
+            "lease_until": None,
+            "requests_reserved": 0,
+            "updated_at": now,
+            "finished_at": now
+        }, synchronize_session=False)
+    db.commit()
+    return cancelled
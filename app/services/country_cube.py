@@ -0,0 +1,126 @@
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+
+Cube = models.CountryTechniqueStats
+
+
+# -------------------------------------------------
+# Reconstrucción (al cerrar una corrida del collector)
+# -------------------------------------------------
+def refresh_country_cube(db: Session, countries=None):
+    """
+    Recalcula el cubo para esos países (None = todos) con una consulta agrupada y lo
+    reemplaza en la misma transacción: los lectores ven el cubo viejo o el nuevo. Hace commit.
+    """
+    if countries is not None:
+        countries = sorted({c for c in countries if c})
+        if not countries:
+            return 0
+
+    tactic = func.coalesce(models.TechniqueTactic.tactic, "")
+    query = (
+        db.query(
+            models.ThreatActor.country,
+            models.ActorTechnique.technique_id,
+            tactic,
+            func.count(models.ActorTechnique.id),
+            func.sum(models.ActorTechnique.sightings_count),
+            func.max(models.ActorTechnique.last_seen)
+        )
+        .join(models.ActorTechnique, models.ActorTechnique.actor_id == models.ThreatActor.id)
+        .outerjoin(models.TechniqueTactic, models.TechniqueTactic.technique_id == models.ActorTechnique.technique_id)
+        .filter(models.ThreatActor.active == True)
+        .filter(models.ThreatActor.country != None)
+        .filter(models.ActorTechnique.active == True)
+    )
+    if countries is not None:
+        query = query.filter(models.ThreatActor.country.in_(countries))
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "country": country,
+            "technique_id": technique_id,
+            "tactic": tactic_value,
+            "actors_using": int(actors or 0),
+            "sightings": int(sightings or 0),
+            "last_seen": last_seen,
+            "updated_at": now,
+        }
+        for country, technique_id, tactic_value, actors, sightings, last_seen
+        in query.group_by(models.ThreatActor.country, models.ActorTechnique.technique_id, tactic).all()
+    ]
+
+    stale = db.query(Cube)
+    if countries is not None:
+        stale = stale.filter(Cube.country.in_(countries))
+    stale.delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(Cube), rows)
+    db.commit()
+    return len(rows)
+
+
+def ensure_country_cube(db: Session):
+    """Backfill al arrancar: cubo vacío con TTPs activas (BD recién migrada)."""
+    if db.query(Cube.country).limit(1).first():
+        return 0
+    if not db.query(models.ActorTechnique.id).filter(models.ActorTechnique.active == True).limit(1).first():
+        return 0
+    return refresh_country_cube(db)
+
+
+# -------------------------------------------------
+# Lecturas (heatmap, matriz, tácticas, tendencias, navigator)
+# -------------------------------------------------
+def technique_usage(db: Session, country: str, limit: int | None = None):
+    """Una fila por técnica: (tech_id, name, tactic, actors_using, sightings), de mayor a menor uso."""
+    # los valores se repiten en cada fila de táctica de la técnica: max() los colapsa
+    actors_using = func.max(Cube.actors_using)
+    query = (
+        db.query(
+            models.Technique.tech_id,
+            models.Technique.name,
+            models.Technique.tactic,
+            actors_using,
+            func.max(Cube.sightings)
+        )
+        .join(Cube, Cube.technique_id == models.Technique.id)
+        .filter(Cube.country == country)
+        .group_by(models.Technique.id, models.Technique.tech_id, models.Technique.name, models.Technique.tactic)
+        .order_by(actors_using.desc(), models.Technique.tech_id)
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def tactic_matrix(db: Session, country: str):
+    """{táctica: [{technique, count}]} ordenado por actores que la usan."""
+    rows = (
+        db.query(Cube.tactic, models.Technique.tech_id, Cube.actors_using)
+        .join(models.Technique, models.Technique.id == Cube.technique_id)
+        .filter(Cube.country == country)
+        .filter(Cube.tactic != "")
+        .order_by(Cube.tactic, Cube.actors_using.desc(), models.Technique.tech_id)
+        .all()
+    )
+    matrix = {}
+    for tactic, tech_id, actors in rows:
+        matrix.setdefault(tactic, []).append({"technique": tech_id, "count": int(actors or 0)})
+    return matrix
+
+
+def tactic_totals(db: Session, country: str):
+    """{táctica: filas actor-técnica activas} del país."""
+    rows = (
+        db.query(Cube.tactic, func.sum(Cube.actors_using))
+        .filter(Cube.country == country)
+        .filter(Cube.tactic != "")
+        .group_by(Cube.tactic)
+        .all()
+    )
+    return {tactic: int(total or 0) for tactic, total in rows}
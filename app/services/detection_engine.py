@@ -0,0 +1,474 @@
+import json
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app import models
+from app.services.event_bus import notify
+from app.services.technique_catalog import get_catalog
+
+MAX_EVIDENCE_PER_CONDITION = 5
+BOGOTA_TZ = ZoneInfo("America/Bogota")
+
+CompiledCondition = namedtuple(
+    "CompiledCondition",
+    ["id", "tactic", "technique_id", "procedure", "min_sightings", "min_days", "technique_ids"]
+)
+CompiledUseCase = namedtuple("CompiledUseCase", ["id", "name", "severity", "country_scope", "conditions"])
+ActorRow = namedtuple("ActorRow", ["id", "name", "country"])
+TechniqueStats = namedtuple("TechniqueStats", ["sightings", "days", "last_seen"])
+
+
+# -------------------------------------------------
+# Compilación de condiciones contra el catálogo
+# -------------------------------------------------
+def compile_condition(cond: models.DetectionCondition, catalog) -> CompiledCondition:
+    """
+    Convierte táctica / técnica / procedimiento en el conjunto de technique_id que los
+    cumple. La táctica se compara exacta contra las tácticas normalizadas de la técnica
+    (como technique_tactics); el procedimiento sigue siendo subcadena sin distinguir
+    mayúsculas. None = cualquier técnica.
+    """
+    technique_ids = None
+
+    if cond.technique_id:
+        technique_ids = {cond.technique_id}
+
+    if cond.tactic:
+        tactic = cond.tactic.strip().lower()
+        by_tactic = {e.id for e in catalog.entries if tactic in e.tactics}
+        technique_ids = by_tactic if technique_ids is None else technique_ids & by_tactic
+
+    if cond.procedure:
+        proc = cond.procedure.lower()
+        by_procedure = {
+            e.id for e in catalog.entries
+            if proc in (e.name or "").lower() or proc in (e.description or "").lower()
+        }
+        technique_ids = by_procedure if technique_ids is None else technique_ids & by_procedure
+
+    return CompiledCondition(
+        id=cond.id,
+        tactic=cond.tactic,
+        technique_id=cond.technique_id,
+        procedure=cond.procedure,
+        min_sightings=int(cond.min_sightings or 1),
+        min_days=int(cond.min_days or 1),
+        technique_ids=frozenset(technique_ids) if technique_ids is not None else None,
+    )
+
+
+def compile_use_cases(db: Session, use_case_ids=None, only_enabled: bool = False) -> list[CompiledUseCase]:
+    """Casos de uso con sus condiciones compiladas (dos consultas)."""
+    catalog = get_catalog(db)
+
+    query = db.query(models.DetectionUseCase)
+    if use_case_ids is not None:
+        query = query.filter(models.DetectionUseCase.id.in_(list(use_case_ids) or [-1]))
+    if only_enabled:
+        query = query.filter(models.DetectionUseCase.enabled == True)
+    use_cases = query.order_by(models.DetectionUseCase.id).all()
+    if not use_cases:
+        return []
+
+    conditions = {}
+    rows = (
+        db.query(models.DetectionCondition)
+        .filter(models.DetectionCondition.use_case_id.in_([uc.id for uc in use_cases]))
+        .order_by(models.DetectionCondition.id)
+        .all()
+    )
+    for cond in rows:
+        conditions.setdefault(cond.use_case_id, []).append(compile_condition(cond, catalog))
+
+    return [
+        CompiledUseCase(
+            id=uc.id,
+            name=uc.name,
+            severity=uc.severity,
+            country_scope=uc.country_scope,
+            conditions=tuple(conditions.get(uc.id, ())),
+        )
+        for uc in use_cases
+    ]
+
+
+# -------------------------------------------------
+# Tabla actor × técnica en memoria
+# -------------------------------------------------
+class ActorTechniqueTable:
+    """TTPs activas de los actores activos: actor_id -> {technique_id: TechniqueStats}."""
+
+    def __init__(self, actors: dict, techniques: dict):
+        self.actors = actors
+        self.techniques = techniques
+
+    @classmethod
+    def load(cls, db: Session, actor_ids=None):
+        actor_query = db.query(
+            models.ThreatActor.id,
+            models.ThreatActor.name,
+            models.ThreatActor.country
+        ).filter(models.ThreatActor.active == True)
+        if actor_ids is not None:
+            actor_query = actor_query.filter(models.ThreatActor.id.in_(list(actor_ids) or [-1]))
+        actors = {row.id: ActorRow(row.id, row.name, row.country) for row in actor_query.all()}
+
+        technique_query = (
+            db.query(
+                models.ActorTechnique.actor_id,
+                models.ActorTechnique.technique_id,
+                models.ActorTechnique.sightings_count,
+                models.ActorTechnique.seen_days_count,
+                models.ActorTechnique.last_seen
+            )
+            .join(models.ThreatActor, models.ThreatActor.id == models.ActorTechnique.actor_id)
+            .filter(models.ThreatActor.active == True)
+            .filter(models.ActorTechnique.active == True)
+        )
+        if actor_ids is not None:
+            technique_query = technique_query.filter(models.ActorTechnique.actor_id.in_(list(actor_ids) or [-1]))
+
+        techniques = {}
+        for actor_id, technique_id, sightings, days, last_seen in technique_query.all():
+            techniques.setdefault(actor_id, {})[technique_id] = TechniqueStats(
+                int(sightings or 0),
+                int(days or 0),
+                last_seen
+            )
+        return cls(actors, techniques)
+
+    @classmethod
+    def from_records(cls, actor, records):
+        """Tabla de un solo actor armada con filas ActorTechnique ya en memoria (sin consultas)."""
+        techniques = {
+            r.technique_id: TechniqueStats(int(r.sightings_count or 0), int(r.seen_days_count or 0), r.last_seen)
+            for r in records
+            if r.active
+        }
+        return cls({actor.id: ActorRow(actor.id, actor.name, actor.country)}, {actor.id: techniques})
+
+
+# -------------------------------------------------
+# Evaluación
+# -------------------------------------------------
+def _condition_hits(cond: CompiledCondition, actor_techniques: dict):
+    if cond.technique_ids is None:
+        candidates = actor_techniques.keys()
+    elif len(cond.technique_ids) < len(actor_techniques):
+        candidates = (t for t in cond.technique_ids if t in actor_techniques)
+    else:
+        candidates = (t for t in actor_techniques if t in cond.technique_ids)
+
+    hits = []
+    for technique_id in candidates:
+        stats = actor_techniques[technique_id]
+        if stats.sightings >= cond.min_sightings and stats.days >= cond.min_days:
+            hits.append(technique_id)
+    return hits
+
+
+def _evidence(technique_ids, actor_techniques: dict, catalog, to_local):
+    # las más recientes primero, como máximo MAX_EVIDENCE_PER_CONDITION
+    ordered = sorted(
+        technique_ids,
+        key=lambda t: actor_techniques[t].last_seen or datetime.min,
+        reverse=True
+    )[:MAX_EVIDENCE_PER_CONDITION]
+
+    evidence = []
+    for technique_id in ordered:
+        stats = actor_techniques[technique_id]
+        entry = catalog.get_by_id(technique_id)
+        evidence.append({
+            "technique": entry.tech_id if entry else None,
+            "technique_name": entry.name if entry else None,
+            "tactic": entry.tactic if entry else None,
+            "sightings_count": stats.sightings,
+            "seen_days_count": stats.days,
+            "last_seen": to_local(stats.last_seen)
+        })
+    return evidence
+
+
+def match_use_case(use_case: CompiledUseCase, table: ActorTechniqueTable, catalog, to_local=None, actor_ids=None):
+    """
+    Actores que cumplen todas las condiciones del caso de uso. Solo arma el detalle
+    (evidencias) de los que hacen match.
+    """
+    to_local = to_local or (lambda dt: dt.isoformat() if dt else None)
+    if not use_case.conditions:
+        return []
+
+    matches = []
+    for actor_id in (actor_ids if actor_ids is not None else table.actors):
+        actor = table.actors.get(actor_id)
+        if actor is None:
+            continue
+        if use_case.country_scope and actor.country != use_case.country_scope:
+            continue
+        actor_techniques = table.techniques.get(actor_id)
+        if not actor_techniques:
+            continue
+
+        hits_by_condition = []
+        for cond in use_case.conditions:
+            hits = _condition_hits(cond, actor_techniques)
+            if not hits:
+                break
+            hits_by_condition.append((cond, hits))
+        else:
+            matches.append({
+                "actor_id": actor.id,
+                "actor": actor.name,
+                "country": actor.country,
+                "matched_conditions": len(hits_by_condition),
+                "total_conditions": len(use_case.conditions),
+                "details": [
+                    {
+                        "condition_id": cond.id,
+                        "tactic": cond.tactic,
+                        "technique_id": cond.technique_id,
+                        "procedure": cond.procedure,
+                        "min_sightings": cond.min_sightings,
+                        "min_days": cond.min_days,
+                        "evidence": _evidence(hits, actor_techniques, catalog, to_local)
+                    }
+                    for cond, hits in hits_by_condition
+                ]
+            })
+
+    matches.sort(key=lambda x: (x["actor"] or "").lower())
+    return matches
+
+
+def match_use_cases(db: Session, use_case_ids=None, only_enabled: bool = False, to_local=None):
+    """Evalúa uno, varios o todos los casos de uso en una sola pasada sobre la tabla en memoria."""
+    use_cases = compile_use_cases(db, use_case_ids=use_case_ids, only_enabled=only_enabled)
+    if not use_cases:
+        return []
+    table = ActorTechniqueTable.load(db)
+    catalog = get_catalog(db)
+    return [
+        {
+            "use_case_id": uc.id,
+            "use_case_name": uc.name,
+            "severity": uc.severity,
+            "matches": match_use_case(uc, table, catalog, to_local=to_local)
+        }
+        for uc in use_cases
+    ]
+
+
+def to_bogota_iso(dt: datetime | None):
+    if not dt:
+        return None
+    return dt.replace(tzinfo=timezone.utc).astimezone(BOGOTA_TZ).isoformat()
+
+
+# -------------------------------------------------
+# Resultados persistidos (detection_matches) + feed de cambios
+# -------------------------------------------------
+_rules = None
+_rules_stamp = None
+_rules_lock = threading.Lock()
+
+
+def get_rules(db: Session) -> list[CompiledUseCase]:
+    """
+    Casos de uso habilitados ya compilados, cacheados en el proceso. Se recompilan si
+    cambia algún caso de uso (count + max(updated_at), también en otro proceso) o el catálogo.
+    """
+    global _rules, _rules_stamp
+    count, last_update = db.query(
+        func.count(models.DetectionUseCase.id),
+        func.max(models.DetectionUseCase.updated_at)
+    ).one()
+    stamp = (count, last_update, id(get_catalog(db)))
+
+    with _rules_lock:
+        if _rules is not None and _rules_stamp == stamp:
+            return _rules
+    rules = [uc for uc in compile_use_cases(db, only_enabled=True) if uc.conditions]
+    with _rules_lock:
+        _rules = rules
+        _rules_stamp = stamp
+    return rules
+
+
+def invalidate_rules():
+    global _rules
+    with _rules_lock:
+        _rules = None
+
+
+def _passes(cond: CompiledCondition, stats) -> bool:
+    return stats is not None and stats[0] >= cond.min_sightings and stats[1] >= cond.min_days
+
+
+def match_relevant(rules: list[CompiledUseCase], before: dict, after: dict) -> bool:
+    """
+    before/after: technique_id -> (sightings, days) de las TTPs activas del actor.
+    True si algún cambio puede alterar el resultado de alguna condición (aparece,
+    desaparece o cruza un umbral); los incrementos que no cruzan nada no cuentan.
+    """
+    changed = [t for t in before.keys() | after.keys() if before.get(t) != after.get(t)]
+    if not changed:
+        return False
+    for uc in rules:
+        for cond in uc.conditions:
+            for technique_id in changed:
+                if cond.technique_ids is not None and technique_id not in cond.technique_ids:
+                    continue
+                if _passes(cond, before.get(technique_id)) != _passes(cond, after.get(technique_id)):
+                    return True
+    return False
+
+
+def _store_results(db: Session, use_case_ids, actor_ids, results: dict, now: datetime):
+    """
+    Sincroniza detection_matches para los pares evaluados (use_case_ids × actor_ids) con
+    `results` {(use_case_id, actor_id): match}. Registra ENTERED/LEFT. Sin commit.
+    """
+    query = db.query(models.DetectionMatch)
+    if use_case_ids is not None:
+        query = query.filter(models.DetectionMatch.use_case_id.in_(list(use_case_ids) or [-1]))
+    if actor_ids is not None:
+        query = query.filter(models.DetectionMatch.actor_id.in_(list(actor_ids) or [-1]))
+    stored = {(m.use_case_id, m.actor_id): m for m in query.all()}
+
+    changes = []
+    for key, match in results.items():
+        row = stored.pop(key, None)
+        details = json.dumps(match["details"], default=str)
+        if row is None:
+            db.add(models.DetectionMatch(
+                use_case_id=key[0],
+                actor_id=key[1],
+                matched_conditions=match["matched_conditions"],
+                total_conditions=match["total_conditions"],
+                details=details,
+                matched_at=now,
+                updated_at=now
+            ))
+            changes.append({"use_case_id": key[0], "actor_id": key[1], "change": "ENTERED"})
+        else:
+            row.matched_conditions = match["matched_conditions"]
+            row.total_conditions = match["total_conditions"]
+            row.details = details
+            row.updated_at = now
+
+    for key, row in stored.items():
+        db.delete(row)
+        changes.append({"use_case_id": key[0], "actor_id": key[1], "change": "LEFT"})
+
+    for change in changes:
+        db.add(models.DetectionMatchEvent(**change, created_at=now))
+    if changes:
+        notify(db, "detections.changed", {"count": len(changes), "changes": changes[:100]})
+    return changes
+
+
+def technique_state(records) -> dict:
+    """technique_id -> (sightings, days) de las filas ActorTechnique activas."""
+    return {r.technique_id: (int(r.sightings_count or 0), int(r.seen_days_count or 0)) for r in records if r.active}
+
+
+def refresh_actor_matches(db: Session, actor_id: int, table: ActorTechniqueTable | None = None, now: datetime | None = None):
+    """
+    Reevalúa todos los casos de uso para un actor. `table` permite pasar el estado en
+    memoria (el collector lo hace antes del commit); sin ella se carga de BD. Sin commit.
+    """
+    now = now or datetime.utcnow()
+    rules = get_rules(db)
+    table = table or ActorTechniqueTable.load(db, actor_ids=[actor_id])
+    catalog = get_catalog(db)
+
+    results = {}
+    for uc in rules:
+        for match in match_use_case(uc, table, catalog, to_local=to_bogota_iso, actor_ids=[actor_id]):
+            results[(uc.id, actor_id)] = match
+    # los casos de uso deshabilitados o sin condiciones no dejan matches vivos
+    return _store_results(db, None, [actor_id], results, now)
+
+
+def refresh_use_case_matches(db: Session, use_case_id: int, now: datetime | None = None):
+    """Reevalúa un caso de uso completo (se creó, cambió o se borró). Sin commit."""
+    now = now or datetime.utcnow()
+    invalidate_rules()
+    compiled = [uc for uc in compile_use_cases(db, use_case_ids=[use_case_id], only_enabled=True) if uc.conditions]
+
+    results = {}
+    if compiled:
+        table = ActorTechniqueTable.load(db)
+        catalog = get_catalog(db)
+        for match in match_use_case(compiled[0], table, catalog, to_local=to_bogota_iso):
+            results[(use_case_id, match["actor_id"])] = match
+
+    changes = _store_results(db, [use_case_id], None, results, now)
+    db.query(models.DetectionUseCase)\
+        .filter(models.DetectionUseCase.id == use_case_id)\
+        .update({"matches_refreshed_at": now}, synchronize_session=False)
+    return changes
+
+
+def rebuild_detection_matches(db: Session, only_stale: bool = False):
+    """
+    Recalcula los matches de todos los casos de uso en una pasada. Con only_stale, solo
+    los que nunca se evaluaron o cambiaron después de la última evaluación. Hace commit.
+    """
+    query = db.query(models.DetectionUseCase.id)
+    if only_stale:
+        query = query.filter(
+            (models.DetectionUseCase.matches_refreshed_at == None) |
+            (models.DetectionUseCase.matches_refreshed_at < models.DetectionUseCase.updated_at)
+        )
+    use_case_ids = [uc_id for (uc_id,) in query.all()]
+    if not use_case_ids:
+        return []
+
+    now = datetime.utcnow()
+    invalidate_rules()
+    compiled = {uc.id: uc for uc in compile_use_cases(db, use_case_ids=use_case_ids, only_enabled=True) if uc.conditions}
+
+    results = {}
+    if compiled:
+        table = ActorTechniqueTable.load(db)
+        catalog = get_catalog(db)
+        for uc in compiled.values():
+            for match in match_use_case(uc, table, catalog, to_local=to_bogota_iso):
+                results[(uc.id, match["actor_id"])] = match
+
+    changes = _store_results(db, use_case_ids, None, results, now)
+    db.query(models.DetectionUseCase)\
+        .filter(models.DetectionUseCase.id.in_(use_case_ids))\
+        .update({"matches_refreshed_at": now}, synchronize_session=False)
+    db.commit()
+    return changes
+
+
+
+def stored_matches(db: Session, use_case_ids) -> dict:
+    """Lectura de detection_matches: use_case_id -> matches con la misma forma que match_use_case."""
+    rows = (
+        db.query(models.DetectionMatch, models.ThreatActor.name, models.ThreatActor.country)
+        .join(models.ThreatActor, models.ThreatActor.id == models.DetectionMatch.actor_id)
+        .filter(models.DetectionMatch.use_case_id.in_(list(use_case_ids) or [-1]))
+        .all()
+    )
+    results = {uc_id: [] for uc_id in use_case_ids}
+    for match, actor_name, country in rows:
+        results.setdefault(match.use_case_id, []).append({
+            "actor_id": match.actor_id,
+            "actor": actor_name,
+            "country": country,
+            "matched_conditions": match.matched_conditions,
+            "total_conditions": match.total_conditions,
+            "matched_at": to_bogota_iso(match.matched_at),
+            "details": json.loads(match.details) if match.details else []
+        })
+    for matches in results.values():
+        matches.sort(key=lambda x: (x["actor"] or "").lower())
+    return results
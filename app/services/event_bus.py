@@ -0,0 +1,148 @@
+import json
+import os
+import select
+import threading
+import time
+from datetime import date, datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.database import engine
+
+# un solo LISTEN por proceso reparte los eventos a todas las conexiones SSE de ese proceso;
+# NOTIFY desde cualquier worker/réplica llega a todos
+EVENT_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "cti_events")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_BUS_QUEUE_SIZE", "200"))
+
+# límite de payload de NOTIFY en Postgres: 8000 bytes
+_MAX_PAYLOAD = 7500
+_NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode(event_type: str, payload: dict) -> str:
+    body = json.dumps({"type": event_type, **(payload or {})}, default=_default)
+    if len(body) <= _MAX_PAYLOAD:
+        return body
+    # payload grande: mandamos solo los identificadores y el cliente consulta el resto
+    slim = {k: v for k, v in (payload or {}).items() if k in ("id", "job_id", "actor_id", "status", "count")}
+    return json.dumps({"type": event_type, "truncated": True, **slim}, default=_default)
+
+
+def notify(db: Session, event_type: str, payload: dict):
+    """NOTIFY dentro de la transacción de `db`: se entrega solo si se hace commit."""
+    db.execute(_NOTIFY_SQL, {"channel": EVENT_CHANNEL, "payload": _encode(event_type, payload)})
+
+
+def publish(event_type: str, payload: dict):
+    """NOTIFY inmediato en una conexión propia. Los errores no interrumpen al llamador."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(_NOTIFY_SQL, {"channel": EVENT_CHANNEL, "payload": _encode(event_type, payload)})
+    except Exception as e:
+        print("Event publish error:", event_type, e)
+
+
+class EventBus:
+    """Hilo LISTEN por proceso + colas asyncio por suscriptor (conexión SSE)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._thread = None
+
+    # -------------------------------------------------
+    # Suscripciones
+    # -------------------------------------------------
+    def subscribe(self, loop, topics: set[str] | None = None):
+        import asyncio
+
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[id(queue)] = (loop, queue, topics or None)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen_forever, name="event-bus", daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(id(queue), None)
+
+    @staticmethod
+    def _put(queue, event: dict):
+        # cliente lento: descartamos el evento más viejo, no bloqueamos al resto
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except Exception:
+                pass
+        queue.put_nowait(event)
+
+    def dispatch(self, event: dict):
+        topic = (event.get("type") or "").split(".", 1)[0]
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for loop, queue, topics in subscribers:
+            if topics and topic not in topics:
+                continue
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # loop cerrado: la conexión ya no existe
+                self.unsubscribe(queue)
+
+    # -------------------------------------------------
+    # LISTEN
+    # -------------------------------------------------
+    def _listen_forever(self):
+        backoff = 1.0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                print("Event bus listener error:", e)
+                time.sleep(backoff)
+                backoff = min(30.0, backoff * 2)
+
+    def _listen(self):
+        raw = engine.raw_connection()
+        # conexión dedicada: fuera del pool mientras escuche
+        raw.detach()
+        conn = getattr(raw, "driver_connection", None) or raw.connection
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f'LISTEN "{EVENT_CHANNEL}"')
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        return
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notification.payload)
+                    except ValueError:
+                        continue
+                    self.dispatch(event)
+        finally:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+
+# instancia del proceso
+event_bus = EventBus()
@@ -0,0 +1,126 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+
+BOGOTA_TZ = ZoneInfo("America/Bogota")
+
+Daily = models.IntelEventDaily
+
+
+def local_day(dt: datetime) -> date:
+    """Día en Bogotá de un datetime UTC naive (como se guardan en BD)."""
+    return dt.replace(tzinfo=timezone.utc).astimezone(BOGOTA_TZ).date()
+
+
+def local_today() -> date:
+    return datetime.now(BOGOTA_TZ).date()
+
+
+# -------------------------------------------------
+# Mantenimiento en escritura (un escaneo de actor)
+# -------------------------------------------------
+class EventRollup:
+    """Acumula los eventos de un escaneo y los suma al rollup diario con un solo upsert."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, actor_id: int, technique_id: int, event_type: str, at: datetime):
+        key = (local_day(at), event_type, actor_id, technique_id)
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = {"events": 1, "first_at": at, "last_at": at}
+            return
+        row["events"] += 1
+        row["first_at"] = min(row["first_at"], at)
+        row["last_at"] = max(row["last_at"], at)
+
+    def new_events(self):
+        """(actor_id, technique_id, primer timestamp) de los NEW acumulados."""
+        return [
+            (actor_id, technique_id, row["first_at"])
+            for (_, event_type, actor_id, technique_id), row in self.rows.items()
+            if event_type == "NEW"
+        ]
+
+    def flush(self, db: Session):
+        """No hace commit: viaja con la transacción de los eventos."""
+        if not self.rows:
+            return
+        table = Daily.__table__
+        stmt = insert(Daily).values([
+            {
+                "day": day,
+                "event_type": event_type,
+                "actor_id": actor_id,
+                "technique_id": technique_id,
+                **row
+            }
+            for (day, event_type, actor_id, technique_id), row in self.rows.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.event_type, table.c.actor_id, table.c.technique_id],
+            set_={
+                "events": table.c.events + stmt.excluded.events,
+                "first_at": func.least(table.c.first_at, stmt.excluded.first_at),
+                "last_at": func.greatest(table.c.last_at, stmt.excluded.last_at),
+            }
+        )
+        db.execute(stmt)
+        self.rows = {}
+
+
+# -------------------------------------------------
+# Backfill
+# -------------------------------------------------
+def rebuild_event_rollup(db: Session, days: int | None = None):
+    """
+    Recalcula el rollup desde intelligence_events con un INSERT … SELECT agrupado.
+    days=None reconstruye todo; si no, solo los últimos `days` días locales. Hace commit.
+    """
+    E = models.IntelligenceEvent
+    day_expr = func.date(func.timezone("America/Bogota", func.timezone("UTC", E.created_at)))
+
+    source = (
+        select(
+            day_expr.label("day"),
+            E.event_type,
+            E.actor_id,
+            E.technique_id,
+            func.count(E.id).label("events"),
+            func.min(E.created_at).label("first_at"),
+            func.max(E.created_at).label("last_at")
+        )
+        .where(E.created_at != None)
+        .where(E.event_type != None)
+        .where(E.actor_id != None)
+        .where(E.technique_id != None)
+        .group_by(day_expr, E.event_type, E.actor_id, E.technique_id)
+    )
+
+    stale = db.query(Daily)
+    if days is not None:
+        since_day = local_today() - timedelta(days=max(0, int(days)))
+        # el día local empieza a las 00:00 Bogotá: en UTC, 5 h después
+        since_utc = datetime.combine(since_day, datetime.min.time(), BOGOTA_TZ).astimezone(timezone.utc).replace(tzinfo=None)
+        source = source.where(E.created_at >= since_utc)
+        stale = stale.filter(Daily.day >= since_day)
+
+    stale.delete(synchronize_session=False)
+    result = db.execute(
+        insert(Daily).from_select(
+            ["day", "event_type", "actor_id", "technique_id", "events", "first_at", "last_at"],
+            source
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def rollup_is_empty(db: Session) -> bool:
+    if db.query(Daily.day).limit(1).first():
+        return False
+    return db.query(models.IntelligenceEvent.id).limit(1).first() is not None
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+
+from app import models
+from app.database import SessionLocal
+
+
+def _split(value: str | None) -> set[str]:
+    return {x for x in (value or "").split(",") if x}
+
+
+def load_cached_techniques(hashes, max_age_days: int) -> dict[str, set[str]]:
+    """Técnicas MITRE ya extraídas por hash de sample, solo si no superan max_age_days."""
+    hashes = [h for h in set(hashes or []) if h]
+    if not hashes or max_age_days <= 0:
+        return {}
+
+    since = datetime.utcnow() - timedelta(days=max_age_days)
+
+    # sesión propia: se llama desde los hilos del collector
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(models.FileBehaviourCache.sample_hash, models.FileBehaviourCache.techniques)
+            .filter(models.FileBehaviourCache.sample_hash.in_(hashes))
+            .filter(models.FileBehaviourCache.fetched_at >= since)
+            .all()
+        )
+    finally:
+        db.close()
+
+    return {sample_hash: _split(techniques) for sample_hash, techniques in rows}
+
+
+def store_techniques(results: dict[str, set[str]]):
+    if not results:
+        return
+
+    now = datetime.utcnow()
+    values = [
+        {"sample_hash": h, "techniques": ",".join(sorted(techs)), "fetched_at": now}
+        for h, techs in results.items()
+    ]
+
+    stmt = insert(models.FileBehaviourCache).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.FileBehaviourCache.sample_hash],
+        set_={"techniques": stmt.excluded.techniques, "fetched_at": stmt.excluded.fetched_at}
+    )
+
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    finally:
+        db.close()
@@ -1,11 +1,29 @@
 import os
-import requests
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
 from dotenv import load_dotenv
 
 from app import models
-from app.services.alert_engine import generate_alert
+from app.database import SessionLocal
+from app.services import collection_queue
+from app.services.alert_engine import AlertBatch, generate_alert
+from app.services.country_cube import refresh_country_cube
+from app.services.event_rollup import EventRollup
+from app.services.tactic_first_seen import record_new_events
+from app.services.detection_engine import ActorTechniqueTable, get_rules, match_relevant, refresh_actor_matches, technique_state
+from app.services.file_behaviour_cache import load_cached_techniques, store_techniques
+from app.services.http_client import connector_client
+from app.services.rate_limiter import RequestBudget, SharedTokenBucket
+from app.services.technique_catalog import get_catalog, split_tactics
+from app.services.risk_score import calculate_risk_by_country
+from app.services.risk_state import RiskStateDelta, apply_risk_delta
 from app.services.risk_tracker import store_snapshot, detect_risk_change
 
 # -------------------------------------------------
@@ -20,7 +38,7 @@ HEADERS = {
     "accept": "application/json"
 }
 
-BASE = "https://www.virustotal.com/api/v3"
+BASE = os.getenv("VT_API_BASE", "https://www.virustotal.com/api/v3").rstrip("/")
 FILES_FALLBACK_LIMIT = int(os.getenv("VT_FILES_FALLBACK_LIMIT", "40"))
 SCAN_MIN_INTERVAL_MINUTES = int(os.getenv("VT_SCAN_MIN_INTERVAL_MINUTES", "60"))
 NEW_ALERT_MIN_SIGHTINGS = int(os.getenv("NEW_ALERT_MIN_SIGHTINGS", "3"))
@@ -33,6 +51,41 @@ WATCHLIST_TECHNIQUES = {
 WATCHLIST_MIN_SIGHTINGS = int(os.getenv("WATCHLIST_MIN_SIGHTINGS", "1"))
 WATCHLIST_MIN_DISTINCT_DAYS = int(os.getenv("WATCHLIST_MIN_DISTINCT_DAYS", "1"))
 NEW_ALERT_TACTIC_THRESHOLD_OVERRIDES = os.getenv("NEW_ALERT_TACTIC_THRESHOLD_OVERRIDES", "")
+VT_TIMEOUT_SECONDS = int(os.getenv("VT_TIMEOUT_SECONDS", "30"))
+COLLECTOR_CONCURRENCY = max(1, int(os.getenv("VT_COLLECTOR_CONCURRENCY", "8")))
+VT_RATE_LIMIT_PER_MINUTE = int(os.getenv("VT_RATE_LIMIT_PER_MINUTE", "240"))
+VT_RATE_LIMIT_BURST = int(os.getenv("VT_RATE_LIMIT_BURST", "20"))
+# tokens que cada proceso retira de la fila compartida por viaje a la BD
+VT_RATE_LIMIT_BATCH = max(1, int(os.getenv("VT_RATE_LIMIT_BATCH", "5")))
+VT_HOST_CONCURRENCY = int(os.getenv("VT_HOST_CONCURRENCY", "16"))
+VT_COLLECTION_ID_TTL_HOURS = int(os.getenv("VT_COLLECTION_ID_TTL_HOURS", "168"))
+VT_COLLECTION_NOT_FOUND_TTL_HOURS = int(os.getenv("VT_COLLECTION_NOT_FOUND_TTL_HOURS", "24"))
+FILE_BEHAVIOUR_CACHE_DAYS = int(os.getenv("VT_FILE_BEHAVIOUR_CACHE_DAYS", "30"))
+FILES_FETCH_CONCURRENCY = max(1, int(os.getenv("VT_FILES_FETCH_CONCURRENCY", "8")))
+VT_RUN_REQUEST_BUDGET = int(os.getenv("VT_RUN_REQUEST_BUDGET", "0"))
+COLLECTION_DRAIN_POLL_SECONDS = float(os.getenv("COLLECTION_DRAIN_POLL_SECONDS", "5"))
+
+# pesos del puntaje de prioridad de escaneo
+PRIORITY_STALENESS_CAP_HOURS = 168
+PRIORITY_WEIGHT_STALENESS = 1.0      # por hora sin escanear (tope 7 días)
+PRIORITY_WEIGHT_ACTIVITY = 5.0       # por evento NEW/REACTIVATED en 7 días
+PRIORITY_WEIGHT_PROJECT_TAG = 10.0   # por proyecto de cliente etiquetado
+PRIORITY_WEIGHT_WATCHLIST = 8.0      # por técnica activa de la watchlist
+PRIORITY_CARRY_OVER_BONUS = 1000.0   # diferidos por presupuesto en la corrida anterior
+
+# cuota compartida por todos los hilos y procesos que consultan VT/GTI (fila en rate_limit_buckets)
+VT_RATE_LIMITER = SharedTokenBucket(
+    "vt",
+    VT_RATE_LIMIT_PER_MINUTE,
+    session_factory=SessionLocal,
+    model=models.RateLimitBucket,
+    burst=VT_RATE_LIMIT_BURST,
+    batch=VT_RATE_LIMIT_BATCH
+)
+connector_client.set_host_concurrency(urlsplit(BASE).netloc, VT_HOST_CONCURRENCY)
+
+# presupuesto de la corrida en curso para el hilo actual (ver _fetch_with_budget)
+_fetch_context = threading.local()
 
 
 def _parse_tactic_overrides(raw: str):
@@ -57,16 +110,30 @@ def _parse_tactic_overrides(raw: str):
 TACTIC_THRESHOLD_OVERRIDES = _parse_tactic_overrides(NEW_ALERT_TACTIC_THRESHOLD_OVERRIDES)
 
 
+def _vt_get(url: str, params: dict | None = None):
+    budget = getattr(_fetch_context, "budget", None)
+    if budget is not None:
+        budget.charge()
+    return connector_client.get(
+        url,
+        headers=HEADERS,
+        params=params,
+        timeout=VT_TIMEOUT_SECONDS,
+        rate_limiter=VT_RATE_LIMITER
+    )
+
+
 # -------------------------------------------------
 # Obtener collection ID del actor
 # -------------------------------------------------
-def resolve_collection_id(actor):
+def resolve_collection_id_status(actor):
+    """Devuelve (collection_id, status) con status FOUND | NOT_FOUND | ERROR."""
     # Prefer GTI/VT collection ID only if it is valid in VT.
     candidate = (getattr(actor, "gti_id", None) or "").strip()
     if candidate:
-        probe = requests.get(f"{BASE}/collections/{candidate}", headers=HEADERS)
+        probe = _vt_get(f"{BASE}/collections/{candidate}")
         if probe.status_code == 200:
-            return candidate
+            return candidate, "FOUND"
         print("Provided gti_id is not a VT collection id:", candidate, "status:", probe.status_code)
 
     url = f"{BASE}/intelligence/search"
@@ -76,18 +143,41 @@ def resolve_collection_id(actor):
         "limit": 1
     }
 
-    r = requests.get(url, headers=HEADERS, params=params)
+    r = _vt_get(url, params=params)
 
     if r.status_code != 200:
         print("Search error:", r.status_code, r.text)
-        return None
+        return None, "ERROR"
 
     data = r.json().get("data", [])
     if not data:
         print("No results for", actor.name)
-        return None
+        return None, "NOT_FOUND"
+
+    return data[0]["id"], "FOUND"
+
 
-    return data[0]["id"]
+def resolve_collection_id(actor):
+    collection_id, _ = resolve_collection_id_status(actor)
+    return collection_id
+
+
+def cached_collection_resolution(actor, now: datetime):
+    """Devuelve (collection_id, status) si la resolución guardada sigue vigente, si no (None, None)."""
+    status = getattr(actor, "vt_collection_status", None)
+    resolved_at = getattr(actor, "vt_collection_resolved_at", None)
+    if not status or not resolved_at:
+        return None, None
+
+    if status == "FOUND":
+        collection_id = getattr(actor, "vt_collection_id", None)
+        if collection_id and now - resolved_at < timedelta(hours=VT_COLLECTION_ID_TTL_HOURS):
+            return collection_id, status
+    elif status == "NOT_FOUND":
+        if now - resolved_at < timedelta(hours=VT_COLLECTION_NOT_FOUND_TTL_HOURS):
+            return None, status
+
+    return None, None
 
 
 # -------------------------------------------------
@@ -104,7 +194,7 @@ def fetch_actor_ttps(collection_id: str):
 
     while url:
 
-        r = requests.get(url, headers=HEADERS, params=params)
+        r = _vt_get(url, params=params)
 
         if r.status_code != 200:
             print("TTP error:", r.status_code, r.text)
@@ -128,7 +218,7 @@ def fetch_actor_file_hashes(collection_id: str, limit: int = FILES_FALLBACK_LIMI
     hashes = []
 
     while url and len(hashes) < limit:
-        r = requests.get(url, headers=HEADERS, params=params)
+        r = _vt_get(url, params=params)
 
         if r.status_code != 200:
             print("Files error:", r.status_code, r.text)
@@ -145,11 +235,16 @@ def fetch_actor_file_hashes(collection_id: str, limit: int = FILES_FALLBACK_LIMI
 
 
 def fetch_file_mitre_techniques(file_hash: str):
+    techniques, _ = fetch_file_mitre_techniques_status(file_hash)
+    return techniques
+
+
+def fetch_file_mitre_techniques_status(file_hash: str):
     url = f"{BASE}/files/{file_hash}/behaviour_mitre_trees"
-    r = requests.get(url, headers=HEADERS)
+    r = _vt_get(url)
 
     if r.status_code != 200:
-        return set()
+        return set(), r.status_code
 
     techniques = set()
     data = r.json().get("data", {})
@@ -161,7 +256,45 @@ def fetch_file_mitre_techniques(file_hash: str):
                 if tech_id:
                     techniques.add(tech_id)
 
-    return techniques
+    return techniques, r.status_code
+
+
+def fetch_files_mitre_techniques(hashes) -> dict[str, set[str]]:
+    """
+    Técnicas por hash de sample. El reporte de comportamiento de un sha256 casi no cambia,
+    así que se reutiliza el cache local y solo se consultan en paralelo los faltantes.
+    """
+    result = load_cached_techniques(hashes, FILE_BEHAVIOUR_CACHE_DAYS)
+    misses = [h for h in dict.fromkeys(hashes) if h not in result]
+    if not misses:
+        return result
+
+    # los hilos del pool cargan sus requests al presupuesto de la corrida del actor
+    budget = getattr(_fetch_context, "budget", None)
+
+    def _fetch(h):
+        _fetch_context.budget = budget
+        try:
+            return fetch_file_mitre_techniques_status(h)
+        finally:
+            _fetch_context.budget = None
+
+    to_cache = {}
+    with ThreadPoolExecutor(max_workers=min(FILES_FETCH_CONCURRENCY, len(misses)), thread_name_prefix="gti-files") as pool:
+        for h, (techniques, status_code) in zip(misses, pool.map(_fetch, misses)):
+            result[h] = techniques
+            # 404 = sample sin reporte de comportamiento; los demás errores no se cachean
+            if status_code in (200, 404):
+                to_cache[h] = techniques
+
+    if FILE_BEHAVIOUR_CACHE_DAYS > 0 and to_cache:
+        try:
+            store_techniques(to_cache)
+        except Exception as e:
+            print("File behaviour cache write error:", e)
+
+    print(f"Files behaviour: {len(hashes)} samples | cache hits: {len(hashes) - len(misses)} | fetched: {len(misses)}")
+    return result
 
 
 def fetch_actor_ttps_from_files(collection_id: str):
@@ -169,10 +302,12 @@ def fetch_actor_ttps_from_files(collection_id: str):
     if hash_err:
         return [], {}, hash_err
 
+    techniques_by_hash = fetch_files_mitre_techniques(hashes)
+
     all_ttps = set()
     evidence_map = {}
     for h in hashes:
-        ttps = fetch_file_mitre_techniques(h)
+        ttps = techniques_by_hash.get(h, set())
         all_ttps.update(ttps)
         for tech_code in ttps:
             if tech_code not in evidence_map:
@@ -186,10 +321,10 @@ def get_confirmation_thresholds(technique, tech_code: str):
     if (tech_code or "").upper() in WATCHLIST_TECHNIQUES:
         return WATCHLIST_MIN_SIGHTINGS, WATCHLIST_MIN_DISTINCT_DAYS, "watchlist"
 
-    tactic_value = ""
+    # entradas del catálogo: tácticas ya normalizadas al cargarlo
+    tactic_names = ()
     if technique is not None:
-        tactic_value = technique.tactic or ""
-    tactic_names = [x.strip().lower() for x in tactic_value.split(",") if x.strip()]
+        tactic_names = getattr(technique, "tactics", None) or split_tactics(technique.tactic)
     matches = [TACTIC_THRESHOLD_OVERRIDES[t] for t in tactic_names if t in TACTIC_THRESHOLD_OVERRIDES]
     if matches:
         # si una técnica participa en varias tácticas, usamos la regla más sensible
@@ -200,72 +335,103 @@ def get_confirmation_thresholds(technique, tech_code: str):
     return NEW_ALERT_MIN_SIGHTINGS, NEW_ALERT_MIN_DISTINCT_DAYS, "default"
 
 
-def store_evidence(db: Session, actor_id: int, technique_id: int, hashes: set[str], source: str):
-    if not hashes:
+def evidence_rows(actor_id: int, technique_id: int, hashes: set[str], source: str, observed_at: datetime):
+    return [
+        {
+            "actor_id": actor_id,
+            "technique_id": technique_id,
+            "sample_hash": h,
+            "source": source,
+            "observed_at": observed_at
+        }
+        for h in sorted(hashes or ())
+        if h
+    ]
+
+
+def store_evidence_rows(db: Session, rows: list[dict]):
+    """Un solo INSERT ... ON CONFLICT DO NOTHING sobre (actor_id, technique_id, sample_hash). No hace commit."""
+    if not rows:
         return 0
-    inserted = 0
-    for h in hashes:
-        exists = (
-            db.query(models.TechniqueEvidence.id)
-            .filter(models.TechniqueEvidence.actor_id == actor_id)
-            .filter(models.TechniqueEvidence.technique_id == technique_id)
-            .filter(models.TechniqueEvidence.sample_hash == h)
-            .first()
-        )
-        if exists:
-            continue
-        db.add(models.TechniqueEvidence(
-            actor_id=actor_id,
-            technique_id=technique_id,
-            sample_hash=h,
-            source=source,
-            observed_at=datetime.utcnow()
-        ))
-        inserted += 1
-    return inserted
+    stmt = insert(models.TechniqueEvidence).values(rows).on_conflict_do_nothing(
+        index_elements=[
+            models.TechniqueEvidence.actor_id,
+            models.TechniqueEvidence.technique_id,
+            models.TechniqueEvidence.sample_hash
+        ]
+    )
+    return db.execute(stmt).rowcount or 0
+
+
+def store_evidence(db: Session, actor_id: int, technique_id: int, hashes: set[str], source: str):
+    return store_evidence_rows(db, evidence_rows(actor_id, technique_id, hashes, source, datetime.utcnow()))
+
+
+def _error_result(error: str, source: str | None = None):
+    result = {
+        "status": "error",
+        "error": error,
+        "total": 0,
+        "inserted": 0,
+        "new_confirmed": 0,
+        "new_pending": 0,
+        "reactivated": 0,
+        "disabled": 0,
+        "missing_mitre": 0
+    }
+    if source:
+        result["source"] = source
+    return result
+
+
+def _actor_ref(actor):
+    # copia plana del actor para usarla fuera del hilo dueño de la sesión
+    return SimpleNamespace(
+        id=actor.id,
+        name=actor.name,
+        gti_id=actor.gti_id,
+        country=actor.country,
+        vt_collection_id=actor.vt_collection_id,
+        vt_collection_status=actor.vt_collection_status,
+        vt_collection_resolved_at=actor.vt_collection_resolved_at
+    )
 
 
 # -------------------------------------------------
-# Actualizar TTPs en base de datos
+# Consultar GTI (solo red, sin BD: se puede ejecutar en paralelo)
 # -------------------------------------------------
-def update_actor_ttps(db: Session, actor):
+def fetch_actor_intel(actor):
 
-    now = datetime.utcnow()
+    collection_id, cached_status = cached_collection_resolution(actor, datetime.utcnow())
+    resolution = None
 
-    print(f"\n=== ACTOR: {actor.name} ===")
+    if cached_status == "NOT_FOUND":
+        return {"status": "error", "error": "NOT_FOUND", "source": None, "collection_cached": True}
 
-    collection_id = resolve_collection_id(actor)
     if not collection_id:
-        return {
-            "status": "error",
-            "error": "NOT_FOUND",
-            "total": 0,
-            "inserted": 0,
-            "new_confirmed": 0,
-            "new_pending": 0,
-            "reactivated": 0,
-            "disabled": 0,
-            "missing_mitre": 0
-        }
+        collection_id, status = resolve_collection_id_status(actor)
+        if status != "ERROR":
+            resolution = {"collection_id": collection_id, "status": status}
+        if not collection_id:
+            return {"status": "error", "error": "NOT_FOUND", "source": None, "resolution": resolution}
 
     ttps, err = fetch_actor_ttps(collection_id)
+
+    if err == "TTP_HTTP_404" and cached_status:
+        # la collection guardada ya no existe en VT: invalidamos y resolvemos de nuevo
+        print("Cached collection id no longer valid:", collection_id)
+        collection_id, status = resolve_collection_id_status(actor)
+        resolution = {"collection_id": collection_id, "status": status} if status != "ERROR" else {"collection_id": None, "status": None}
+        if not collection_id:
+            return {"status": "error", "error": "NOT_FOUND", "source": None, "resolution": resolution}
+        ttps, err = fetch_actor_ttps(collection_id)
+
     source = "attack_techniques"
     fallback_evidence_map = {}
 
     if err:
         # Si falla este endpoint, no marcamos técnicas como desaparecidas por un error temporal.
-        return {
-            "status": "error",
-            "error": err,
-            "source": source,
-            "total": 0,
-            "inserted": 0,
-            "new_confirmed": 0,
-            "new_pending": 0,
-            "reactivated": 0,
-            "disabled": 0,
-            "missing_mitre": 0
-        }
+        return {"status": "error", "error": err, "source": source, "resolution": resolution}
 
     if not ttps:
         fallback_ttps, fallback_evidence_map, fallback_err = fetch_actor_ttps_from_files(collection_id)
@@ -274,28 +440,92 @@ def update_actor_ttps(db: Session, actor):
                 "status": "error",
                 "error": fallback_err,
                 "source": "files_behaviour_mitre_trees",
-                "total": 0,
-                "inserted": 0,
-                "new_confirmed": 0,
-                "new_pending": 0,
-                "reactivated": 0,
-                "disabled": 0,
-                "missing_mitre": 0
+                "resolution": resolution
             }
-        if not fallback_err and fallback_ttps:
+        if fallback_ttps:
             ttps = fallback_ttps
             source = "files_behaviour_mitre_trees"
 
+    return {
+        "status": "ok",
+        "error": None,
+        "collection_id": collection_id,
+        "resolution": resolution,
+        "source": source,
+        "ttps": ttps,
+        "evidence_map": fallback_evidence_map
+    }
+
+
+def _store_collection_resolution(actor, resolution: dict | None, now: datetime) -> bool:
+    if not resolution:
+        return False
+    status = resolution.get("status")
+    actor.vt_collection_id = resolution.get("collection_id")
+    actor.vt_collection_status = status
+    actor.vt_collection_resolved_at = now if status else None
+    return True
+
+
+def _record_event(db: Session, delta: RiskStateDelta, rollup: EventRollup, actor_id: int, technique_id: int, event_type: str, now: datetime):
+    db.add(models.IntelligenceEvent(
+        actor_id=actor_id,
+        technique_id=technique_id,
+        event_type=event_type,
+        created_at=now
+    ))
+    delta.event(technique_id, event_type)
+    rollup.add(actor_id, technique_id, event_type, now)
+
+
+# -------------------------------------------------
+# Actualizar TTPs en base de datos
+# -------------------------------------------------
+def update_actor_ttps(db: Session, actor):
+    intel = fetch_actor_intel(_actor_ref(actor))
+    return apply_actor_ttps(db, actor, intel)
+
+
+def apply_actor_ttps(db: Session, actor, intel: dict):
+
+    now = datetime.utcnow()
+
+    print(f"\n=== ACTOR: {actor.name} ===")
+
+    _store_collection_resolution(actor, intel.get("resolution"), now)
+    actor.last_scanned_at = now
+    actor.last_scan_status = "ok" if intel.get("status") == "ok" else "error"
+
+    if intel.get("status") != "ok":
+        db.commit()
+        return _error_result(intel.get("error") or "UNKNOWN", intel.get("source"))
+
+    err = intel.get("error")
+    ttps = intel.get("ttps") or []
+    source = intel.get("source")
+    fallback_evidence_map = intel.get("evidence_map") or {}
+
     print("TTPs desde GTI:", len(ttps), "| source:", source)
 
+    catalog = get_catalog(db)
+
     # TTPs actuales en BD
     existing = db.query(models.ActorTechnique)\
         .filter(models.ActorTechnique.actor_id == actor.id)\
         .all()
 
-    existing_map = {at.technique.tech_id: at for at in existing}
+    existing_map = {}
+    for at in existing:
+        entry = catalog.get_by_id(at.technique_id)
+        existing_map[entry.tech_id if entry else at.technique.tech_id] = at
 
+    techniques_before = technique_state(existing)
+    added = []
     seen_today = set()
+    # el estado de riesgo por país solo cuenta actores activos
+    delta = RiskStateDelta(actor.id, actor.country if actor.active else None)
+    alerts = AlertBatch(db, actor.id)
+    rollup = EventRollup()
 
     inserted = 0
     new_confirmed = 0
@@ -304,15 +534,14 @@ def update_actor_ttps(db: Session, actor):
     disabled = 0
     missing_mitre = 0
     evidence_added = 0
+    pending_evidence = []
 
     # -------------------------------------------------
     # NUEVAS Y REACTIVADAS
     # -------------------------------------------------
     for tech_code in ttps:
 
-        technique = db.query(models.Technique)\
-            .filter(models.Technique.tech_id == tech_code)\
-            .first()
+        technique = catalog.get(tech_code)
 
         if not technique:
             print("NO EXISTE EN MITRE:", tech_code)
@@ -337,34 +566,32 @@ def update_actor_ttps(db: Session, actor):
             )
 
             db.add(new)
+            added.append(new)
+            delta.activated(technique.id, now)
             inserted += 1
             new_pending += 1
 
             min_sightings, min_days, _ = get_confirmation_thresholds(technique, tech_code)
             if min_sightings <= 1 and min_days <= 1:
                 new.new_alert_sent = True
-                db.add(models.IntelligenceEvent(
-                    actor_id=actor.id,
-                    technique_id=technique.id,
-                    event_type="NEW",
-                    created_at=now
-                ))
+                _record_event(db, delta, rollup, actor.id, technique.id, "NEW", now)
                 generate_alert(
                     db,
                     actor,
                     technique,
                     "NEW",
-                    context=f"NEW confirmed ({1}/{min_sightings} observations, {1}/{min_days} days). source={source}"
+                    context=f"NEW confirmed ({1}/{min_sightings} observations, {1}/{min_days} days). source={source}",
+                    batch=alerts
                 )
                 new_confirmed += 1
                 new_pending -= 1
                 if source == "files_behaviour_mitre_trees":
-                    evidence_added += store_evidence(
-                        db,
+                    pending_evidence += evidence_rows(
                         actor.id,
                         technique.id,
                         fallback_evidence_map.get(tech_code, set()),
-                        source
+                        source,
+                        now
                     )
 
         # ---------------- REACTIVATED ----------------
@@ -387,15 +614,11 @@ def update_actor_ttps(db: Session, actor):
 
             if not record.active:
                 record.active = True
+                delta.activated(technique.id, record.first_seen)
 
-                db.add(models.IntelligenceEvent(
-                    actor_id=actor.id,
-                    technique_id=technique.id,
-                    event_type="REACTIVATED",
-                    created_at=now
-                ))
+                _record_event(db, delta, rollup, actor.id, technique.id, "REACTIVATED", now)
 
-                generate_alert(db, actor, technique, "REACTIVATED", context="Technique reactivated after inactivity")
+                generate_alert(db, actor, technique, "REACTIVATED", context="Technique reactivated after inactivity", batch=alerts)
                 reactivated += 1
             elif not record.new_alert_sent:
                 sightings = record.sightings_count or 0
@@ -403,27 +626,23 @@ def update_actor_ttps(db: Session, actor):
                 min_sightings, min_days, _ = get_confirmation_thresholds(technique, tech_code)
                 if sightings >= min_sightings and seen_days >= min_days:
                     record.new_alert_sent = True
-                    db.add(models.IntelligenceEvent(
-                        actor_id=actor.id,
-                        technique_id=technique.id,
-                        event_type="NEW",
-                        created_at=now
-                    ))
+                    _record_event(db, delta, rollup, actor.id, technique.id, "NEW", now)
                     generate_alert(
                         db,
                         actor,
                         technique,
                         "NEW",
-                        context=f"NEW confirmed ({sightings}/{min_sightings} observations, {seen_days}/{min_days} days). source={source}"
+                        context=f"NEW confirmed ({sightings}/{min_sightings} observations, {seen_days}/{min_days} days). source={source}",
+                        batch=alerts
                     )
                     new_confirmed += 1
                     if source == "files_behaviour_mitre_trees":
-                        evidence_added += store_evidence(
-                            db,
+                        pending_evidence += evidence_rows(
                             actor.id,
                             technique.id,
                             fallback_evidence_map.get(tech_code, set()),
-                            source
+                            source,
+                            now
                         )
 
     # -------------------------------------------------
@@ -434,17 +653,26 @@ def update_actor_ttps(db: Session, actor):
         if code not in seen_today and record.active:
 
             record.active = False
+            delta.deactivated(record.technique_id, record.first_seen)
 
-            db.add(models.IntelligenceEvent(
-                actor_id=actor.id,
-                technique_id=record.technique_id,
-                event_type="DISAPPEARED",
-                created_at=now
-            ))
+            _record_event(db, delta, rollup, actor.id, record.technique_id, "DISAPPEARED", now)
 
-            generate_alert(db, actor, record.technique, "DISAPPEARED", context="Technique no longer observed in current collection window")
+            technique = catalog.get_by_id(record.technique_id) or record.technique
+            generate_alert(db, actor, technique, "DISAPPEARED", context="Technique no longer observed in current collection window", batch=alerts)
             disabled += 1
 
+    apply_risk_delta(db, delta)
+    record_new_events(db, catalog, rollup.new_events())
+    rollup.flush(db)
+    alerts.flush(db)
+    evidence_added = store_evidence_rows(db, pending_evidence)
+
+    # detecciones: solo se reevalúa si algún cambio cruza el umbral de alguna condición
+    records = existing + added
+    detection_changes = 0
+    if actor.active and match_relevant(get_rules(db), techniques_before, technique_state(records)):
+        table = ActorTechniqueTable.from_records(actor, records)
+        detection_changes = len(refresh_actor_matches(db, actor.id, table=table, now=now))
     db.commit()
 
     print("Insertadas:", inserted)
@@ -453,6 +681,7 @@ def update_actor_ttps(db: Session, actor):
     print("Reactivadas:", reactivated)
     print("Desactivadas:", disabled)
     print("Evidencias:", evidence_added)
+    print("Cambios de detección:", detection_changes)
 
     return {
         "status": "ok",
@@ -465,67 +694,437 @@ def update_actor_ttps(db: Session, actor):
         "reactivated": reactivated,
         "disabled": disabled,
         "missing_mitre": missing_mitre,
-        "evidence_added": evidence_added
+        "evidence_added": evidence_added,
+        "detection_changes": detection_changes
     }
 
 
-def should_scan_actor(db: Session, actor_id: int, now: datetime) -> bool:
+def scan_decision(last_scanned_at: datetime | None, last_scan_status: str | None, now: datetime):
+    """Devuelve (escanear, motivo) para un actor."""
     # 0 o negativo = siempre escanear (sin throttling)
     if SCAN_MIN_INTERVAL_MINUTES <= 0:
-        return True
+        return True, "throttling_disabled"
+
+    if not last_scanned_at:
+        return True, "never_scanned"
+
+    if last_scan_status == "error":
+        return True, "retry_after_error"
+
+    if (now - last_scanned_at) >= timedelta(minutes=SCAN_MIN_INTERVAL_MINUTES):
+        return True, "interval_elapsed"
+
+    return False, "scanned_recently"
+
 
+def priority_score(last_scanned_at: datetime | None, activity: int, project_tags: int, watchlist_hits: int, carried_over: bool, now: datetime) -> float:
+    if last_scanned_at:
+        stale_hours = min(PRIORITY_STALENESS_CAP_HOURS, max(0.0, (now - last_scanned_at).total_seconds() / 3600))
+    else:
+        stale_hours = PRIORITY_STALENESS_CAP_HOURS
+
+    return round(
+        stale_hours * PRIORITY_WEIGHT_STALENESS
+        + activity * PRIORITY_WEIGHT_ACTIVITY
+        + project_tags * PRIORITY_WEIGHT_PROJECT_TAG
+        + watchlist_hits * PRIORITY_WEIGHT_WATCHLIST
+        + (PRIORITY_CARRY_OVER_BONUS if carried_over else 0.0),
+        2
+    )
+
+
+def plan_collection(db: Session, now: datetime):
+    """
+    Planifica la corrida con una sola consulta: actores activos + último escaneo +
+    señales de prioridad (actividad 7d, proyectos de cliente, hits de watchlist).
+    Para actores anteriores a last_scanned_at se usa max(last_collected) de sus TTPs.
+    Devuelve [(actor, escanear, motivo, prioridad)] con los escaneos primero, de mayor
+    a menor prioridad, y deja la decisión registrada en el actor (sin commit).
+    """
     last_collected = (
-        db.query(models.ActorTechnique.last_collected)
-        .filter(models.ActorTechnique.actor_id == actor_id)
-        .order_by(models.ActorTechnique.last_collected.desc())
-        .limit(1)
-        .scalar()
+        db.query(
+            models.ActorTechnique.actor_id.label("actor_id"),
+            func.max(models.ActorTechnique.last_collected).label("last_collected")
+        )
+        .group_by(models.ActorTechnique.actor_id)
+        .subquery()
+    )
+    project_tags = (
+        db.query(
+            models.ActorProjectTag.actor_id.label("actor_id"),
+            func.count(models.ActorProjectTag.id).label("project_tags")
+        )
+        .group_by(models.ActorProjectTag.actor_id)
+        .subquery()
     )
 
-    if not last_collected:
-        return True
+    catalog = get_catalog(db)
+    watchlist_ids = [e.id for e in (catalog.get(code) for code in WATCHLIST_TECHNIQUES) if e]
+    watchlist_hits = (
+        db.query(
+            models.ActorTechnique.actor_id.label("actor_id"),
+            func.count(models.ActorTechnique.id).label("watchlist_hits")
+        )
+        .filter(models.ActorTechnique.active == True)
+        .filter(models.ActorTechnique.technique_id.in_(watchlist_ids or [-1]))
+        .group_by(models.ActorTechnique.actor_id)
+        .subquery()
+    )
 
-    return (now - last_collected) >= timedelta(minutes=SCAN_MIN_INTERVAL_MINUTES)
+    rows = (
+        db.query(
+            models.ThreatActor,
+            last_collected.c.last_collected,
+            models.ActorRiskState.new_7d,
+            models.ActorRiskState.reactivated_7d,
+            project_tags.c.project_tags,
+            watchlist_hits.c.watchlist_hits
+        )
+        .outerjoin(last_collected, last_collected.c.actor_id == models.ThreatActor.id)
+        .outerjoin(models.ActorRiskState, models.ActorRiskState.actor_id == models.ThreatActor.id)
+        .outerjoin(project_tags, project_tags.c.actor_id == models.ThreatActor.id)
+        .outerjoin(watchlist_hits, watchlist_hits.c.actor_id == models.ThreatActor.id)
+        .filter(models.ThreatActor.active == True)
+        .order_by(models.ThreatActor.id)
+        .all()
+    )
+
+    plan = []
+    for actor, collected_at, new_7d, reactivated_7d, tags, hits in rows:
+        last_scanned_at = actor.last_scanned_at or collected_at
+        carried_over = actor.last_scan_decision == "DEFERRED"
+
+        if carried_over:
+            scan, reason = True, "carried_over"
+        else:
+            scan, reason = scan_decision(last_scanned_at, actor.last_scan_status, now)
+
+        priority = priority_score(
+            last_scanned_at,
+            int(new_7d or 0) + int(reactivated_7d or 0),
+            int(tags or 0),
+            int(hits or 0),
+            carried_over,
+            now
+        )
+
+        actor.last_scan_decision = "SCAN" if scan else "SKIP"
+        actor.last_scan_reason = reason
+        plan.append((actor, scan, reason, priority))
+
+    plan.sort(key=lambda x: (not x[1], -x[3], x[0].id))
+    return plan
+
+
+def should_scan_actor(db: Session, actor_id: int, now: datetime) -> bool:
+    actor = db.query(models.ThreatActor).filter(models.ThreatActor.id == actor_id).first()
+    last_scanned_at = actor.last_scanned_at if actor else None
+    if actor and not last_scanned_at:
+        last_scanned_at = (
+            db.query(func.max(models.ActorTechnique.last_collected))
+            .filter(models.ActorTechnique.actor_id == actor_id)
+            .scalar()
+        )
+    return scan_decision(last_scanned_at, actor.last_scan_status if actor else None, now)[0]
+
+
+def _fetch_with_budget(actor_ref, budget: RequestBudget | None):
+    _fetch_context.budget = budget
+    try:
+        return fetch_actor_intel(actor_ref)
+    finally:
+        _fetch_context.budget = None
+
+
+def collect_actors(db: Session, actors, on_result=None, concurrency: int = COLLECTOR_CONCURRENCY, budget: RequestBudget | None = None):
+    """
+    Consulta GTI para varios actores en paralelo (limitado por VT_RATE_LIMITER), en el
+    orden recibido, y aplica los cambios en BD actor por actor desde el hilo dueño de la sesión.
+    Con budget, deja de lanzar actores nuevos cuando se agota (los que están en vuelo terminan)
+    y devuelve los actores que no se alcanzaron a consultar.
+    """
+    pending = list(actors or [])
+    if not pending:
+        return []
+
+    concurrency = max(1, concurrency)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="gti-collector")
+    futures = {}
+    try:
+        while pending or futures:
+            while pending and len(futures) < concurrency and not (budget and budget.exhausted):
+                actor = pending.pop(0)
+                # contador propio del actor, que también descuenta del presupuesto de la corrida
+                actor_budget = RequestBudget(0, parent=budget)
+                futures[pool.submit(_fetch_with_budget, _actor_ref(actor), actor_budget)] = (actor, actor_budget)
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                actor, actor_budget = futures.pop(future)
+                try:
+                    intel = future.result()
+                except Exception as e:
+                    print("Fetch error:", actor.name, e)
+                    intel = {"status": "error", "error": f"FETCH_EXCEPTION: {e}", "source": None}
+
+                result = apply_actor_ttps(db, actor, intel)
+                result["requests"] = actor_budget.used
+
+                if on_result:
+                    on_result(actor, result)
+    finally:
+        # si la aplicación falla no esperamos a los actores pendientes
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return pending
 
 
 # -------------------------------------------------
-# Ejecutar collector para todos los actores
+# Cola de tareas compartida (varios workers por corrida)
 # -------------------------------------------------
-def run_collection(db: Session, progress_callback=None):
+def process_collection_tasks(db: Session, job_id: int, limit: int = COLLECTOR_CONCURRENCY, on_result=None) -> int:
+    """
+    Reclama hasta `limit` escaneos pendientes de la corrida, los consulta en paralelo
+    y registra el resultado de cada uno. Devuelve cuántos procesó.
+    """
+    tasks = collection_queue.claim_tasks(db, job_id, limit, budget=VT_RUN_REQUEST_BUDGET)
+    if not tasks:
+        return 0
+
+    task_ids = {task.actor_id: task.id for task in tasks}
+    actors = {
+        a.id: a
+        for a in db.query(models.ThreatActor).filter(models.ThreatActor.id.in_(list(task_ids))).all()
+    }
+
+    for actor_id, task_id in task_ids.items():
+        if actor_id not in actors:
+            collection_queue.finish_task(db, task_id, _error_result("ACTOR_NOT_FOUND"))
+
+    def _on_result(actor, result):
+        collection_queue.finish_task(db, task_ids[actor.id], result)
+        if on_result:
+            on_result(actor, result)
+
+    # este worker solo gasta lo que reservó al reclamar
+    reserved = sum(task.requests_reserved or 0 for task in tasks)
+    budget = RequestBudget(reserved) if VT_RUN_REQUEST_BUDGET > 0 else None
+    not_started = collect_actors(
+        db,
+        [actors[actor_id] for actor_id in task_ids if actor_id in actors],
+        on_result=_on_result,
+        budget=budget
+    )
+    for actor in not_started:
+        collection_queue.release_task(db, task_ids[actor.id])
+
+    return len(tasks) - len(not_started)
+
+
+def drain_collection(db: Session, job_id: int, progress_callback=None):
+    """
+    Procesa la cola de la corrida junto con los demás workers y espera a que se vacíe.
+    Si el presupuesto de requests se agota, lo que quede pendiente pasa a DEFERRED.
+    Devuelve el resumen de la corrida armado desde sus tareas (checkpoints).
+    """
+    def _progress(details: str | None = None):
+        if not progress_callback:
+            return
+        counts = collection_queue.task_counts(db, job_id)
+        progress_callback(
+            processed_items=counts["SKIPPED"] + counts["DONE"] + counts["ERROR"],
+            total_items=sum(counts.values()),
+            details=details or f"queue:pending={counts['PENDING']} running={counts['RUNNING']} done={counts['DONE']} errors={counts['ERROR']}"
+        )
+
+    while True:
+        processed_now = process_collection_tasks(
+            db,
+            job_id,
+            on_result=lambda actor, result: _progress(f"scan:{actor.name}:{result.get('status')}")
+        )
+        counts = collection_queue.task_counts(db, job_id)
+        _progress()
+
+        if not counts["PENDING"] and not counts["RUNNING"]:
+            break
+
+        if processed_now:
+            continue
+
+        budget_spent = VT_RUN_REQUEST_BUDGET > 0 and collection_queue.requests_used(db, job_id) >= VT_RUN_REQUEST_BUDGET
+        if budget_spent:
+            # nadie va a reclamar las tareas de un worker caído: quedan diferidas
+            collection_queue.release_expired(db, job_id)
+            if not collection_queue.task_counts(db, job_id)["RUNNING"]:
+                break
+
+        # tareas en curso en otros workers (o leases por vencer): esperamos
+        time.sleep(COLLECTION_DRAIN_POLL_SECONDS)
+
+    deferred_ids = collection_queue.defer_pending(db, job_id)
+    if deferred_ids:
+        db.query(models.ThreatActor)\
+            .filter(models.ThreatActor.id.in_(deferred_ids))\
+            .update({"last_scan_decision": "DEFERRED", "last_scan_reason": "budget_exhausted"}, synchronize_session=False)
+        print(f"Request budget exhausted: {len(deferred_ids)} actors deferred")
+    db.commit()
 
-    actors = db.query(models.ThreatActor)\
-        .filter_by(active=True)\
+    return summarize_collection(db, job_id)
+
+
+def summarize_collection(db: Session, job_id: int):
+    rows = (
+        db.query(models.CollectionTask, models.ThreatActor)
+        .join(models.ThreatActor, models.ThreatActor.id == models.CollectionTask.actor_id)
+        .filter(models.CollectionTask.job_id == job_id)
+        .order_by(models.CollectionTask.finished_at, models.CollectionTask.id)
         .all()
+    )
 
+    actor_results = []
     affected_countries = set()
+    counts = {"scanned": 0, "skipped": 0, "deferred": 0, "errors": 0}
+    for task, actor in rows:
+        if task.status == "SKIPPED":
+            counts["skipped"] += 1
+            actor_results.append({"actor_id": actor.id, "actor": actor.name, "status": "skipped", "reason": task.reason})
+            continue
+        if task.status == "DEFERRED":
+            counts["deferred"] += 1
+            actor_results.append({"actor_id": actor.id, "actor": actor.name, "status": "deferred", "reason": "budget_exhausted"})
+            continue
+        if task.status not in ("DONE", "ERROR"):
+            continue
+        counts["scanned"] += 1
+        if task.result_status != "ok":
+            counts["errors"] += 1
+        elif actor.country and actor.active:
+            affected_countries.add(actor.country)
+        actor_results.append({
+            "actor_id": actor.id,
+            "actor": actor.name,
+            "status": task.result_status or "error",
+            "source": task.result_source,
+            "total": task.result_total,
+            "requests": task.requests_used,
+            "attempts": task.attempts,
+            "reason": task.reason
+        })
+
+    return {
+        "total_actors": len(rows),
+        "processed": counts["scanned"] + counts["skipped"] + counts["deferred"],
+        **counts,
+        "requests_used": collection_queue.requests_used(db, job_id),
+        "affected_countries": affected_countries,
+        "actors": actor_results
+    }
+
+
+def _finish_queued_collection(db: Session, job_id: int, progress_callback=None):
+    summary = drain_collection(db, job_id, progress_callback=progress_callback)
+
+    # -------------------------------------------------
+    # CALCULAR RIESGO POR PAIS (una vez, al cerrar la corrida)
+    # -------------------------------------------------
+    affected_countries = summary.pop("affected_countries")
+    refresh_country_cube(db, affected_countries)
+    evaluate_country_risk(db, affected_countries)
+    summary["countries_evaluated"] = len(affected_countries)
+    return summary
+
+
+def resume_collection(db: Session, job_id: int, progress_callback=None):
+    """
+    Continúa una corrida interrumpida desde sus checkpoints: los actores ya escaneados
+    no se repiten, las tareas de workers caídos vuelven a la cola y el riesgo por país
+    se evalúa una sola vez al terminar. Si la corrida no alcanzó a encolar, se planifica de nuevo.
+    """
+    if not sum(collection_queue.task_counts(db, job_id).values()):
+        return run_collection(db, progress_callback=progress_callback, job_id=job_id)
+
+    released = collection_queue.release_expired(db, job_id)
+    print(f"Resuming collection job {job_id} (released leases: {released})")
+    return _finish_queued_collection(db, job_id, progress_callback=progress_callback)
+
+
+def evaluate_country_risk(db: Session, countries):
+    if not countries:
+        return
+    risks_by_country = calculate_risk_by_country(db, countries)
+
+    for country in countries:
+        print(f"\nEvaluating risk for {country}")
+        store_snapshot(db, country, risks=risks_by_country.get(country, []))
+        detect_risk_change(db, country)
+
+
+# -------------------------------------------------
+# Ejecutar collector para todos los actores
+# -------------------------------------------------
+def run_collection(db: Session, progress_callback=None, job_id: int | None = None):
+    """
+    Con job_id, los escaneos se encolan como tareas de la corrida y los drenan este
+    proceso y los workers de los demás procesos; sin job_id se ejecuta todo en proceso.
+    """
     now = datetime.utcnow()
-    total_actors = len(actors)
+    plan = plan_collection(db, now)
+    db.commit()
+
+    total_actors = len(plan)
     processed = 0
-    scanned = 0
     skipped = 0
-    errors = 0
     actor_results = []
+    to_scan = []
 
-    for actor in actors:
-        processed += 1
-        if not should_scan_actor(db, actor.id, now):
-            print(f"Skipping {actor.name}: scanned recently")
-            skipped += 1
-            if progress_callback:
-                progress_callback(
-                    processed_items=processed,
-                    total_items=total_actors,
-                    details=f"skip:{actor.name}"
-                )
+    for actor, scan, reason, priority in plan:
+        if scan:
+            to_scan.append((actor, priority))
             continue
 
-        result = update_actor_ttps(db, actor)
+        processed += 1
+        print(f"Skipping {actor.name}: {reason}")
+        skipped += 1
+        actor_results.append({
+            "actor_id": actor.id,
+            "actor": actor.name,
+            "status": "skipped",
+            "reason": reason
+        })
+        if progress_callback:
+            progress_callback(
+                processed_items=processed,
+                total_items=total_actors,
+                details=f"skip:{actor.name}:{reason}"
+            )
+
+    if job_id is not None:
+        # cada actor queda como tarea de la corrida (SKIPPED incluidos): son los checkpoints para reanudar
+        collection_queue.enqueue_tasks(db, job_id, [
+            {"actor_id": actor.id, "priority": priority, "reason": reason, "status": "PENDING" if scan else "SKIPPED"}
+            for actor, scan, reason, priority in plan
+        ])
+        return _finish_queued_collection(db, job_id, progress_callback=progress_callback)
+
+    affected_countries = set()
+    scanned = 0
+    errors = 0
+
+    def _on_result(actor, result):
+        nonlocal processed, scanned, errors
+        processed += 1
         actor_results.append({
             "actor_id": actor.id,
             "actor": actor.name,
             "status": result.get("status"),
             "source": result.get("source"),
-            "total": result.get("total")
+            "total": result.get("total"),
+            "requests": result.get("requests"),
+            "reason": actor.last_scan_reason
         })
         scanned += 1
 
@@ -542,20 +1141,44 @@ def run_collection(db: Session, progress_callback=None):
                 details=f"scan:{actor.name}:{result.get('status')}"
             )
 
+    budget = RequestBudget(VT_RUN_REQUEST_BUDGET)
+    deferred = collect_actors(db, [actor for actor, _ in to_scan], on_result=_on_result, budget=budget)
+
+    # sin presupuesto: los pendientes pasan primero en la próxima corrida
+    for actor in deferred:
+        processed += 1
+        actor.last_scan_decision = "DEFERRED"
+        actor.last_scan_reason = "budget_exhausted"
+        actor_results.append({
+            "actor_id": actor.id,
+            "actor": actor.name,
+            "status": "deferred",
+            "reason": "budget_exhausted"
+        })
+    if deferred:
+        db.commit()
+        print(f"Request budget exhausted ({budget.used}/{budget.limit}): {len(deferred)} actors deferred")
+        if progress_callback:
+            progress_callback(
+                processed_items=processed,
+                total_items=total_actors,
+                details=f"deferred:{len(deferred)}"
+            )
+
     # -------------------------------------------------
-    # CALCULAR RIESGO POR PAIS
+    # CUBO POR PAIS + RIESGO POR PAIS
     # -------------------------------------------------
-    for country in affected_countries:
-        print(f"\nEvaluating risk for {country}")
-        store_snapshot(db, country)
-        detect_risk_change(db, country)
+    refresh_country_cube(db, affected_countries)
+    evaluate_country_risk(db, affected_countries)
 
     return {
         "total_actors": total_actors,
         "processed": processed,
         "scanned": scanned,
         "skipped": skipped,
+        "deferred": len(deferred),
         "errors": errors,
+        "requests_used": budget.used,
         "countries_evaluated": len(affected_countries),
         "actors": actor_results
     }
@@ -1,35 +1,20 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app import models
+from app.services.country_cube import technique_usage
 
 
 def get_heatmap(db: Session, country: str):
 
-    results = (
-        db.query(
-            models.Technique.tech_id,
-            models.Technique.name,
-            models.Technique.tactic,
-            func.count(models.ActorTechnique.id).label("usage_count")
-        )
-        .join(models.ActorTechnique, models.ActorTechnique.technique_id == models.Technique.id)
-        .join(models.ThreatActor, models.ThreatActor.id == models.ActorTechnique.actor_id)
-        .filter(models.ThreatActor.country == country)
-        .filter(models.ActorTechnique.active == True)
-        .group_by(models.Technique.tech_id, models.Technique.name, models.Technique.tactic)
-        .order_by(func.count(models.ActorTechnique.id).desc())
-        .all()
-    )
+    # leído del cubo country_technique_stats (actores activos con la TTP activa)
+    results = technique_usage(db, country)
 
     heatmap = []
 
-    for r in results:
+    for tech_id, name, tactic, actors_using, _ in results:
         heatmap.append({
-            "technique": r.tech_id,
-            "name": r.name,
-            "tactic": r.tactic,
-            "score": r.usage_count
+            "technique": tech_id,
+            "name": name,
+            "tactic": tactic,
+            "score": int(actors_using or 0)
         })
 
     return heatmap
-
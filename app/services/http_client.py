@@ -0,0 +1,189 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("HTTP_DEFAULT_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "1"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "60"))
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "8"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    raw = (value or "").strip()
+    if not raw:
+        return None
+    if raw.isdigit():
+        return float(raw)
+    try:
+        dt = parsedate_to_datetime(raw)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+
+
+class ConnectorClient:
+    """
+    Cliente HTTP compartido por los conectores de inteligencia (GTI, MISP, OpenCTI, MITRE):
+    conexiones keep-alive por host, compresión, reintentos con backoff exponencial
+    con jitter (respetando Retry-After), límite de concurrencia por host y contadores.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = HTTP_POOL_CONNECTIONS,
+        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+        max_retries: int = HTTP_MAX_RETRIES,
+        default_timeout: float = HTTP_DEFAULT_TIMEOUT_SECONDS,
+        host_concurrency: int = HTTP_HOST_CONCURRENCY,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+        self.max_retries = max(0, int(max_retries))
+        self.default_timeout = default_timeout
+        self.host_concurrency = max(1, int(host_concurrency))
+
+        self._lock = threading.Lock()
+        self._host_caps = {}
+        self._host_semaphores = {}
+        self._stats = {}
+
+    # -------------------------------------------------
+    # Concurrencia por host
+    # -------------------------------------------------
+    def set_host_concurrency(self, host: str, limit: int):
+        with self._lock:
+            self._host_caps[host] = max(1, int(limit))
+            self._host_semaphores.pop(host, None)
+
+    def _semaphore(self, host: str):
+        with self._lock:
+            sem = self._host_semaphores.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self._host_caps.get(host, self.host_concurrency))
+                self._host_semaphores[host] = sem
+            return sem
+
+    # -------------------------------------------------
+    # Contadores
+    # -------------------------------------------------
+    def _record(self, host: str, latency: float, status: int | None, bytes_in: int, retried: bool):
+        with self._lock:
+            s = self._stats.get(host)
+            if s is None:
+                s = {
+                    "calls": 0,
+                    "retries": 0,
+                    "errors": 0,
+                    "bytes_in": 0,
+                    "latency_total_ms": 0.0,
+                    "latency_max_ms": 0.0,
+                    "status": {},
+                }
+                self._stats[host] = s
+            latency_ms = latency * 1000.0
+            s["calls"] += 1
+            s["bytes_in"] += bytes_in
+            s["latency_total_ms"] += latency_ms
+            s["latency_max_ms"] = max(s["latency_max_ms"], latency_ms)
+            if retried:
+                s["retries"] += 1
+            key = str(status) if status is not None else "exception"
+            s["status"][key] = s["status"].get(key, 0) + 1
+            if status is None or status >= 400:
+                s["errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for host, s in self._stats.items():
+                result[host] = {
+                    **s,
+                    "status": dict(s["status"]),
+                    "latency_avg_ms": round(s["latency_total_ms"] / s["calls"], 2) if s["calls"] else 0.0,
+                    "latency_total_ms": round(s["latency_total_ms"], 2),
+                    "latency_max_ms": round(s["latency_max_ms"], 2),
+                }
+            return result
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    # -------------------------------------------------
+    # Requests
+    # -------------------------------------------------
+    def _backoff(self, attempt: int, response=None) -> float:
+        if response is not None:
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, HTTP_BACKOFF_MAX_SECONDS)
+        delay = min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def request(self, method: str, url: str, rate_limiter=None, retries: int | None = None, **kwargs):
+        host = urlsplit(url).netloc
+        kwargs.setdefault("timeout", self.default_timeout)
+        max_retries = self.max_retries if retries is None else max(0, int(retries))
+        semaphore = self._semaphore(host)
+
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+
+            response = None
+            error = None
+            started = time.monotonic()
+            with semaphore:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    # leemos el body dentro del slot para medir bytes y liberar la conexión
+                    bytes_in = len(response.content)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                    bytes_in = 0
+            latency = time.monotonic() - started
+            self._record(host, latency, response.status_code if response is not None else None, bytes_in, attempt > 0)
+
+            retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+            if not retryable or attempt >= max_retries:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt, response)
+            print(
+                f"HTTP retry {attempt + 1}/{max_retries} {method} {host}:",
+                error or response.status_code,
+                f"sleep={delay:.1f}s"
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+# instancia compartida por todos los conectores del proceso
+connector_client = ConnectorClient()
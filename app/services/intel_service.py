@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from app import models
+from app.services.technique_catalog import get_catalog
 
 def get_actor_timeline(db: Session, actor_id: int):
 
@@ -11,12 +12,15 @@ def get_actor_timeline(db: Session, actor_id: int):
         .all()
     )
 
+    catalog = get_catalog(db)
+
     result = []
 
     for e in events:
+        tech = catalog.get_by_id(e.technique_id) or e.technique
         result.append({
-            "technique": e.technique.tech_id,
-            "tactic": e.technique.tactic,
+            "technique": tech.tech_id,
+            "tactic": tech.tactic,
             "event_type": e.event_type,
             "date": e.created_at
         })
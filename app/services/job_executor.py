@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import models
+from app.database import SessionLocal
+
+JOB_EXECUTOR_MAX_WORKERS = max(1, int(os.getenv("JOB_EXECUTOR_MAX_WORKERS", "4")))
+# formato: "tipo:límite,..."; los tipos no listados usan 1
+JOB_CONCURRENCY_LIMITS = os.getenv(
+    "JOB_CONCURRENCY_LIMITS",
+    "collector:1,actor_scan:4,mitre_sync:1,misp_sync:1,opencti_sync:1"
+)
+# cada cuánto un job en curso consulta en BD si le pidieron cancelar (desde otro proceso)
+JOB_CANCEL_CHECK_SECONDS = float(os.getenv("JOB_CANCEL_CHECK_SECONDS", "5"))
+
+ACTIVE_STATUSES = ("PENDING", "RUNNING")
+
+
+class JobCancelled(Exception):
+    """La cancelación se pidió con /jobs/{id}/cancel; se lanza en el siguiente punto de progreso."""
+
+
+def _parse_limits(raw: str) -> dict[str, int]:
+    limits = {}
+    for chunk in (raw or "").split(","):
+        if ":" not in chunk:
+            continue
+        job_type, value = chunk.split(":", 1)
+        try:
+            limits[job_type.strip()] = max(1, int(value))
+        except ValueError:
+            continue
+    return limits
+
+
+def dedup_key(job_type: str, params: dict | None) -> str:
+    return f"{job_type}:{json.dumps(params or {}, sort_keys=True, separators=(',', ':'))}"
+
+
+class JobExecutor:
+    """
+    Ejecuta los jobs administrativos fuera del request HTTP: pool acotado, límite de
+    concurrencia por tipo (el resto espera en PENDING), deduplicación de jobs idénticos
+    activos y cancelación cooperativa.
+    """
+
+    def __init__(self, max_workers: int = JOB_EXECUTOR_MAX_WORKERS, limits: dict[str, int] | None = None):
+        self.max_workers = max_workers
+        self.limits = limits if limits is not None else _parse_limits(JOB_CONCURRENCY_LIMITS)
+        self._pool = None
+        self._runner = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._running = {}
+        self._cancelled = set()
+        self._cancel_checked_at = {}
+
+    def configure(self, runner):
+        """runner(job_id) ejecuta un JobRun ya reclamado (lo define main con los helpers de jobs)."""
+        self._runner = runner
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job-executor")
+        return self._pool
+
+    # -------------------------------------------------
+    # Encolar
+    # -------------------------------------------------
+    def submit(
+        self,
+        db,
+        job_type: str,
+        params: dict | None = None,
+        trigger: str = "manual",
+        actor_id: int | None = None,
+        actor_name: str | None = None,
+        total_items: int = 0,
+    ):
+        """Crea el JobRun PENDING y lo encola. Devuelve (job, deduplicado)."""
+        key = dedup_key(job_type, params)
+        now = datetime.utcnow()
+        job = models.JobRun(
+            job_type=job_type,
+            trigger=trigger,
+            status="PENDING",
+            actor_id=actor_id,
+            actor_name=actor_name,
+            total_items=total_items,
+            processed_items=0,
+            params=json.dumps(params or {}),
+            dedup_key=key,
+            cancel_requested=False,
+            started_at=now,
+            updated_at=now,
+        )
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # ya hay un job idéntico PENDING/RUNNING (índice único parcial sobre dedup_key)
+            db.rollback()
+            existing = (
+                db.query(models.JobRun)
+                .filter(models.JobRun.dedup_key == key)
+                .filter(models.JobRun.status.in_(ACTIVE_STATUSES))
+                .order_by(models.JobRun.id.desc())
+                .first()
+            )
+            if existing:
+                return existing, True
+            raise
+        db.refresh(job)
+        self.enqueue(job.id, job_type)
+        return job, False
+
+    def enqueue(self, job_id: int, job_type: str):
+        with self._lock:
+            self._pending.setdefault(job_type, deque()).append(job_id)
+        self._dispatch()
+
+    def resubmit_pending(self, db):
+        """Al arrancar: vuelve a encolar los PENDING que quedaron de un proceso anterior."""
+        rows = (
+            db.query(models.JobRun.id, models.JobRun.job_type)
+            .filter(models.JobRun.status == "PENDING")
+            .order_by(models.JobRun.id)
+            .all()
+        )
+        for job_id, job_type in rows:
+            self.enqueue(job_id, job_type)
+        return len(rows)
+
+    def _dispatch(self):
+        to_start = []
+        with self._lock:
+            busy = sum(self._running.values())
+            for job_type, queue in self._pending.items():
+                limit = self.limits.get(job_type, 1)
+                while queue and busy < self.max_workers and self._running.get(job_type, 0) < limit:
+                    to_start.append((queue.popleft(), job_type))
+                    self._running[job_type] = self._running.get(job_type, 0) + 1
+                    busy += 1
+        for job_id, job_type in to_start:
+            self._executor().submit(self._run, job_id, job_type)
+
+    def _run(self, job_id: int, job_type: str):
+        try:
+            if self._runner is not None:
+                self._runner(job_id)
+        except Exception as e:
+            print("Job executor error:", job_type, job_id, e)
+        finally:
+            with self._lock:
+                self._running[job_type] = max(0, self._running.get(job_type, 1) - 1)
+                self._cancelled.discard(job_id)
+                self._cancel_checked_at.pop(job_id, None)
+            self._dispatch()
+
+    # -------------------------------------------------
+    # Cancelación
+    # -------------------------------------------------
+    def cancel(self, db, job_id: int):
+        """PENDING se cancela ya; RUNNING se marca y el job se detiene en su próximo punto de progreso."""
+        now = datetime.utcnow()
+        cancelled = db.query(models.JobRun)\
+            .filter(models.JobRun.id == job_id)\
+            .filter(models.JobRun.status == "PENDING")\
+            .update({
+                "status": "CANCELLED",
+                "cancel_requested": True,
+                "finished_at": now,
+                "updated_at": now
+            }, synchronize_session=False)
+        if not cancelled:
+            db.query(models.JobRun)\
+                .filter(models.JobRun.id == job_id)\
+                .filter(models.JobRun.status == "RUNNING")\
+                .update({"cancel_requested": True, "updated_at": now}, synchronize_session=False)
+            with self._lock:
+                self._cancelled.add(job_id)
+        db.commit()
+        return db.query(models.JobRun).filter(models.JobRun.id == job_id).first()
+
+    def raise_if_cancelled(self, job_id: int):
+        with self._lock:
+            if job_id in self._cancelled:
+                raise JobCancelled(f"job {job_id} cancelled")
+            last = self._cancel_checked_at.get(job_id, 0.0)
+            if time.monotonic() - last < JOB_CANCEL_CHECK_SECONDS:
+                return
+            self._cancel_checked_at[job_id] = time.monotonic()
+
+        db = SessionLocal()
+        try:
+            requested = db.query(models.JobRun.cancel_requested).filter(models.JobRun.id == job_id).scalar()
+        finally:
+            db.close()
+        if requested:
+            with self._lock:
+                self._cancelled.add(job_id)
+            raise JobCancelled(f"job {job_id} cancelled")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "limits": dict(self.limits),
+                "running": {k: v for k, v in self._running.items() if v},
+                "pending": {k: len(v) for k, v in self._pending.items() if v},
+            }
+
+
+# instancia del proceso
+job_executor = JobExecutor()
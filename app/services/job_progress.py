@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from datetime import datetime
+from app import models
+from app.database import SessionLocal
+from app.services.event_bus import notify
+from app.services.job_executor import job_executor
+
+# el progreso vive en memoria y se escribe en job_runs como mucho cada N segundos o M ítems
+JOB_PROGRESS_FLUSH_SECONDS = float(os.getenv("JOB_PROGRESS_FLUSH_SECONDS", "5"))
+JOB_PROGRESS_FLUSH_ITEMS = int(os.getenv("JOB_PROGRESS_FLUSH_ITEMS", "50"))
+
+
+class JobProgressTracker:
+    """
+    Progreso de los jobs en curso de este proceso. Las escrituras a job_runs usan
+    una sesión propia, así no se mezclan con la transacción del collector.
+    """
+
+    def __init__(self, flush_seconds: float = JOB_PROGRESS_FLUSH_SECONDS, flush_items: int = JOB_PROGRESS_FLUSH_ITEMS):
+        self.flush_seconds = flush_seconds
+        self.flush_items = max(1, flush_items)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def update(self, job_id: int, processed_items: int | None = None, total_items: int | None = None, details: str | None = None):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                entry = {
+                    "processed_items": None,
+                    "total_items": None,
+                    "details": None,
+                    "updated_at": None,
+                    "flushed_at": time.monotonic(),
+                    "flushed_items": 0,
+                    "dirty": False,
+                }
+                self._jobs[job_id] = entry
+            if processed_items is not None:
+                entry["processed_items"] = processed_items
+            if total_items is not None:
+                entry["total_items"] = total_items
+            if details is not None:
+                entry["details"] = details
+            entry["updated_at"] = datetime.utcnow()
+            entry["dirty"] = True
+
+            due = (
+                time.monotonic() - entry["flushed_at"] >= self.flush_seconds
+                or (entry["processed_items"] or 0) - entry["flushed_items"] >= self.flush_items
+            )
+
+        if due:
+            self.flush(job_id)
+
+    def get(self, job_id: int):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            return {k: entry[k] for k in ("processed_items", "total_items", "details", "updated_at")}
+
+    def _take(self, job_id: int, force: bool):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None or (not entry["dirty"] and not force):
+                return None
+            entry["dirty"] = False
+            entry["flushed_at"] = time.monotonic()
+            entry["flushed_items"] = entry["processed_items"] or 0
+            return {k: entry[k] for k in ("processed_items", "total_items", "details", "updated_at")}
+
+    def flush(self, job_id: int, force: bool = False):
+        values = self._take(job_id, force)
+        if not values:
+            return
+
+        changes = {"updated_at": values["updated_at"] or datetime.utcnow()}
+        for key in ("processed_items", "total_items", "details"):
+            if values[key] is not None:
+                changes[key] = values[key]
+
+        db = SessionLocal()
+        try:
+            db.query(models.JobRun)\
+                .filter(models.JobRun.id == job_id)\
+                .update(changes, synchronize_session=False)
+            notify(db, "jobs.progress", {"job_id": job_id, **changes})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print("Job progress flush error:", job_id, e)
+            with self._lock:
+                if job_id in self._jobs:
+                    self._jobs[job_id]["dirty"] = True
+        finally:
+            db.close()
+
+    def finish(self, job_id: int):
+        """Escribe lo pendiente y deja de seguir el job (antes de marcarlo SUCCESS/ERROR)."""
+        self.flush(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def callback(self, job_id: int):
+        """
+        progress_callback(processed_items, total_items, details) para run_collection y afines.
+        Cada reporte es también un punto de cancelación: lanza JobCancelled si se pidió.
+        """
+        def _callback(processed_items=None, total_items=None, details=None):
+            self.update(job_id, processed_items=processed_items, total_items=total_items, details=details)
+            job_executor.raise_if_cancelled(job_id)
+        return _callback
+
+
+# instancia del proceso
+job_progress = JobProgressTracker()
@@ -1,6 +1,6 @@
 from collections import defaultdict
 from app.services.risk_score import calculate_risk
-from app import models
+from app.services.technique_catalog import get_catalog
 
 
 def risk_to_color(score: float):
@@ -24,23 +24,25 @@ def build_matrix(db, country: str):
 
     top_risks = calculate_risk(db, country)
 
+    catalog = get_catalog(db)
+
     matrix = defaultdict(list)
 
     for item in top_risks:
 
-        tech = db.query(models.Technique).filter_by(tech_id=item["technique"]).first()
+        tech = catalog.get(item["technique"])
 
         if not tech:
             continue
 
-        tactic = tech.tactic or "unknown"
-
-        matrix[tactic].append({
-            "technique": tech.tech_id,
-            "name": tech.name,
-            "risk": item["risk"],
-            "color": risk_to_color(item["risk"])
-        })
+        # una celda por cada táctica de la técnica
+        for tactic in tech.tactics or ("unknown",):
+            matrix[tactic].append({
+                "technique": tech.tech_id,
+                "name": tech.name,
+                "risk": item["risk"],
+                "color": risk_to_color(item["risk"])
+            })
 
     return dict(matrix)
 
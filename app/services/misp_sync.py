@@ -1,11 +1,11 @@
 import os
 from datetime import datetime, timezone, timedelta
 
-import requests
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 
 from app import models
+from app.services.http_client import connector_client
 
 load_dotenv()
 
@@ -206,7 +206,7 @@ def _fetch_attributes_page(page: int, limit: int, days: int | None) -> list[dict
     if days is not None and days > 0:
         payload["date"] = f"{int(days)}d"
 
-    response = requests.post(
+    response = connector_client.post(
         f"{_misp_url()}/attributes/restSearch",
         headers=_headers(),
         json=payload,
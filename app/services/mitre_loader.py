@@ -1,6 +1,8 @@
-import requests
 from sqlalchemy.orm import Session
 from app import models
+from app.services.http_client import connector_client
+from app.services.technique_catalog import reload_catalog, split_tactics
+from app.services.technique_tactics import sync_technique_tactics
 
 MITRE_URL = "https://raw.githubusercontent.com/mitre/cti/master/enterprise-attack/enterprise-attack.json"
 
@@ -8,10 +10,11 @@ MITRE_URL = "https://raw.githubusercontent.com/mitre/cti/master/enterprise-attac
 def load_mitre(db: Session):
 
     print("Downloading MITRE ATT&CK...")
-    data = requests.get(MITRE_URL, timeout=60).json()
+    data = connector_client.get(MITRE_URL, timeout=60).json()
 
     created = 0
     total = 0
+    added = []
 
     for obj in data["objects"]:
 
@@ -44,15 +47,20 @@ def load_mitre(db: Session):
         if exists:
             continue
 
-        db.add(models.Technique(
+        technique = models.Technique(
             tech_id=tech_id,
             name=name,
             tactic=tactic
-        ))
+        )
+        db.add(technique)
+        added.append(technique)
 
         created += 1
 
+    db.flush()
+    sync_technique_tactics(db, {t.id: split_tactics(t.tactic) for t in added})
     db.commit()
+    reload_catalog(db)
 
     print(f"MITRE loaded: {created}/{total}")
 
@@ -1,7 +1,9 @@
 import json
-import requests
 from sqlalchemy.orm import Session
 from app import models
+from app.services.http_client import connector_client
+from app.services.technique_catalog import reload_catalog, split_tactics
+from app.services.technique_tactics import sync_technique_tactics
 
 STIX_URL = "https://raw.githubusercontent.com/mitre-attack/attack-stix-data/master/enterprise-attack/enterprise-attack.json"
 
@@ -25,7 +27,7 @@ def _extract_tactics(kill_chain_phases):
 
 
 def sync_mitre_from_github(db: Session):
-    resp = requests.get(STIX_URL, timeout=30)
+    resp = connector_client.get(STIX_URL, timeout=30)
     resp.raise_for_status()
 
     bundle = resp.json()
@@ -33,6 +35,7 @@ def sync_mitre_from_github(db: Session):
 
     updated = 0
     created = 0
+    synced = []
 
     for obj in objects:
         if obj.get("type") != "attack-pattern":
@@ -51,16 +54,23 @@ def sync_mitre_from_github(db: Session):
             existing.name = name
             existing.tactic = tactics
             existing.description = description
+            synced.append(existing)
             updated += 1
         else:
-            db.add(models.Technique(
+            technique = models.Technique(
                 tech_id=tech_id,
                 name=name,
                 tactic=tactics,
                 description=description
-            ))
+            )
+            db.add(technique)
+            synced.append(technique)
             created += 1
 
+    # ids de las nuevas + relación normalizada en la misma transacción
+    db.flush()
+    sync_technique_tactics(db, {t.id: split_tactics(t.tactic) for t in synced})
     db.commit()
+    reload_catalog(db)
 
     return {"created": created, "updated": updated}
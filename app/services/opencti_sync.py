@@ -1,9 +1,13 @@
 import os
-import requests
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 
 from app import models
+from app.crud import invalidate_collection_cache
+from app.services.country_cube import refresh_country_cube
+from app.services.detection_engine import refresh_actor_matches
+from app.services.risk_state import apply_actor_move
+from app.services.http_client import connector_client
 
 load_dotenv()
 
@@ -53,7 +57,7 @@ def _fetch_threat_actors(limit: int = 200):
 
     while len(collected) < limit:
         variables = {"first": page_size, "after": after}
-        resp = requests.post(
+        resp = connector_client.post(
             _opencti_graphql_url(),
             headers=_opencti_headers(),
             json={"query": query, "variables": variables},
@@ -113,6 +117,7 @@ def sync_opencti_actors(db: Session, limit: int = 200):
     updated = 0
     unchanged = 0
     skipped = 0
+    reactivated = []
 
     for row in rows:
         name = row["name"]
@@ -127,12 +132,14 @@ def sync_opencti_actors(db: Session, limit: int = 200):
                 changed = True
             if not existing.active:
                 existing.active = True
+                reactivated.append(existing)
                 changed = True
             if (existing.source or "").strip() in {"", "OSINT", "OTRO"}:
                 existing.source = "OPENCTI"
                 changed = True
             if not (existing.gti_id or "").strip() and opencti_id:
                 existing.gti_id = _ensure_unique_gti_id(db, opencti_id)
+                invalidate_collection_cache(existing)
                 changed = True
 
             if changed:
@@ -156,7 +163,14 @@ def sync_opencti_actors(db: Session, limit: int = 200):
         ))
         created += 1
 
+    # reactivados: vuelven a contar en las detecciones y en el riesgo/cubo de su país (en lote)
+    db.flush()
+    for actor in reactivated:
+        refresh_actor_matches(db, actor.id)
+        apply_actor_move(db, actor.id, None, actor.country)
     db.commit()
+    if reactivated:
+        refresh_country_cube(db, {actor.country for actor in reactivated})
 
     return {
         "fetched": len(rows),
@@ -46,8 +46,11 @@ def predict_next_techniques(db, matrix):
 
     from app import models
 
+    # technique_tactics incluye las técnicas multi-táctica ("defense-evasion,persistence")
     techniques = db.query(models.Technique)\
-        .filter(models.Technique.tactic == next_tactic)\
+        .join(models.TechniqueTactic, models.TechniqueTactic.technique_id == models.Technique.id)\
+        .filter(models.TechniqueTactic.tactic == next_tactic)\
+        .order_by(models.Technique.tech_id)\
         .limit(10)\
         .all()
 
@@ -0,0 +1,181 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+
+class TokenBucket:
+    """Token bucket thread-safe para respetar la cuota de una API entre varios hilos."""
+
+    def __init__(self, rate_per_minute: float, burst: int | None = None):
+        self.rate_per_second = max(0.0, float(rate_per_minute or 0)) / 60.0
+        self.capacity = float(max(1, int(burst if burst is not None else rate_per_minute or 1)))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate_per_second <= 0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_second)
+            self.updated_at = now
+
+    def _take(self, tokens: float) -> float | None:
+        """Toma los tokens y devuelve 0, o los segundos a esperar antes de reintentar."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate_per_second
+
+    def acquire(self, tokens: float = 1.0):
+        # 0 o negativo = sin límite
+        if self.unlimited:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            wait_for = self._take(tokens)
+            if wait_for == 0:
+                return waited
+            # None = reintento inmediato
+            if wait_for:
+                time.sleep(wait_for)
+                waited += wait_for
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket guardado en una fila de BD (`model`, p. ej. RateLimitBucket), para que todos
+    los procesos (workers de uvicorn / réplicas) descuenten de la misma cuota. Cada proceso
+    retira tokens en lotes de hasta `batch` con una transacción corta (FOR UPDATE) y los reparte
+    entre sus hilos desde memoria; solo un hilo por proceso va a la BD a la vez, así el limitador
+    ocupa como mucho una conexión del pool. Si la BD falla se espera `retry_seconds` y se
+    reintenta: nunca se entregan tokens que no se descontaron de la fila.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_minute: float,
+        session_factory,
+        model,
+        burst: int | None = None,
+        batch: int = 5,
+        retry_seconds: float = 1.0
+    ):
+        super().__init__(rate_per_minute, burst=burst)
+        self.name = name
+        self.session_factory = session_factory
+        self.model = model
+        self.batch = max(1.0, min(float(batch), self.capacity))
+        self.retry_seconds = max(0.1, float(retry_seconds))
+        # reserva local: tokens ya descontados de la fila y aún no usados
+        self.tokens = 0.0
+        self._db_lock = threading.Lock()
+        self._failing = False
+
+    def _take_local(self, tokens: float) -> bool:
+        with self._lock:
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def _take(self, tokens: float) -> float | None:
+        if self._take_local(tokens):
+            return 0.0
+
+        with self._db_lock:
+            # otro hilo pudo traer un lote mientras esperábamos el turno
+            if self._take_local(tokens):
+                return 0.0
+            with self._lock:
+                missing = tokens - self.tokens
+            granted, wait_for = self._withdraw(missing)
+
+        if granted:
+            with self._lock:
+                self.tokens += granted
+            # None = reintento inmediato si otro hilo alcanzó a usar el lote
+            return 0.0 if self._take_local(tokens) else None
+        return wait_for
+
+    def _withdraw(self, missing: float) -> tuple[float, float | None]:
+        """Retira de la fila entre `missing` y `batch` tokens. Devuelve (retirados, espera)."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            row = (
+                db.query(self.model)
+                .filter(self.model.name == self.name)
+                .with_for_update()
+                .first()
+            )
+            if row is None:
+                row = self.model(name=self.name, tokens=self.capacity, updated_at=now)
+                db.add(row)
+            else:
+                # relojes de hosts distintos: un salto hacia atrás no resta tokens
+                elapsed = (now - row.updated_at).total_seconds() if row.updated_at else 0.0
+                if elapsed > 0:
+                    row.tokens = min(self.capacity, (row.tokens or 0.0) + elapsed * self.rate_per_second)
+                    row.updated_at = now
+                row.tokens = min(self.capacity, row.tokens or 0.0)
+
+            granted, wait_for = 0.0, (missing - row.tokens) / self.rate_per_second
+            if row.tokens >= missing:
+                granted, wait_for = min(row.tokens, max(missing, self.batch)), 0.0
+                row.tokens -= granted
+            db.commit()
+            if self._failing:
+                print(f"Shared rate limiter '{self.name}' recovered")
+                self._failing = False
+            return granted, wait_for
+        except IntegrityError:
+            # otro proceso creó la fila primero: reintentamos
+            db.rollback()
+            return 0.0, None
+        except SQLAlchemyError as e:
+            # pool agotado o BD caída: esperar, no entregar tokens sin descontarlos
+            db.rollback()
+            if not self._failing:
+                print(f"Shared rate limiter '{self.name}' unavailable, retrying every {self.retry_seconds}s:", e)
+                self._failing = True
+            return 0.0, self.retry_seconds
+        finally:
+            db.close()
+
+
+class RequestBudget:
+    """
+    Presupuesto de requests de una corrida, compartido por sus hilos. limit <= 0 = sin límite.
+    Con parent, cada cargo también se suma al presupuesto padre (contador por actor dentro de la corrida).
+    """
+
+    def __init__(self, limit: int, parent=None):
+        self.limit = max(0, int(limit or 0))
+        self.parent = parent
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def charge(self, requests: int = 1):
+        with self._lock:
+            self.used += requests
+        if self.parent is not None:
+            self.parent.charge(requests)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.limit > 0 and self.used >= self.limit
+
+    @property
+    def remaining(self) -> int | None:
+        if self.limit <= 0:
+            return None
+        return max(0, self.limit - self.used)
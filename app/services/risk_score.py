@@ -1,80 +1,56 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from app import models
 
-
-def calculate_risk(db: Session, country: str):
-
-    # 1️⃣ Obtener actores activos del país objetivo
-    actors = (
-        db.query(models.ThreatActor)
-        .filter(models.ThreatActor.country == country)
-        .filter(models.ThreatActor.active == True)
-        .all()
+TOP_RISKS = 15
+
+
+def calculate_risk_by_country(db: Session, countries=None):
+    """
+    Riesgo por técnica para uno o varios países, leído del estado derivado
+    (country_technique_risk_state + technique_risk_state) que mantiene el collector.
+    countries=None evalúa todos los países con actores activos.
+    """
+    now_epoch = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+
+    query = (
+        db.query(
+            models.CountryTechniqueRiskState.country,
+            models.Technique.id,
+            models.Technique.tech_id,
+            models.Technique.name,
+            models.CountryTechniqueRiskState.actors_using,
+            models.TechniqueRiskState.new_7d,
+            models.TechniqueRiskState.reactivated_7d,
+            models.TechniqueRiskState.active_rows,
+            models.TechniqueRiskState.first_seen_epoch_sum
+        )
+        .join(models.Technique, models.Technique.id == models.CountryTechniqueRiskState.technique_id)
+        .outerjoin(
+            models.TechniqueRiskState,
+            models.TechniqueRiskState.technique_id == models.CountryTechniqueRiskState.technique_id
+        )
+        .filter(models.CountryTechniqueRiskState.actors_using > 0)
     )
+    if countries is not None:
+        countries = [c for c in countries if c]
+        if not countries:
+            return {}
+        query = query.filter(models.CountryTechniqueRiskState.country.in_(countries))
 
-    if not actors:
-        return []
-
-    actor_ids = [a.id for a in actors]
-
-    since_7 = datetime.utcnow() - timedelta(days=7)
-
-    results = []
+    results = {}
 
-    # 2️⃣ Recorrer todas las técnicas MITRE
-    techniques = db.query(models.Technique).all()
+    for country, technique_id, tech_id, name, actors_using, new_7, reactivated, active_rows, epoch_sum in sorted(query.all(), key=lambda r: r[1]):
+        actors_using = int(actors_using or 0)
+        new_7 = int(new_7 or 0)
+        reactivated = int(reactivated or 0)
 
-    for tech in techniques:
+        # persistencia promedio = ahora - promedio(first_seen), en días
+        avg_days = 0.0
+        if active_rows:
+            avg_days = (now_epoch - float(epoch_sum or 0) / int(active_rows)) / 86400
 
-        # --- CUANTOS ACTORES LA USAN ACTUALMENTE ---
-        actors_using = (
-            db.query(func.count(models.ActorTechnique.id))
-            .filter(models.ActorTechnique.technique_id == tech.id)
-            .filter(models.ActorTechnique.actor_id.in_(actor_ids))
-            .filter(models.ActorTechnique.active == True)
-            .scalar()
-        ) or 0
-
-        if actors_using == 0:
-            continue
-
-        # --- NUEVAS APARICIONES (últimos 7 días) ---
-        new_7 = (
-            db.query(func.count(models.IntelligenceEvent.id))
-            .filter(models.IntelligenceEvent.technique_id == tech.id)
-            .filter(models.IntelligenceEvent.event_type == "NEW")
-            .filter(models.IntelligenceEvent.created_at >= since_7)
-            .scalar()
-        ) or 0
-
-        # --- REACTIVACIONES ---
-        reactivated = (
-            db.query(func.count(models.IntelligenceEvent.id))
-            .filter(models.IntelligenceEvent.technique_id == tech.id)
-            .filter(models.IntelligenceEvent.event_type == "REACTIVATED")
-            .filter(models.IntelligenceEvent.created_at >= since_7)
-            .scalar()
-        ) or 0
-
-        # --- PERSISTENCIA PROMEDIO ---
-        avg_days = float(
-            db.query(
-                func.avg(
-                    func.extract(
-                        'epoch',
-                        datetime.utcnow() - models.ActorTechnique.first_seen
-                    ) / 86400
-                )
-            )
-            .filter(models.ActorTechnique.technique_id == tech.id)
-            .filter(models.ActorTechnique.active == True)
-            .scalar()
-            or 0
-        )
-
-        # 3️⃣ Fórmula de riesgo CTI
+        # Fórmula de riesgo CTI
         risk = (
             actors_using * 5      # adopción
             + new_7 * 8           # aparición reciente
@@ -82,12 +58,18 @@ def calculate_risk(db: Session, country: str):
             + avg_days * 0.3      # persistencia
         )
 
-        results.append({
-            "technique": tech.tech_id,
-            "name": tech.name,
+        results.setdefault(country, []).append({
+            "technique": tech_id,
+            "name": name,
             "risk": round(risk, 2)
         })
 
-    # 4️⃣ Top 15 más peligrosas
-    return sorted(results, key=lambda x: x["risk"], reverse=True)[:15]
+    # Top 15 más peligrosas por país
+    return {
+        country: sorted(items, key=lambda x: x["risk"], reverse=True)[:TOP_RISKS]
+        for country, items in results.items()
+    }
 
+
+def calculate_risk(db: Session, country: str):
+    return calculate_risk_by_country(db, [country]).get(country, [])
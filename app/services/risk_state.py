@@ -0,0 +1,382 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+
+# intervalo por defecto de la programación `risk_state_sweep`: descuenta los eventos que salieron
+# de la ventana de 7 días (0 = se crea deshabilitada)
+RISK_STATE_SWEEP_MINUTES = int(os.getenv("RISK_STATE_SWEEP_MINUTES", "60"))
+# advisory lock de Postgres: los deltas lo toman compartido y la reconstrucción exclusivo
+RISK_STATE_LOCK_KEY = int(os.getenv("RISK_STATE_LOCK_KEY", "48151624"))
+RISK_WINDOW_DAYS = 7
+
+
+def _lock_shared(db: Session):
+    # hasta el commit: una reconstrucción en curso espera a este delta (o al revés)
+    db.execute(text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": RISK_STATE_LOCK_KEY})
+
+
+def _lock_exclusive(db: Session):
+    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": RISK_STATE_LOCK_KEY})
+
+
+def _epoch(dt: datetime | None) -> float:
+    return (dt - datetime(1970, 1, 1)).total_seconds() if dt else 0.0
+
+
+# -------------------------------------------------
+# Delta incremental de un escaneo de actor
+# -------------------------------------------------
+class RiskStateDelta:
+    """Cambios de un escaneo de actor, aplicados en la misma transacción que los eventos."""
+
+    def __init__(self, actor_id: int, country: str | None):
+        self.actor_id = actor_id
+        self.country = country
+        self.techniques = {}
+        self.actor = {"active_ttps": 0, "new_7d": 0, "reactivated_7d": 0}
+
+    def _technique(self, technique_id: int):
+        if technique_id not in self.techniques:
+            self.techniques[technique_id] = {
+                "actors_using": 0,
+                "new_7d": 0,
+                "reactivated_7d": 0,
+                "active_rows": 0,
+                "first_seen_epoch_sum": 0.0,
+            }
+        return self.techniques[technique_id]
+
+    def activated(self, technique_id: int, first_seen: datetime | None):
+        t = self._technique(technique_id)
+        t["actors_using"] += 1
+        if first_seen:
+            t["active_rows"] += 1
+            t["first_seen_epoch_sum"] += _epoch(first_seen)
+        self.actor["active_ttps"] += 1
+
+    def deactivated(self, technique_id: int, first_seen: datetime | None):
+        t = self._technique(technique_id)
+        t["actors_using"] -= 1
+        if first_seen:
+            t["active_rows"] -= 1
+            t["first_seen_epoch_sum"] -= _epoch(first_seen)
+        self.actor["active_ttps"] -= 1
+
+    def event(self, technique_id: int, event_type: str):
+        key = {"NEW": "new_7d", "REACTIVATED": "reactivated_7d"}.get(event_type)
+        if not key:
+            return
+        self._technique(technique_id)[key] += 1
+        self.actor[key] += 1
+
+    def is_empty(self) -> bool:
+        return not self.techniques and not any(self.actor.values())
+
+
+def _upsert(db: Session, model, rows: list[dict], key_cols: list[str], value_cols: list[str], increment: bool):
+    if not rows:
+        return
+    table = model.__table__
+    stmt = insert(model).values(rows)
+    set_ = {"updated_at": stmt.excluded.updated_at}
+    for col in value_cols:
+        if increment:
+            set_[col] = func.coalesce(table.c[col], 0) + stmt.excluded[col]
+        else:
+            set_[col] = stmt.excluded[col]
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c[c] for c in key_cols], set_=set_)
+    db.execute(stmt)
+
+
+def apply_risk_delta(db: Session, delta: RiskStateDelta):
+    """Suma el delta al estado derivado. No hace commit: viaja con la transacción del collector."""
+    if delta is None or delta.is_empty():
+        return
+
+    _lock_shared(db)
+    now = datetime.utcnow()
+
+    _upsert(
+        db,
+        models.TechniqueRiskState,
+        [
+            {
+                "technique_id": technique_id,
+                "new_7d": t["new_7d"],
+                "reactivated_7d": t["reactivated_7d"],
+                "active_rows": t["active_rows"],
+                "first_seen_epoch_sum": t["first_seen_epoch_sum"],
+                "updated_at": now,
+            }
+            for technique_id, t in delta.techniques.items()
+        ],
+        ["technique_id"],
+        ["new_7d", "reactivated_7d", "active_rows", "first_seen_epoch_sum"],
+        increment=True
+    )
+
+    if delta.country:
+        _upsert(
+            db,
+            models.CountryTechniqueRiskState,
+            [
+                {"country": delta.country, "technique_id": technique_id, "actors_using": t["actors_using"], "updated_at": now}
+                for technique_id, t in delta.techniques.items()
+                if t["actors_using"]
+            ],
+            ["country", "technique_id"],
+            ["actors_using"],
+            increment=True
+        )
+
+    _upsert(
+        db,
+        models.ActorRiskState,
+        [{"actor_id": delta.actor_id, **delta.actor, "updated_at": now}],
+        ["actor_id"],
+        ["active_ttps", "new_7d", "reactivated_7d"],
+        increment=True
+    )
+
+
+# -------------------------------------------------
+# Reconstrucción / barrido
+# -------------------------------------------------
+def apply_actor_move(db: Session, actor_id: int, previous_country: str | None, country: str | None):
+    """
+    El actor cambió de país o se activó/desactivó (país = None si está inactivo): mueve sus
+    TTPs activas entre países en country_technique_risk_state. No hace commit.
+    """
+    if previous_country == country:
+        return
+
+    rows = (
+        db.query(models.ActorTechnique.technique_id, func.count(models.ActorTechnique.id))
+        .filter(models.ActorTechnique.actor_id == actor_id)
+        .filter(models.ActorTechnique.active == True)
+        .group_by(models.ActorTechnique.technique_id)
+        .all()
+    )
+    if not rows:
+        return
+
+    _lock_shared(db)
+    now = datetime.utcnow()
+    for target, sign in ((previous_country, -1), (country, 1)):
+        if not target:
+            continue
+        _upsert(
+            db,
+            models.CountryTechniqueRiskState,
+            [
+                {"country": target, "technique_id": technique_id, "actors_using": sign * int(count or 0), "updated_at": now}
+                for technique_id, count in rows
+            ],
+            ["country", "technique_id"],
+            ["actors_using"],
+            increment=True
+        )
+
+
+def rebuild_risk_state(db: Session):
+    """
+    Recalcula todo el estado desde las tablas crudas con consultas agrupadas. Toma el
+    advisory lock exclusivo antes de leer: los deltas ya aplicados están confirmados y
+    los que lleguen después esperan y se suman sobre el estado reconstruido.
+    """
+    _lock_exclusive(db)
+    now = datetime.utcnow()
+    since = now - timedelta(days=RISK_WINDOW_DAYS)
+
+    techniques = {}
+
+    def _tech(technique_id):
+        if technique_id not in techniques:
+            techniques[technique_id] = {"new_7d": 0, "reactivated_7d": 0, "active_rows": 0, "first_seen_epoch_sum": 0.0}
+        return techniques[technique_id]
+
+    event_rows = (
+        db.query(
+            models.IntelligenceEvent.actor_id,
+            models.IntelligenceEvent.technique_id,
+            models.IntelligenceEvent.event_type,
+            func.count(models.IntelligenceEvent.id)
+        )
+        .filter(models.IntelligenceEvent.event_type.in_(["NEW", "REACTIVATED"]))
+        .filter(models.IntelligenceEvent.created_at >= since)
+        .group_by(
+            models.IntelligenceEvent.actor_id,
+            models.IntelligenceEvent.technique_id,
+            models.IntelligenceEvent.event_type
+        )
+        .all()
+    )
+
+    actors = {}
+
+    def _actor(actor_id):
+        if actor_id not in actors:
+            actors[actor_id] = {"active_ttps": 0, "new_7d": 0, "reactivated_7d": 0}
+        return actors[actor_id]
+
+    for actor_id, technique_id, event_type, count in event_rows:
+        key = "new_7d" if event_type == "NEW" else "reactivated_7d"
+        if technique_id is not None:
+            _tech(technique_id)[key] += int(count or 0)
+        if actor_id is not None:
+            _actor(actor_id)[key] += int(count or 0)
+
+    persistence_rows = (
+        db.query(
+            models.ActorTechnique.technique_id,
+            func.count(models.ActorTechnique.first_seen),
+            func.sum(func.extract('epoch', models.ActorTechnique.first_seen))
+        )
+        .filter(models.ActorTechnique.active == True)
+        .group_by(models.ActorTechnique.technique_id)
+        .all()
+    )
+    for technique_id, rows, epoch_sum in persistence_rows:
+        t = _tech(technique_id)
+        t["active_rows"] = int(rows or 0)
+        t["first_seen_epoch_sum"] = float(epoch_sum or 0)
+
+    active_ttps_rows = (
+        db.query(models.ActorTechnique.actor_id, func.count(models.ActorTechnique.id))
+        .filter(models.ActorTechnique.active == True)
+        .group_by(models.ActorTechnique.actor_id)
+        .all()
+    )
+    for actor_id, count in active_ttps_rows:
+        _actor(actor_id)["active_ttps"] = int(count or 0)
+
+    usage_rows = (
+        db.query(
+            models.ThreatActor.country,
+            models.ActorTechnique.technique_id,
+            func.count(models.ActorTechnique.id)
+        )
+        .join(models.ThreatActor, models.ThreatActor.id == models.ActorTechnique.actor_id)
+        .filter(models.ThreatActor.active == True)
+        .filter(models.ThreatActor.country != None)
+        .filter(models.ActorTechnique.active == True)
+        .group_by(models.ThreatActor.country, models.ActorTechnique.technique_id)
+        .all()
+    )
+
+    _upsert(
+        db,
+        models.TechniqueRiskState,
+        [{"technique_id": k, **v, "updated_at": now} for k, v in techniques.items()],
+        ["technique_id"],
+        ["new_7d", "reactivated_7d", "active_rows", "first_seen_epoch_sum"],
+        increment=False
+    )
+    _upsert(
+        db,
+        models.CountryTechniqueRiskState,
+        [
+            {"country": country, "technique_id": technique_id, "actors_using": int(count or 0), "updated_at": now}
+            for country, technique_id, count in usage_rows
+        ],
+        ["country", "technique_id"],
+        ["actors_using"],
+        increment=False
+    )
+    _upsert(
+        db,
+        models.ActorRiskState,
+        [{"actor_id": k, **v, "updated_at": now} for k, v in actors.items()],
+        ["actor_id"],
+        ["active_ttps", "new_7d", "reactivated_7d"],
+        increment=False
+    )
+
+    # filas que ya no aparecen en las tablas crudas
+    for model in (models.TechniqueRiskState, models.CountryTechniqueRiskState, models.ActorRiskState):
+        db.query(model).filter(model.updated_at < now).delete(synchronize_session=False)
+
+    # el barrido descuenta desde aquí
+    window = db.query(models.RiskStateWindow).first()
+    if window is None:
+        window = models.RiskStateWindow()
+        db.add(window)
+    window.window_start = since
+    window.updated_at = now
+
+    db.commit()
+
+
+def sweep_risk_state(db: Session) -> int:
+    """
+    Resta de new_7d/reactivated_7d solo los eventos que salieron de la ventana de 7 días
+    desde el último barrido (entre window_start y ahora - 7 días). Sin marca previa
+    reconstruye todo. Devuelve cuántos eventos descontó.
+    """
+    if db.query(models.RiskStateWindow.window_start).filter(models.RiskStateWindow.window_start != None).first() is None:
+        rebuild_risk_state(db)
+        return 0
+
+    # compartido: no choca con los deltas; la fila de la ventana serializa dos barridos
+    _lock_shared(db)
+    window = db.query(models.RiskStateWindow).with_for_update().first()
+    now = datetime.utcnow()
+    window_start = now - timedelta(days=RISK_WINDOW_DAYS)
+    if window.window_start >= window_start:
+        db.commit()
+        return 0
+
+    event_rows = (
+        db.query(
+            models.IntelligenceEvent.actor_id,
+            models.IntelligenceEvent.technique_id,
+            models.IntelligenceEvent.event_type,
+            func.count(models.IntelligenceEvent.id)
+        )
+        .filter(models.IntelligenceEvent.event_type.in_(["NEW", "REACTIVATED"]))
+        .filter(models.IntelligenceEvent.created_at >= window.window_start)
+        .filter(models.IntelligenceEvent.created_at < window_start)
+        .group_by(
+            models.IntelligenceEvent.actor_id,
+            models.IntelligenceEvent.technique_id,
+            models.IntelligenceEvent.event_type
+        )
+        .all()
+    )
+
+    techniques = {}
+    actors = {}
+    aged = 0
+    for actor_id, technique_id, event_type, count in event_rows:
+        key = "new_7d" if event_type == "NEW" else "reactivated_7d"
+        count = int(count or 0)
+        aged += count
+        if technique_id is not None:
+            techniques.setdefault(technique_id, {"new_7d": 0, "reactivated_7d": 0})[key] -= count
+        if actor_id is not None:
+            actors.setdefault(actor_id, {"new_7d": 0, "reactivated_7d": 0})[key] -= count
+
+    _upsert(
+        db,
+        models.TechniqueRiskState,
+        [{"technique_id": k, **v, "updated_at": now} for k, v in techniques.items()],
+        ["technique_id"],
+        ["new_7d", "reactivated_7d"],
+        increment=True
+    )
+    _upsert(
+        db,
+        models.ActorRiskState,
+        [{"actor_id": k, **v, "updated_at": now} for k, v in actors.items()],
+        ["actor_id"],
+        ["new_7d", "reactivated_7d"],
+        increment=True
+    )
+
+    window.window_start = window_start
+    window.updated_at = now
+    db.commit()
+    return aged
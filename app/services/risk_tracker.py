@@ -1,15 +1,17 @@
 from datetime import datetime
 from sqlalchemy.orm import Session
 from app import models
+from app.services.event_bus import notify
 from app.services.risk_score import calculate_risk
 
 
 # -------------------------------------------------
 # Guardar snapshot
 # -------------------------------------------------
-def store_snapshot(db: Session, country: str):
+def store_snapshot(db: Session, country: str, risks: list | None = None):
 
-    risks = calculate_risk(db, country)
+    if risks is None:
+        risks = calculate_risk(db, country)
 
     if not risks:
         return
@@ -66,9 +68,12 @@ def detect_risk_change(db: Session, country: str):
         title=f"Risk change detected in {country}",
         description=f"Risk changed {change:.2f}% (from {previous.risk_score:.2f} to {latest.risk_score:.2f})",
         severity=severity,
+        event_type="RISK_CHANGE",
         created_at=datetime.utcnow()
     )
 
     db.add(alert)
+    db.flush()
+    notify(db, "alerts.created", {"actor_id": None, "count": 1, "alert_ids": [alert.id], "country": country})
     db.commit()
 
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app import models
+from app.database import engine, SessionLocal
+from app.services.event_bus import event_bus, notify
+from app.services.risk_state import RISK_STATE_SWEEP_MINUTES
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_TZ = ZoneInfo(os.getenv("SCHEDULER_TZ", "America/Bogota"))
+# clave del advisory lock de Postgres: solo el proceso que lo tiene dispara jobs
+SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "48151623"))
+# cada cuánto un proceso que no es líder reintenta tomar el lock
+SCHEDULER_LEADER_RETRY_SECONDS = float(os.getenv("SCHEDULER_LEADER_RETRY_SECONDS", "30"))
+# el líder nunca duerme más que esto (revisa el lock y cubre eventos perdidos)
+SCHEDULER_MAX_SLEEP_SECONDS = float(os.getenv("SCHEDULER_MAX_SLEEP_SECONDS", "300"))
+# un disparo atrasado menos que esto siempre corre, aunque catch_up esté apagado
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "300"))
+
+DAY_KEYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def parse_days(value: str | None) -> list[str]:
+    return [d.strip().lower() for d in (value or "").split(",") if d.strip().lower() in DAY_KEYS]
+
+
+def _next_interval_fire(day_keys: list[str], interval_minutes: int, after: datetime) -> datetime | None:
+    # `after` + intervalo; si cae en un día no programado, el inicio (00:00 local) del siguiente que sí
+    candidate = after + timedelta(minutes=interval_minutes)
+    local_candidate = candidate.replace(tzinfo=timezone.utc).astimezone(SCHEDULER_TZ)
+    for offset in range(8):
+        day = local_candidate.date() + timedelta(days=offset)
+        if DAY_KEYS[day.weekday()] not in day_keys:
+            continue
+        if offset == 0:
+            return candidate
+        start = datetime(day.year, day.month, day.day, tzinfo=SCHEDULER_TZ)
+        return start.astimezone(timezone.utc).replace(tzinfo=None)
+    return None
+
+
+def next_fire_time(
+    days: str | None,
+    time_hhmm: str | None,
+    after: datetime,
+    interval_minutes: int | None = None
+) -> datetime | None:
+    """Próximo disparo (UTC naive) estrictamente posterior a `after` (UTC naive)."""
+    day_keys = parse_days(days)
+    if day_keys and interval_minutes:
+        return _next_interval_fire(day_keys, interval_minutes, after)
+    if not day_keys or not time_hhmm:
+        return None
+    try:
+        hour, minute = (int(x) for x in time_hhmm.split(":"))
+    except ValueError:
+        return None
+
+    local_after = after.replace(tzinfo=timezone.utc).astimezone(SCHEDULER_TZ)
+    for offset in range(8):
+        day = local_after.date() + timedelta(days=offset)
+        if DAY_KEYS[day.weekday()] not in day_keys:
+            continue
+        candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=SCHEDULER_TZ)
+        if candidate > local_after:
+            return candidate.astimezone(timezone.utc).replace(tzinfo=None)
+    return None
+
+
+def reschedule(db: Session, entry: models.ScheduledJob, now: datetime | None = None):
+    """Recalcula next_run_at tras un cambio de configuración y avisa al líder. Sin commit."""
+    now = now or datetime.utcnow()
+    entry.next_run_at = next_fire_time(entry.days, entry.time_hhmm, now, entry.interval_minutes) if entry.enabled else None
+    entry.updated_at = now
+    notify(db, "schedule.changed", {"name": entry.name, "next_run_at": entry.next_run_at})
+
+
+def _legacy_defaults(db: Session):
+    """Programaciones por defecto; collector y MITRE heredan schedule_config / mitre_sync_config."""
+    collector = db.query(models.ScheduleConfig).first()
+    mitre = db.query(models.MitreSyncConfig).first()
+    return [
+        {
+            "name": "collector",
+            "job_type": "collector",
+            "params": {},
+            "days": collector.days if collector else "mon,tue,wed,thu,fri",
+            "time_hhmm": (collector.time_hhmm if collector else None) or "06:00",
+            "enabled": bool(collector.enabled) if collector else True,
+            "last_run_at": collector.last_run_at if collector else None,
+        },
+        {
+            "name": "mitre_sync",
+            "job_type": "mitre_sync",
+            "params": {},
+            "days": (mitre.day_of_week if mitre else None) or "sun",
+            "time_hhmm": (mitre.time_hhmm if mitre else None) or "03:00",
+            "enabled": bool(mitre.enabled) if mitre else True,
+            "last_run_at": mitre.last_run_at if mitre else None,
+        },
+        {
+            "name": "misp_sync",
+            "job_type": "misp_sync",
+            "params": {"limit": 10000, "days": 2, "page_size": 500},
+            "days": ",".join(DAY_KEYS),
+            "time_hhmm": "02:00",
+            "enabled": False,
+        },
+        {
+            "name": "opencti_sync",
+            "job_type": "opencti_sync",
+            "params": {"limit": 200},
+            "days": ",".join(DAY_KEYS),
+            "time_hhmm": "01:00",
+            "enabled": False,
+        },
+        {
+            "name": "risk_snapshot",
+            "job_type": "risk_snapshot",
+            "params": {},
+            "days": ",".join(DAY_KEYS),
+            "time_hhmm": "23:30",
+            "enabled": False,
+        },
+        {
+            # descuenta del estado de riesgo los eventos que salieron de la ventana de 7 días
+            "name": "risk_state_sweep",
+            "job_type": "risk_state_sweep",
+            "params": {},
+            "days": ",".join(DAY_KEYS),
+            "time_hhmm": "00:00",
+            "interval_minutes": max(1, RISK_STATE_SWEEP_MINUTES),
+            "enabled": RISK_STATE_SWEEP_MINUTES > 0,
+        },
+    ]
+
+
+def ensure_default_schedules(db: Session):
+    existing = {name for (name,) in db.query(models.ScheduledJob.name).all()}
+    now = datetime.utcnow()
+    created = False
+    for item in _legacy_defaults(db):
+        if item["name"] in existing:
+            continue
+        entry = models.ScheduledJob(
+            name=item["name"],
+            job_type=item["job_type"],
+            params=json.dumps(item["params"]),
+            days=item["days"],
+            time_hhmm=item["time_hhmm"],
+            interval_minutes=item.get("interval_minutes"),
+            enabled=item["enabled"],
+            catch_up=True,
+            last_run_at=item.get("last_run_at"),
+            updated_at=now,
+        )
+        entry.next_run_at = next_fire_time(entry.days, entry.time_hhmm, now, entry.interval_minutes) if entry.enabled else None
+        db.add(entry)
+        created = True
+    if created:
+        db.commit()
+
+
+class Scheduler:
+    """
+    Un solo proceso (el que tiene el advisory lock) dispara los jobs programados:
+    duerme hasta el próximo next_run_at y se despierta antes si llega `schedule.changed`.
+    next_run_at vive en BD, así que un disparo perdido mientras el backend estaba caído
+    se ejecuta al volver (catch_up) o se salta al siguiente.
+    """
+
+    def __init__(self, fire):
+        # fire(db, entry) encola el job y devuelve el JobRun (o None si no se pudo)
+        self._fire = fire
+        self._lock_conn = None
+
+    # -------------------------------------------------
+    # Liderazgo
+    # -------------------------------------------------
+    def _is_leader(self) -> bool:
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.execute(text("SELECT 1"))
+                self._lock_conn.commit()
+                return True
+            except Exception as e:
+                print("Scheduler lost leader connection:", e)
+                self._release()
+
+        conn = engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SCHEDULER_LOCK_KEY}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        # el lock es de sesión: se mantiene mientras esta conexión siga abierta
+        self._lock_conn = conn
+        print("Scheduler: this process is the leader")
+        return True
+
+    def _release(self):
+        conn, self._lock_conn = self._lock_conn, None
+        if conn is not None:
+            try:
+                conn.invalidate()
+            except Exception:
+                pass
+
+    # -------------------------------------------------
+    # Disparos
+    # -------------------------------------------------
+    def run_due(self) -> datetime | None:
+        """Dispara lo vencido y devuelve el próximo next_run_at (UTC) o None."""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            entries = db.query(models.ScheduledJob).filter(models.ScheduledJob.enabled == True).all()
+            for entry in entries:
+                if entry.next_run_at is None:
+                    entry.next_run_at = next_fire_time(entry.days, entry.time_hhmm, now, entry.interval_minutes)
+                    continue
+                if entry.next_run_at > now:
+                    continue
+
+                late = (now - entry.next_run_at).total_seconds()
+                if entry.catch_up or late <= SCHEDULER_MISFIRE_GRACE_SECONDS:
+                    try:
+                        job = self._fire(db, entry)
+                        entry.last_run_at = now
+                        entry.last_job_id = job.id if job is not None else entry.last_job_id
+                        print(f"Scheduler fired {entry.name} (late {int(late)}s)")
+                    except Exception as e:
+                        db.rollback()
+                        print("Scheduler fire error:", entry.name, e)
+                        entry = db.query(models.ScheduledJob).filter(models.ScheduledJob.id == entry.id).first()
+                else:
+                    print(f"Scheduler skipped missed run of {entry.name} (late {int(late)}s, catch_up off)")
+
+                # varios disparos perdidos cuentan como uno: el siguiente es posterior a ahora
+                entry.next_run_at = next_fire_time(entry.days, entry.time_hhmm, now, entry.interval_minutes)
+            db.commit()
+
+            upcoming = [e.next_run_at for e in entries if e.enabled and e.next_run_at]
+            return min(upcoming) if upcoming else None
+        finally:
+            db.close()
+
+    async def run_forever(self):
+        queue = event_bus.subscribe(asyncio.get_running_loop(), {"schedule"})
+        try:
+            while True:
+                timeout = SCHEDULER_LEADER_RETRY_SECONDS
+                try:
+                    if await asyncio.to_thread(self._is_leader):
+                        next_run_at = await asyncio.to_thread(self.run_due)
+                        timeout = SCHEDULER_MAX_SLEEP_SECONDS
+                        if next_run_at is not None:
+                            timeout = min(timeout, max(0.0, (next_run_at - datetime.utcnow()).total_seconds()))
+                except Exception as e:
+                    print("Scheduler error:", e)
+
+                try:
+                    # un cambio de programación en cualquier proceso despierta al líder
+                    await asyncio.wait_for(queue.get(), timeout=timeout)
+                    while not queue.empty():
+                        queue.get_nowait()
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            event_bus.unsubscribe(queue)
+            self._release()
@@ -0,0 +1,82 @@
+from datetime import datetime
+from sqlalchemy import DateTime, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+
+FirstSeen = models.TacticFirstSeen
+
+
+def record_new_events(db: Session, catalog, events):
+    """
+    events: [(actor_id, technique_id, created_at)] de eventos NEW recién escritos.
+    Upsert por táctica que solo reemplaza si el evento es anterior al registrado. No hace commit.
+    """
+    earliest = {}
+    for actor_id, technique_id, created_at in events:
+        entry = catalog.get_by_id(technique_id)
+        for tactic in (entry.tactics if entry else ()):
+            current = earliest.get(tactic)
+            if current is None or created_at < current[0]:
+                earliest[tactic] = (created_at, actor_id, technique_id)
+    if not earliest:
+        return 0
+
+    now = datetime.utcnow()
+    table = FirstSeen.__table__
+    stmt = insert(FirstSeen).values([
+        {
+            "tactic": tactic,
+            "first_seen_at": created_at,
+            "actor_id": actor_id,
+            "technique_id": technique_id,
+            "updated_at": now,
+        }
+        for tactic, (created_at, actor_id, technique_id) in sorted(earliest.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.tactic],
+        set_={
+            "first_seen_at": stmt.excluded.first_seen_at,
+            "actor_id": stmt.excluded.actor_id,
+            "technique_id": stmt.excluded.technique_id,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=stmt.excluded.first_seen_at < table.c.first_seen_at
+    )
+    db.execute(stmt)
+    return len(earliest)
+
+
+def rebuild_tactic_first_seen(db: Session):
+    """Reconstruye desde el historial de NEW (DISTINCT ON por táctica). Hace commit."""
+    E = models.IntelligenceEvent
+    TT = models.TechniqueTactic
+    now = literal(datetime.utcnow(), DateTime)
+    source = (
+        select(TT.tactic, E.created_at, E.actor_id, E.technique_id, now)
+        .join(E, E.technique_id == TT.technique_id)
+        .where(E.event_type == "NEW")
+        .where(E.created_at != None)
+        .distinct(TT.tactic)
+        .order_by(TT.tactic, E.created_at, E.id)
+    )
+
+    db.query(FirstSeen).delete(synchronize_session=False)
+    result = db.execute(
+        insert(FirstSeen).from_select(
+            ["tactic", "first_seen_at", "actor_id", "technique_id", "updated_at"],
+            source
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def first_seen_is_empty(db: Session) -> bool:
+    if db.query(FirstSeen.tactic).limit(1).first():
+        return False
+    return db.query(models.IntelligenceEvent.id)\
+        .filter(models.IntelligenceEvent.event_type == "NEW")\
+        .limit(1)\
+        .first() is not None
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy.orm import Session
+from app import models
+
+# el catálogo ATT&CK (~800 técnicas) solo cambia con el sync de MITRE;
+# el TTL cubre el caso de un sync ejecutado en otro proceso/worker
+CATALOG_TTL_SECONDS = int(os.getenv("TECHNIQUE_CATALOG_TTL_SECONDS", "300"))
+
+TechniqueEntry = namedtuple("TechniqueEntry", ["id", "tech_id", "name", "tactic", "tactics", "description"])
+
+
+def split_tactics(tactic_value: str | None) -> tuple[str, ...]:
+    return tuple(x.strip().lower() for x in (tactic_value or "").split(",") if x.strip())
+
+
+class TechniqueCatalog:
+    """Índice de solo lectura del catálogo de técnicas, por tech_id (T1059) y por id."""
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.by_id = {e.id: e for e in self.entries}
+        self.by_code = {e.tech_id: e for e in self.entries if e.tech_id}
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, tech_id: str | None):
+        return self.by_code.get(tech_id)
+
+    def get_by_id(self, technique_id: int | None):
+        return self.by_id.get(technique_id)
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.loaded_at >= CATALOG_TTL_SECONDS
+
+
+_catalog = None
+_reload_lock = threading.Lock()
+
+
+def build_catalog(db: Session) -> TechniqueCatalog:
+    rows = db.query(
+        models.Technique.id,
+        models.Technique.tech_id,
+        models.Technique.name,
+        models.Technique.tactic,
+        models.Technique.description
+    ).all()
+
+    return TechniqueCatalog(
+        TechniqueEntry(
+            id=r.id,
+            tech_id=r.tech_id,
+            name=r.name,
+            tactic=r.tactic,
+            tactics=split_tactics(r.tactic),
+            description=r.description
+        )
+        for r in rows
+    )
+
+
+def reload_catalog(db: Session) -> TechniqueCatalog:
+    global _catalog
+    catalog = build_catalog(db)
+    # reemplazo atómico: los lectores ven el índice viejo o el nuevo, nunca uno a medias
+    _catalog = catalog
+    return catalog
+
+
+def get_catalog(db: Session) -> TechniqueCatalog:
+    catalog = _catalog
+    if catalog is not None and not catalog.is_stale():
+        return catalog
+
+    # un solo hilo recarga; el resto sigue usando el índice anterior si existe
+    if not _reload_lock.acquire(blocking=catalog is None):
+        return catalog
+    try:
+        current = _catalog
+        if current is not None and not current.is_stale():
+            return current
+        return reload_catalog(db)
+    finally:
+        _reload_lock.release()
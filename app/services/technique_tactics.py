@@ -0,0 +1,64 @@
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app import models
+from app.services.technique_catalog import split_tactics
+
+
+def sync_technique_tactics(db: Session, tactics_by_technique: dict):
+    """
+    Deja technique_tactics igual a {technique_id: iterable de tácticas} para las técnicas
+    indicadas (las demás no se tocan). Diferencia en memoria + dos sentencias. No hace commit.
+    """
+    if not tactics_by_technique:
+        return 0
+
+    wanted = {
+        (technique_id, tactic)
+        for technique_id, tactics in tactics_by_technique.items()
+        for tactic in tactics
+    }
+    current = set(
+        db.query(models.TechniqueTactic.technique_id, models.TechniqueTactic.tactic)
+        .filter(models.TechniqueTactic.technique_id.in_(list(tactics_by_technique)))
+        .all()
+    )
+
+    stale = current - wanted
+    if stale:
+        db.query(models.TechniqueTactic)\
+            .filter(tuple_(models.TechniqueTactic.technique_id, models.TechniqueTactic.tactic).in_(sorted(stale)))\
+            .delete(synchronize_session=False)
+
+    missing = wanted - current
+    if missing:
+        stmt = insert(models.TechniqueTactic).values([
+            {"technique_id": technique_id, "tactic": tactic}
+            for technique_id, tactic in sorted(missing)
+        ])
+        db.execute(stmt.on_conflict_do_nothing())
+
+    return len(stale) + len(missing)
+
+
+def rebuild_technique_tactics(db: Session):
+    """Backfill desde el string Technique.tactic de todo el catálogo. Hace commit."""
+    rows = db.query(models.Technique.id, models.Technique.tactic).all()
+    changed = sync_technique_tactics(db, {technique_id: split_tactics(tactic) for technique_id, tactic in rows})
+    db.commit()
+    return changed
+
+
+def ensure_technique_tactics(db: Session):
+    """Backfill al arrancar si la tabla quedó vacía (BD migrada o catálogo cargado antes)."""
+    if db.query(models.TechniqueTactic.technique_id).limit(1).first():
+        return 0
+    if not db.query(models.Technique.id).limit(1).first():
+        return 0
+    return rebuild_technique_tactics(db)
+
+
+def technique_ids_for_tactic(db: Session, tactic: str):
+    """Subconsulta de technique_id con esa táctica (usa el índice (tactic, technique_id))."""
+    return db.query(models.TechniqueTactic.technique_id)\
+        .filter(models.TechniqueTactic.tactic == (tactic or "").strip().lower())
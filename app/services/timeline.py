@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from app import models
+from app.services.technique_catalog import get_catalog
 
 
 def get_actor_timeline(db: Session, actor_name: str):
@@ -16,11 +17,13 @@ def get_actor_timeline(db: Session, actor_name: str):
         .order_by(models.IntelligenceEvent.created_at.asc())\
         .all()
 
+    catalog = get_catalog(db)
+
     timeline = []
 
     for e in events:
 
-        tech = db.query(models.Technique).filter_by(id=e.technique_id).first()
+        tech = catalog.get_by_id(e.technique_id)
 
         timeline.append({
             "date": e.created_at.strftime("%Y-%m-%d"),
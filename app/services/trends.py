@@ -1,59 +1,50 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app import models
+from app.services.country_cube import technique_usage
+from app.services.event_rollup import local_today
 
 
 def get_trends(db: Session, country: str, days: int = 7):
 
-    since = datetime.utcnow() - timedelta(days=days)
+    # days=7 son 7 días locales: hoy y los 6 anteriores
+    since_day = local_today() - timedelta(days=max(1, days) - 1)
 
-    actors = db.query(models.ThreatActor).filter_by(country=country, active=True).all()
-    actor_ids = [a.id for a in actors]
+    actor_exists = db.query(models.ThreatActor.id)\
+        .filter_by(country=country, active=True)\
+        .first()
 
-    if not actor_ids:
+    if not actor_exists:
         return {}
 
-    # NEW
-    new_ttps = db.query(models.Technique.tech_id)\
-        .join(models.IntelligenceEvent)\
-        .filter(models.IntelligenceEvent.actor_id.in_(actor_ids))\
-        .filter(models.IntelligenceEvent.event_type == "NEW")\
-        .filter(models.IntelligenceEvent.created_at >= since)\
-        .all()
-
-    # DISAPPEARED
-    disappeared = db.query(models.Technique.tech_id)\
-        .join(models.IntelligenceEvent)\
-        .filter(models.IntelligenceEvent.actor_id.in_(actor_ids))\
-        .filter(models.IntelligenceEvent.event_type == "DISAPPEARED")\
-        .filter(models.IntelligenceEvent.created_at >= since)\
+    # NEW / DISAPPEARED / REACTIVATED desde el rollup diario (una fila por técnica y tipo)
+    rows = db.query(
+        models.IntelEventDaily.event_type,
+        models.Technique.tech_id,
+        func.sum(models.IntelEventDaily.events)
+    )\
+        .join(models.Technique, models.Technique.id == models.IntelEventDaily.technique_id)\
+        .join(models.ThreatActor, models.ThreatActor.id == models.IntelEventDaily.actor_id)\
+        .filter(models.ThreatActor.country == country)\
+        .filter(models.ThreatActor.active == True)\
+        .filter(models.IntelEventDaily.day >= since_day)\
+        .group_by(models.IntelEventDaily.event_type, models.Technique.tech_id)\
+        .order_by(models.Technique.tech_id)\
         .all()
 
-    # REACTIVATED
-    reactivated = db.query(models.Technique.tech_id)\
-        .join(models.IntelligenceEvent)\
-        .filter(models.IntelligenceEvent.actor_id.in_(actor_ids))\
-        .filter(models.IntelligenceEvent.event_type == "REACTIVATED")\
-        .filter(models.IntelligenceEvent.created_at >= since)\
-        .all()
+    # se mantiene el formato previo: el tech_id se repite una vez por evento
+    by_type = {"NEW": [], "DISAPPEARED": [], "REACTIVATED": []}
+    for event_type, tech_id, count in rows:
+        if event_type in by_type:
+            by_type[event_type].extend([tech_id] * int(count or 0))
 
-    # TOP USED
-    top = db.query(
-        models.Technique.tech_id,
-        func.count(models.ActorTechnique.id).label("count")
-    ).join(models.ActorTechnique)\
-     .filter(models.ActorTechnique.actor_id.in_(actor_ids))\
-     .filter(models.ActorTechnique.active == True)\
-     .group_by(models.Technique.tech_id)\
-     .order_by(func.count(models.ActorTechnique.id).desc())\
-     .limit(10)\
-     .all()
+    # TOP USED (cubo country_technique_stats)
+    top = technique_usage(db, country, limit=10)
 
     return {
-        "new_ttps": [t[0] for t in new_ttps],
-        "disappeared_ttps": [t[0] for t in disappeared],
-        "reactivated_ttps": [t[0] for t in reactivated],
-        "top_ttps": [{"technique": t[0], "count": t[1]} for t in top]
+        "new_ttps": by_type["NEW"],
+        "disappeared_ttps": by_type["DISAPPEARED"],
+        "reactivated_ttps": by_type["REACTIVATED"],
+        "top_ttps": [{"technique": t[0], "count": int(t[3] or 0)} for t in top]
     }
-
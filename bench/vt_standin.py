@@ -0,0 +1,324 @@
+"""
+Stand-in local de la API VirusTotal/GTI para medir el collector sin gastar cuota.
+
+Sirve respuestas sintéticas (deterministas por actor) o grabadas (--replay DIR) para
+los endpoints que usa app.services.gti_collector, con latencia, paginación y 429 configurables.
+
+    python -m bench.vt_standin --actors 200 --techniques 50 --latency-ms 80 --rate-429 0.02
+
+Con --replay DIR, una ruta como /api/v3/collections/abc/relationships/attack_techniques
+se busca primero en DIR/collections/abc/relationships/attack_techniques.json
+(o ...attack_techniques.<cursor>.json para las páginas siguientes).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+API_PREFIX = "/api/v3"
+
+# códigos ATT&CK reales, para que el collector los encuentre en el catálogo MITRE cargado
+DEFAULT_TECHNIQUES = [
+    "T1001", "T1003", "T1005", "T1007", "T1012", "T1016", "T1018", "T1021", "T1027", "T1033",
+    "T1036", "T1041", "T1046", "T1047", "T1048", "T1049", "T1053", "T1055", "T1056", "T1057",
+    "T1059", "T1068", "T1069", "T1070", "T1071", "T1074", "T1078", "T1082", "T1083", "T1087",
+    "T1090", "T1095", "T1098", "T1102", "T1105", "T1106", "T1110", "T1112", "T1113", "T1114",
+    "T1119", "T1120", "T1124", "T1129", "T1132", "T1133", "T1134", "T1135", "T1136", "T1140",
+    "T1176", "T1185", "T1187", "T1189", "T1190", "T1195", "T1197", "T1199", "T1200", "T1201",
+    "T1203", "T1204", "T1205", "T1207", "T1210", "T1211", "T1212", "T1213", "T1216", "T1217",
+    "T1218", "T1219", "T1220", "T1221", "T1222", "T1480", "T1482", "T1484", "T1485", "T1486",
+]
+
+
+class StandinConfig:
+    def __init__(
+        self,
+        actors: int = 50,
+        techniques: int = 30,
+        technique_pool: list[str] | None = None,
+        files_per_actor: int = 40,
+        files_fallback_fraction: float = 0.0,
+        page_size: int = 40,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        replay_dir: str | None = None,
+        seed: int = 7,
+    ):
+        self.actors = actors
+        self.techniques = techniques
+        self.technique_pool = list(technique_pool or DEFAULT_TECHNIQUES)
+        self.files_per_actor = files_per_actor
+        self.files_fallback_fraction = files_fallback_fraction
+        self.page_size = max(1, page_size)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.replay_dir = Path(replay_dir) if replay_dir else None
+        self.seed = seed
+
+
+def actor_name(index: int) -> str:
+    return f"BENCH-ACTOR-{index:05d}"
+
+
+def collection_id(index: int) -> str:
+    return f"threat-actor--bench-{index:05d}"
+
+
+def _actor_index(value: str) -> int | None:
+    prefix = "threat-actor--bench-"
+    if not value.startswith(prefix):
+        return None
+    try:
+        return int(value[len(prefix):])
+    except ValueError:
+        return None
+
+
+class SyntheticIntel:
+    """Datos deterministas: el actor i siempre devuelve las mismas técnicas y samples."""
+
+    def __init__(self, config: StandinConfig):
+        self.config = config
+
+    def _rng(self, *parts) -> random.Random:
+        return random.Random(f"{self.config.seed}:" + ":".join(str(p) for p in parts))
+
+    def known(self, index: int | None) -> bool:
+        return index is not None and 0 <= index < self.config.actors
+
+    def uses_files_fallback(self, index: int) -> bool:
+        return self._rng("fallback", index).random() < self.config.files_fallback_fraction
+
+    def techniques(self, index: int) -> list[str]:
+        pool = self.config.technique_pool
+        return sorted(self._rng("ttps", index).sample(pool, min(self.config.techniques, len(pool))))
+
+    def file_hashes(self, index: int) -> list[str]:
+        return [
+            hashlib.sha256(f"{self.config.seed}:{index}:{j}".encode()).hexdigest()
+            for j in range(self.config.files_per_actor)
+        ]
+
+    def file_techniques(self, file_hash: str) -> list[str] | None:
+        # el hash no dice de qué actor es: repartimos técnicas del pool de forma estable
+        rng = self._rng("file", file_hash)
+        if rng.random() < 0.1:
+            return None  # sample sin reporte de comportamiento (404)
+        pool = self.config.technique_pool
+        return sorted(rng.sample(pool, min(len(pool), rng.randint(1, 8))))
+
+
+class StandinStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.by_endpoint = {}
+
+    def record(self, endpoint: str, throttled: bool):
+        with self._lock:
+            self.requests += 1
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+            if throttled:
+                self.throttled += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "throttled_429": self.throttled, "by_endpoint": dict(self.by_endpoint)}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "vt-standin/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # -------------------------------------------------
+    # Respuestas
+    # -------------------------------------------------
+    def _send(self, status: int, payload: dict | None = None, headers: dict | None = None):
+        body = json.dumps(payload or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self):
+        self._send(404, {"error": {"code": "NotFoundError", "message": "not found"}})
+
+    def _page(self, path: str, query: dict, items: list[dict]):
+        limit = int((query.get("limit") or [self.server.config.page_size])[0])
+        limit = max(1, min(limit, self.server.config.page_size))
+        cursor = int((query.get("cursor") or ["0"])[0] or 0)
+        page = items[cursor:cursor + limit]
+        links = {"self": f"http://{self.headers.get('Host')}{path}"}
+        if cursor + limit < len(items):
+            links["next"] = f"http://{self.headers.get('Host')}{path}?limit={limit}&cursor={cursor + limit}"
+        self._send(200, {"data": page, "links": links, "meta": {"count": len(items)}})
+
+    def _replay(self, route: str, query: dict) -> bool:
+        replay_dir = self.server.config.replay_dir
+        if not replay_dir:
+            return False
+        cursor = (query.get("cursor") or [""])[0]
+        name = route.strip("/") + (f".{cursor}" if cursor else "") + ".json"
+        candidate = (replay_dir / name).resolve()
+        if replay_dir.resolve() not in candidate.parents or not candidate.is_file():
+            return False
+        self._send(200, json.loads(candidate.read_text()))
+        return True
+
+    # -------------------------------------------------
+    # Rutas
+    # -------------------------------------------------
+    def do_GET(self):
+        config = self.server.config
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query)
+        route = path[len(API_PREFIX):] if path.startswith(API_PREFIX) else path
+        segments = [unquote(x) for x in route.strip("/").split("/") if x]
+        endpoint = "/".join(
+            "{id}" if i == 1 and segments[0] in ("collections", "files") else s
+            for i, s in enumerate(segments)
+        )
+
+        if config.latency_ms or config.jitter_ms:
+            time.sleep(max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000.0)
+
+        throttled = config.rate_429 > 0 and random.random() < config.rate_429
+        self.server.stats.record(endpoint, throttled)
+        if throttled:
+            self._send(429, {"error": {"code": "QuotaExceededError"}}, headers={"Retry-After": str(config.retry_after)})
+            return
+
+        if self._replay(route, query):
+            return
+
+        intel = self.server.intel
+
+        if segments[:1] == ["intelligence"] and segments[1:2] == ["search"]:
+            raw = (query.get("query") or [""])[0]
+            name = raw.split('"')[1] if raw.count('"') >= 2 else ""
+            prefix = "BENCH-ACTOR-"
+            index = int(name[len(prefix):]) if name.startswith(prefix) and name[len(prefix):].isdigit() else None
+            data = [{"id": collection_id(index), "type": "collection"}] if intel.known(index) else []
+            self._send(200, {"data": data})
+            return
+
+        if segments[:1] == ["collections"] and len(segments) >= 2:
+            index = _actor_index(segments[1])
+            if not intel.known(index):
+                self._not_found()
+                return
+            if len(segments) == 2:
+                self._send(200, {"data": {"id": segments[1], "type": "collection", "attributes": {"name": actor_name(index)}}})
+                return
+            if segments[2:] == ["relationships", "attack_techniques"]:
+                ttps = [] if intel.uses_files_fallback(index) else intel.techniques(index)
+                self._page(path, query, [{"id": t, "type": "attack_technique"} for t in ttps])
+                return
+            if segments[2:] == ["relationships", "files"]:
+                self._page(path, query, [{"id": h, "type": "file"} for h in intel.file_hashes(index)])
+                return
+
+        if segments[:1] == ["files"] and segments[2:] == ["behaviour_mitre_trees"]:
+            techniques = intel.file_techniques(segments[1])
+            if techniques is None:
+                self._not_found()
+                return
+            self._send(200, {
+                "data": {
+                    "bench_sandbox": {
+                        "tactics": [{"id": "TA0000", "techniques": [{"id": t} for t in techniques]}]
+                    }
+                }
+            })
+            return
+
+        self._not_found()
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StandinConfig):
+        super().__init__(address, StandinHandler)
+        self.config = config
+        self.intel = SyntheticIntel(config)
+        self.stats = StandinStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+
+def start_standin(config: StandinConfig, host: str = "127.0.0.1", port: int = 0) -> StandinServer:
+    """Arranca el stand-in en un hilo de fondo (port=0 elige un puerto libre)."""
+    server = StandinServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="vt-standin", daemon=True).start()
+    return server
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_standin_arguments(parser)
+    return parser
+
+
+def add_standin_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--actors", type=int, default=50, help="actores sintéticos (BENCH-ACTOR-00000..)")
+    parser.add_argument("--techniques", type=int, default=30, help="técnicas por actor")
+    parser.add_argument("--files-per-actor", type=int, default=40)
+    parser.add_argument("--files-fallback-fraction", type=float, default=0.0, help="fracción de actores sin attack_techniques (fuerza el fallback por archivos)")
+    parser.add_argument("--page-size", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilidad de responder 429 a cada request")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--replay", default=None, help="directorio con respuestas grabadas (.json)")
+    parser.add_argument("--seed", type=int, default=7)
+
+
+def config_from_args(args) -> StandinConfig:
+    return StandinConfig(
+        actors=args.actors,
+        techniques=args.techniques,
+        files_per_actor=args.files_per_actor,
+        files_fallback_fraction=args.files_fallback_fraction,
+        page_size=args.page_size,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        replay_dir=args.replay,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    server = StandinServer((args.host, args.port), config_from_args(args))
+    print(f"VT stand-in listening on {server.base_url} (export VT_API_BASE={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.snapshot(), indent=2))
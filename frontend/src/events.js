@@ -0,0 +1,28 @@
+import api from "./api";
+
+// Suscripción SSE a /events/stream. handlers: { "jobs.progress": fn(event), ... }
+// Devuelve una función para cerrar la conexión.
+export function subscribeEvents(topics, handlers, onStatus) {
+  if (typeof window === "undefined" || !window.EventSource) {
+    if (onStatus) onStatus(false);
+    return () => {};
+  }
+
+  const base = (api.defaults.baseURL || "").replace(/\/$/, "");
+  const source = new EventSource(`${base}/events/stream?topics=${encodeURIComponent(topics.join(","))}`);
+
+  Object.entries(handlers).forEach(([type, handler]) => {
+    source.addEventListener(type, (e) => {
+      try {
+        handler(JSON.parse(e.data));
+      } catch {
+        // evento mal formado: se ignora
+      }
+    });
+  });
+
+  source.onopen = () => onStatus && onStatus(true);
+  source.onerror = () => onStatus && onStatus(false);
+
+  return () => source.close();
+}
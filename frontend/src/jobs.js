@@ -0,0 +1,24 @@
+import api from "./api";
+
+const FINAL_STATUSES = ["SUCCESS", "ERROR", "CANCELLED"];
+
+// Los endpoints /admin/* y /actors/{id}/scan encolan el job y devuelven su id:
+// espera a que termine consultando /jobs/{id} y devuelve el job final (con result).
+export function waitForJob(jobId, { intervalMs = 2000, onUpdate } = {}) {
+  return new Promise((resolve, reject) => {
+    const poll = () => {
+      api.get(`/jobs/${jobId}`)
+        .then(res => {
+          const job = res.data || {};
+          if (onUpdate) onUpdate(job);
+          if (FINAL_STATUSES.includes(job.status)) {
+            resolve(job);
+            return;
+          }
+          setTimeout(poll, intervalMs);
+        })
+        .catch(reject);
+    };
+    poll();
+  });
+}
@@ -1,6 +1,7 @@
 import { useEffect, useMemo, useRef, useState } from "react";
 import { Link } from "react-router-dom";
 import api from "../api";
+import { waitForJob } from "../jobs";
 import "../styles/actors.css";
 
 const RELEVANCE_STORAGE_KEY = "actors_relevance_levels_v1";
@@ -229,13 +230,22 @@ export default function Actors() {
     setScanStatus({ type: "loading", message: `Escaneando ${actorName}...` });
     api.post(`/actors/${actorId}/scan`)
       .then(res => {
-        const r = res?.data?.result;
-        if (!r) {
+        const jobId = res?.data?.job_id;
+        if (!jobId) {
           setScanStatus({ type: "error", message: "Respuesta inválida del backend." });
+          return null;
+        }
+        return waitForJob(jobId);
+      })
+      .then(job => {
+        if (!job) return;
+        if (job.status === "CANCELLED") {
+          setScanStatus({ type: "error", message: "Escaneo cancelado." });
           return;
         }
-        if (r?.status !== "ok") {
-          setScanStatus({ type: "error", message: `Error de escaneo: ${r?.error || "desconocido"}` });
+        const r = job.result;
+        if (job.status !== "SUCCESS" || !r) {
+          setScanStatus({ type: "error", message: `Error de escaneo: ${job.error || "desconocido"}` });
           return;
         }
         if (r?.error === "NOT_FOUND") {
@@ -377,7 +387,12 @@ export default function Actors() {
   const runMitreSync = () => {
     setMitreStatus({ type: "loading", message: "Actualizando MITRE..." });
     api.post("/admin/update-mitre")
-      .then(() => {
+      .then(res => waitForJob(res.data.job_id))
+      .then(job => {
+        if (job.status !== "SUCCESS") {
+          setMitreStatus({ type: "error", message: `Falló la actualización MITRE: ${job.error || job.status}` });
+          return;
+        }
         setMitreStatus({ type: "success", message: "MITRE actualizado." });
         loadMitreSchedule();
       })
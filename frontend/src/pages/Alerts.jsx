@@ -1,21 +1,70 @@
-import { useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import api from "../api";
+import { subscribeEvents } from "../events";
 import "./alerts.css";
 
+const SEVERITY_OPTIONS = ["ALL", "HIGH", "MEDIUM", "LOW"];
+const EVENT_TYPE_OPTIONS = ["ALL", "NEW", "REACTIVATED", "DISAPPEARED", "RISK_CHANGE"];
+
 export default function Alerts() {
   const [alerts, setAlerts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [actors, setActors] = useState([]);
   const [recentMap, setRecentMap] = useState({});
+  const [severityFilter, setSeverityFilter] = useState("ALL");
+  const [eventTypeFilter, setEventTypeFilter] = useState("ALL");
+  const [tacticFilter, setTacticFilter] = useState("");
+  const reloadTimer = useRef(null);
 
-  useEffect(() => {
-    api.get("/alerts")
-      .then(res => setAlerts(res.data))
+  const alertParams = useCallback((cursor) => {
+    const params = { limit: 200 };
+    if (cursor) params.cursor = cursor;
+    if (severityFilter !== "ALL") params.severity = severityFilter;
+    if (eventTypeFilter !== "ALL") params.event_type = eventTypeFilter;
+    if (tacticFilter.trim()) params.tactic = tacticFilter.trim();
+    return params;
+  }, [severityFilter, eventTypeFilter, tacticFilter]);
+
+  const loadAlerts = useCallback(() => {
+    api.get("/alerts", { params: alertParams() })
+      .then(res => {
+        setAlerts(Array.isArray(res.data?.items) ? res.data.items : []);
+        setNextCursor(res.data?.next_cursor || null);
+      })
       .catch(err => console.error(err));
+  }, [alertParams]);
+
+  const loadMore = () => {
+    if (!nextCursor) return;
+    api.get("/alerts", { params: alertParams(nextCursor) })
+      .then(res => {
+        const items = Array.isArray(res.data?.items) ? res.data.items : [];
+        setAlerts(prev => [...prev, ...items]);
+        setNextCursor(res.data?.next_cursor || null);
+      })
+      .catch(err => console.error(err));
+  };
+
+  useEffect(() => {
+    loadAlerts();
 
     api.get("/actors")
       .then(res => setActors(Array.isArray(res.data) ? res.data : []))
       .catch(() => setActors([]));
-  }, []);
+  }, [loadAlerts]);
+
+  useEffect(() => {
+    // un collector genera alertas por actor en ráfagas: agrupamos la recarga
+    const onCreated = () => {
+      clearTimeout(reloadTimer.current);
+      reloadTimer.current = setTimeout(loadAlerts, 1500);
+    };
+    const unsubscribe = subscribeEvents(["alerts"], { "alerts.created": onCreated });
+    return () => {
+      clearTimeout(reloadTimer.current);
+      unsubscribe();
+    };
+  }, [loadAlerts]);
 
   useEffect(() => {
     const groupedAlerts = alerts.reduce((acc, a) => {
@@ -85,6 +134,32 @@ export default function Alerts() {
         <span className="alerts-count">{alerts.length} eventos</span>
       </div>
 
+      <div className="alerts-filters">
+        <label>
+          Severidad
+          <select value={severityFilter} onChange={(e) => setSeverityFilter(e.target.value)}>
+            {SEVERITY_OPTIONS.map(s => <option key={s} value={s}>{s}</option>)}
+          </select>
+        </label>
+        <label>
+          Evento
+          <select value={eventTypeFilter} onChange={(e) => setEventTypeFilter(e.target.value)}>
+            {EVENT_TYPE_OPTIONS.map(t => <option key={t} value={t}>{t}</option>)}
+          </select>
+        </label>
+        <label>
+          Táctica
+          <input
+            value={tacticFilter}
+            placeholder="ej. persistence"
+            onChange={(e) => setTacticFilter(e.target.value)}
+          />
+        </label>
+        {nextCursor && (
+          <button type="button" className="alerts-more" onClick={loadMore}>Cargar más antiguas</button>
+        )}
+      </div>
+
       {groups.length === 0 ? (
         <p>No hay alertas aún.</p>
       ) : (
@@ -1,5 +1,6 @@
 import { useEffect, useMemo, useState } from "react";
 import api from "../api";
+import { waitForJob } from "../jobs";
 import "../styles/dashboard.css";
 import {
   LineChart,
@@ -146,8 +147,13 @@ export default function Dashboard() {
         page_size: 500
       }
     })
-      .then((res) => {
-        const data = res.data || {};
+      .then((res) => waitForJob(res.data.job_id))
+      .then((job) => {
+        if (job.status !== "SUCCESS") {
+          setMispSyncMsg(`No se pudo sincronizar MISP: ${job.error || job.status}`);
+          return;
+        }
+        const data = job.result || {};
         setMispSyncMsg(
           `MISP actualizado: fetched=${data.fetched || 0}, created=${data.created || 0}, updated=${data.updated || 0}`
         );
@@ -1,9 +1,10 @@
 import { useCallback, useEffect, useState } from "react";
 import api from "../api";
+import { subscribeEvents } from "../events";
 import "../styles/jobs.css";
 
-const STATUS_OPTIONS = ["ALL", "RUNNING", "SUCCESS", "ERROR"];
-const TYPE_OPTIONS = ["ALL", "collector", "actor_scan", "mitre_sync", "opencti_sync"];
+const STATUS_OPTIONS = ["ALL", "PENDING", "RUNNING", "SUCCESS", "ERROR", "CANCELLED"];
+const TYPE_OPTIONS = ["ALL", "collector", "actor_scan", "mitre_sync", "opencti_sync", "misp_sync"];
 
 export default function Jobs() {
   const [jobs, setJobs] = useState([]);
@@ -11,6 +12,7 @@ export default function Jobs() {
   const [error, setError] = useState("");
   const [statusFilter, setStatusFilter] = useState("ALL");
   const [typeFilter, setTypeFilter] = useState("ALL");
+  const [live, setLive] = useState(false);
 
   const loadJobs = useCallback(async () => {
     try {
@@ -31,19 +33,59 @@ export default function Jobs() {
   useEffect(() => {
     setLoading(true);
     loadJobs();
-    const id = setInterval(loadJobs, 8000);
+    // con SSE conectado el polling queda solo como respaldo
+    const id = setInterval(loadJobs, live ? 60000 : 8000);
     return () => clearInterval(id);
+  }, [loadJobs, live]);
+
+  useEffect(() => {
+    const onProgress = (ev) => {
+      setJobs(prev => prev.map(job => {
+        if (job.id !== ev.job_id) return job;
+        const processed = ev.processed_items ?? job.processed_items;
+        const total = ev.total_items ?? job.total_items;
+        return {
+          ...job,
+          processed_items: processed,
+          total_items: total,
+          details: ev.details ?? job.details,
+          progress_pct: total > 0 ? Math.round((processed / total) * 10000) / 100 : job.progress_pct,
+        };
+      }));
+    };
+
+    return subscribeEvents(
+      ["jobs"],
+      {
+        "jobs.queued": () => loadJobs(),
+        "jobs.started": () => loadJobs(),
+        "jobs.finished": () => loadJobs(),
+        "jobs.progress": onProgress,
+      },
+      setLive
+    );
   }, [loadJobs]);
 
+  const cancelJob = async (jobId) => {
+    try {
+      await api.post(`/jobs/${jobId}/cancel`);
+    } catch {
+      setError("No se pudo cancelar el job.");
+    }
+    loadJobs();
+  };
+
   const formatTs = (ts) => {
     if (!ts) return "—";
     return new Date(ts).toLocaleString("es-CO", { timeZone: "America/Bogota" });
   };
 
   const pillClass = (status) => {
+    if (status === "PENDING") return "job-pill pending";
     if (status === "RUNNING") return "job-pill running";
     if (status === "SUCCESS") return "job-pill success";
     if (status === "ERROR") return "job-pill error";
+    if (status === "CANCELLED") return "job-pill cancelled";
     return "job-pill";
   };
 
@@ -54,7 +96,7 @@ export default function Jobs() {
         <button className="jobs-refresh" onClick={loadJobs}>Actualizar</button>
       </div>
 
-      <p className="jobs-hint">Monitorea ejecuciones de collector, escaneos por actor, sincronización MITRE y OpenCTI.</p>
+      <p className="jobs-hint">Monitorea ejecuciones de collector, escaneos por actor, sincronización MITRE, MISP y OpenCTI. Los jobs en cola o en curso se pueden cancelar.</p>
 
       <div className="jobs-filters">
         <label>
@@ -87,18 +129,19 @@ export default function Jobs() {
               <th>Inicio</th>
               <th>Fin</th>
               <th>Detalle</th>
+              <th></th>
             </tr>
           </thead>
           <tbody>
             {loading && (
               <tr>
-                <td colSpan="9" className="jobs-muted">Cargando jobs...</td>
+                <td colSpan="10" className="jobs-muted">Cargando jobs...</td>
               </tr>
             )}
 
             {!loading && jobs.length === 0 && (
               <tr>
-                <td colSpan="9" className="jobs-muted">No hay jobs para los filtros seleccionados.</td>
+                <td colSpan="10" className="jobs-muted">No hay jobs para los filtros seleccionados.</td>
               </tr>
             )}
 
@@ -120,6 +163,12 @@ export default function Jobs() {
                 <td className="jobs-detail" title={job.error || job.details || ""}>
                   {job.error || job.details || "—"}
                 </td>
+                <td>
+                  {(job.status === "PENDING" || job.status === "RUNNING") && !job.cancel_requested && (
+                    <button className="jobs-cancel" onClick={() => cancelJob(job.id)}>Cancelar</button>
+                  )}
+                  {job.status === "RUNNING" && job.cancel_requested && <span className="jobs-muted">Cancelando…</span>}
+                </td>
               </tr>
             ))}
           </tbody>
@@ -0,0 +1,45 @@
+import os
+
+# los módulos de app crean el engine al importarse; los tests usan su propia BD
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.database import Base
+
+# TEST_DATABASE_URL=postgresql://... corre los tests de BD contra Postgres (SKIP LOCKED real)
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite://")
+
+
+@pytest.fixture
+def session_factory():
+    if TEST_DATABASE_URL.startswith("sqlite"):
+        engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+        @event.listens_for(engine, "connect")
+        def _sqlite_functions(conn, _):
+            # GREATEST de Postgres (release_task)
+            conn.create_function("greatest", -1, max)
+    else:
+        engine = create_engine(TEST_DATABASE_URL)
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.services import collection_queue
+from app.services.collection_queue import (
+    claim_tasks,
+    coordinator_lost,
+    enqueue_tasks,
+    finish_task,
+    release_expired,
+    release_coordinator,
+    release_task,
+    renew_coordinator,
+    requests_used,
+    task_counts,
+)
+
+WORKER_A = "host-a:1"
+WORKER_B = "host-b:2"
+
+
+@pytest.fixture
+def job(db):
+    job = models.JobRun(job_type="collector", status="RUNNING")
+    db.add(job)
+    for i in range(1, 5):
+        db.add(models.ThreatActor(id=i, name=f"actor-{i}", gti_id=f"gti-{i}", country="CO"))
+    db.commit()
+    enqueue_tasks(db, job.id, [
+        {"actor_id": 1, "priority": 1.0},
+        {"actor_id": 2, "priority": 5.0},
+        {"actor_id": 3, "priority": 3.0},
+        {"actor_id": 4, "priority": 0.0, "status": "SKIPPED", "reason": "recent"},
+    ])
+    return job
+
+
+def _task(db, job_id, actor_id):
+    db.expire_all()
+    return db.query(models.CollectionTask).filter_by(job_id=job_id, actor_id=actor_id).one()
+
+
+def _expire_lease(db, job_id, actor_id):
+    task = _task(db, job_id, actor_id)
+    task.lease_until = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+
+def test_enqueue_is_idempotent(db, job):
+    enqueue_tasks(db, job.id, [{"actor_id": 1, "priority": 99.0}])
+    assert task_counts(db, job.id)["PENDING"] == 3
+    assert _task(db, job.id, 1).priority == 1.0
+
+
+def test_claim_by_priority_and_no_double_claim(db, job):
+    claimed = claim_tasks(db, job.id, 2, worker=WORKER_A)
+    assert [t.actor_id for t in claimed] == [2, 3]
+    assert all(t.status == "RUNNING" and t.locked_by == WORKER_A and t.attempts == 1 for t in claimed)
+
+    # con el lease vigente otro worker solo ve lo que queda
+    other = claim_tasks(db, job.id, 5, worker=WORKER_B)
+    assert [t.actor_id for t in other] == [1]
+    assert claim_tasks(db, job.id, 5, worker=WORKER_B) == []
+
+
+def test_finish_only_by_owner(db, job):
+    claim_tasks(db, job.id, 1, worker=WORKER_A)
+
+    finish_task(db, _task(db, job.id, 2).id, {"status": "ok", "total": 4, "requests": 3}, worker=WORKER_B)
+    assert _task(db, job.id, 2).status == "RUNNING"
+
+    finish_task(db, _task(db, job.id, 2).id, {"status": "ok", "total": 4, "requests": 3}, worker=WORKER_A)
+    task = _task(db, job.id, 2)
+    assert (task.status, task.result_total, task.requests_used, task.lease_until) == ("DONE", 4, 3, None)
+
+
+def test_release_returns_task_without_spending_attempt(db, job):
+    claim_tasks(db, job.id, 1, worker=WORKER_A)
+    release_task(db, _task(db, job.id, 2).id, worker=WORKER_A)
+
+    task = _task(db, job.id, 2)
+    assert (task.status, task.attempts, task.locked_by) == ("PENDING", 0, None)
+    assert [t.actor_id for t in claim_tasks(db, job.id, 1, worker=WORKER_B)] == [2]
+
+
+def test_expired_lease_is_released_and_reclaimed(db, job):
+    claim_tasks(db, job.id, 1, worker=WORKER_A)
+    assert release_expired(db, job.id) == 0
+
+    _expire_lease(db, job.id, 2)
+    assert release_expired(db, job.id) == 1
+    assert _task(db, job.id, 2).status == "PENDING"
+
+    reclaimed = claim_tasks(db, job.id, 1, worker=WORKER_B)
+    assert [(t.actor_id, t.locked_by, t.attempts) for t in reclaimed] == [(2, WORKER_B, 2)]
+
+    # el worker caído ya no puede cerrar la tarea
+    finish_task(db, reclaimed[0].id, {"status": "ok"}, worker=WORKER_A)
+    assert _task(db, job.id, 2).status == "RUNNING"
+
+
+def test_expired_lease_is_claimable_directly(db, job):
+    claim_tasks(db, job.id, 1, worker=WORKER_A)
+    _expire_lease(db, job.id, 2)
+    assert [t.actor_id for t in claim_tasks(db, job.id, 1, worker=WORKER_B)] == [2]
+
+
+def test_max_attempts_marks_error(db, job, monkeypatch):
+    monkeypatch.setattr(collection_queue, "COLLECTION_TASK_MAX_ATTEMPTS", 2)
+    for worker in (WORKER_A, WORKER_B):
+        assert [t.actor_id for t in claim_tasks(db, job.id, 1, worker=worker)] == [2]
+        _expire_lease(db, job.id, 2)
+
+    # el tercer intento no se lanza: la tarea queda ERROR y se toma la siguiente
+    assert [t.actor_id for t in claim_tasks(db, job.id, 1, worker=WORKER_A)] == []
+    task = _task(db, job.id, 2)
+    assert (task.status, task.error) == ("ERROR", "MAX_ATTEMPTS_EXCEEDED")
+    assert [t.actor_id for t in claim_tasks(db, job.id, 1, worker=WORKER_A)] == [3]
+
+
+def test_budget_is_reserved_at_claim(db, job, monkeypatch):
+    monkeypatch.setattr(collection_queue, "COLLECTION_TASK_REQUEST_RESERVE", 4)
+
+    # presupuesto 10, reserva 4: el primer worker toma 2 tareas y el segundo solo 1
+    first = claim_tasks(db, job.id, 5, worker=WORKER_A, budget=10)
+    assert [t.requests_reserved for t in first] == [4, 4]
+    assert requests_used(db, job.id) == 8
+
+    second = claim_tasks(db, job.id, 5, worker=WORKER_B, budget=10)
+    assert [t.actor_id for t in second] == [1]
+    assert requests_used(db, job.id) == 12
+    assert claim_tasks(db, job.id, 5, worker=WORKER_B, budget=10) == []
+
+    # al terminar la reserva se reemplaza por lo gastado de verdad
+    finish_task(db, first[0].id, {"status": "ok", "requests": 1}, worker=WORKER_A)
+    assert requests_used(db, job.id) == 9
+
+
+def test_released_task_frees_its_reservation(db, job, monkeypatch):
+    monkeypatch.setattr(collection_queue, "COLLECTION_TASK_REQUEST_RESERVE", 4)
+    claimed = claim_tasks(db, job.id, 1, worker=WORKER_A, budget=10)
+    release_task(db, claimed[0].id, worker=WORKER_A)
+    assert requests_used(db, job.id) == 0
+
+    claim_tasks(db, job.id, 1, worker=WORKER_A, budget=10)
+    _expire_lease(db, job.id, 2)
+    release_expired(db, job.id)
+    assert requests_used(db, job.id) == 0
+
+
+def _lost_ids(db):
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=collection_queue.COLLECTION_COORDINATOR_LEASE_SECONDS)
+    return [job_id for (job_id,) in db.query(models.JobRun.id).filter(coordinator_lost(now, stale_before))]
+
+
+def test_coordinator_lease_is_owned_and_expires(db, job):
+    assert renew_coordinator(db, job.id, WORKER_A)
+    assert not renew_coordinator(db, job.id, WORKER_B)
+    assert _lost_ids(db) == []
+
+    db.query(models.JobRun).filter_by(id=job.id).update(
+        {"coordinator_lease_until": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+    assert _lost_ids(db) == [job.id]
+
+    release_coordinator(db, job.id, WORKER_B)
+    db.expire_all()
+    assert db.get(models.JobRun, job.id).coordinator == WORKER_A
+    release_coordinator(db, job.id, WORKER_A)
+    assert renew_coordinator(db, job.id, WORKER_B)
@@ -0,0 +1,59 @@
+from datetime import date, datetime, timedelta
+
+from app.services import event_rollup
+from app.services.event_rollup import EventRollup, local_day, local_today
+
+
+def test_local_day_shifts_utc_to_bogota():
+    # Bogotá es UTC-5 todo el año
+    assert local_day(datetime(2026, 10, 19, 4, 59)) == date(2026, 10, 18)
+    assert local_day(datetime(2026, 10, 19, 5, 0)) == date(2026, 10, 19)
+    assert local_day(datetime(2027, 1, 1, 3, 0)) == date(2026, 12, 31)
+
+
+def test_local_today_matches_local_day_of_utc_now():
+    before = local_day(datetime.utcnow())
+    today = local_today()
+    after = local_day(datetime.utcnow())
+    assert today in (before, after)
+
+
+def test_local_today_uses_bogota_clock(monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            # 02:00 UTC del 20 = 21:00 del 19 en Bogotá
+            return datetime(2026, 10, 20, 2, 0, tzinfo=event_rollup.timezone.utc).astimezone(tz)
+
+    monkeypatch.setattr(event_rollup, "datetime", FrozenDatetime)
+    assert local_today() == date(2026, 10, 19)
+
+
+def test_rollup_buckets_by_local_day():
+    rollup = EventRollup()
+    late_evening = datetime(2026, 10, 19, 4, 30)   # 23:30 del 18 en Bogotá
+    midnight = datetime(2026, 10, 19, 5, 0)        # 00:00 del 19
+    same_local_day = datetime(2026, 10, 20, 2, 0)  # 21:00 del 19, otra fecha UTC
+
+    rollup.add(1, 10, "NEW", late_evening)
+    rollup.add(1, 10, "NEW", same_local_day)
+    rollup.add(1, 10, "NEW", midnight)
+    rollup.add(1, 10, "DISAPPEARED", midnight)
+
+    assert set(rollup.rows) == {
+        (date(2026, 10, 18), "NEW", 1, 10),
+        (date(2026, 10, 19), "NEW", 1, 10),
+        (date(2026, 10, 19), "DISAPPEARED", 1, 10),
+    }
+    row = rollup.rows[(date(2026, 10, 19), "NEW", 1, 10)]
+    assert row == {"events": 2, "first_at": midnight, "last_at": same_local_day}
+
+
+def test_rollup_new_events_reports_first_timestamp():
+    rollup = EventRollup()
+    first = datetime(2026, 10, 19, 12, 0)
+    rollup.add(1, 10, "NEW", first + timedelta(hours=1))
+    rollup.add(1, 10, "NEW", first)
+    rollup.add(2, 11, "REACTIVATED", first)
+
+    assert rollup.new_events() == [(1, 10, first)]
@@ -0,0 +1,223 @@
+import threading
+from datetime import timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from app import models
+from app.services import rate_limiter
+from app.services.rate_limiter import RequestBudget, SharedTokenBucket, TokenBucket
+
+
+class FakeClock:
+    """Reloj monotónico falso: sleep avanza el tiempo sin esperar."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _fake_time(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_token_bucket_burst_then_waits_for_refill(monkeypatch):
+    clock = _fake_time(monkeypatch)
+    bucket = TokenBucket(60, burst=3)  # 1 token por segundo
+
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    waited = bucket.acquire()
+    assert waited == 1.0
+    assert clock.slept == [1.0]
+
+
+def test_token_bucket_refill_is_capped_at_capacity(monkeypatch):
+    clock = _fake_time(monkeypatch)
+    bucket = TokenBucket(60, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 3600
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 1.0
+
+
+def test_token_bucket_zero_rate_is_unlimited(monkeypatch):
+    clock = _fake_time(monkeypatch)
+    bucket = TokenBucket(0)
+    assert bucket.unlimited
+    assert all(bucket.acquire() == 0.0 for _ in range(1000))
+    assert clock.slept == []
+
+
+def test_token_bucket_is_thread_safe():
+    bucket = TokenBucket(6000, burst=50)
+    results = []
+
+    def worker():
+        for _ in range(10):
+            results.append(bucket.acquire())
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 50 tomas caben en la ráfaga: nadie espera y no se entregan tokens de más
+    assert results == [0.0] * 50
+    assert bucket.tokens < 1
+
+
+def test_request_budget_limit_and_remaining():
+    budget = RequestBudget(3)
+    assert not budget.exhausted
+    assert budget.remaining == 3
+
+    budget.charge()
+    budget.charge(2)
+    assert budget.used == 3
+    assert budget.exhausted
+    assert budget.remaining == 0
+
+    budget.charge()
+    assert budget.remaining == 0
+
+
+def test_request_budget_zero_is_unlimited():
+    budget = RequestBudget(0)
+    budget.charge(10_000)
+    assert not budget.exhausted
+    assert budget.remaining is None
+
+
+def test_request_budget_charges_parent():
+    run = RequestBudget(5)
+    actor_a = RequestBudget(0, parent=run)
+    actor_b = RequestBudget(0, parent=run)
+
+    actor_a.charge(2)
+    actor_b.charge(3)
+    assert (actor_a.used, actor_b.used, run.used) == (2, 3, 5)
+    assert run.exhausted
+    assert not actor_a.exhausted
+
+
+def _shared(session_factory, **kwargs):
+    return SharedTokenBucket("vt", 60, session_factory=session_factory, model=models.RateLimitBucket, **kwargs)
+
+
+def test_shared_token_bucket_quota_spans_instances(monkeypatch, session_factory):
+    clock = _fake_time(monkeypatch)
+    # dos "procesos" con su propio objeto sobre la misma fila
+    worker_a = _shared(session_factory, burst=2, batch=1)
+    worker_b = _shared(session_factory, burst=2, batch=1)
+
+    assert worker_a.acquire() == 0.0
+    assert worker_b.acquire() == 0.0
+    # la ráfaga compartida se agotó: el tercero espera
+    assert worker_b._take(1) > 0
+    assert clock.slept == []
+
+    db = session_factory()
+    try:
+        row = db.query(models.RateLimitBucket).filter_by(name="vt").one()
+        assert row.tokens < 1
+        # pasaron dos segundos para todos los procesos
+        row.updated_at = row.updated_at - timedelta(seconds=2)
+        db.commit()
+    finally:
+        db.close()
+
+    assert worker_a._take(1) == 0.0
+    assert worker_b._take(1) == 0.0
+    assert worker_a._take(1) > 0
+
+
+def test_shared_token_bucket_withdraws_in_batches(monkeypatch, session_factory):
+    _fake_time(monkeypatch)
+    round_trips = []
+
+    def counting_factory():
+        round_trips.append(1)
+        return session_factory()
+
+    bucket = _shared(counting_factory, burst=10, batch=5)
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert len(round_trips) == 1
+
+    db = session_factory()
+    try:
+        assert db.query(models.RateLimitBucket).filter_by(name="vt").one().tokens == 5
+    finally:
+        db.close()
+
+    bucket.acquire()
+    assert len(round_trips) == 2
+
+
+def test_shared_token_bucket_limits_db_contenders(monkeypatch, session_factory):
+    in_db = []
+    peak = []
+
+    def tracking_factory():
+        in_db.append(1)
+        peak.append(len(in_db))
+        session = session_factory()
+        close = session.close
+
+        def _close():
+            in_db.pop()
+            close()
+
+        session.close = _close
+        return session
+
+    bucket = SharedTokenBucket("vt", 60000, session_factory=tracking_factory, model=models.RateLimitBucket, burst=1000, batch=1)
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(20)]) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 16 hilos, pero un solo viaje a la BD a la vez por proceso
+    assert max(peak) == 1
+
+
+def test_shared_token_bucket_waits_instead_of_granting_on_db_error(monkeypatch, session_factory):
+    clock = _fake_time(monkeypatch)
+    failures = [2]
+
+    class FlakySession:
+        def __init__(self):
+            self.inner = session_factory()
+
+        def query(self, *args):
+            if failures[0] > 0:
+                failures[0] -= 1
+                raise OperationalError("SELECT", {}, Exception("QueuePool limit reached"))
+            return self.inner.query(*args)
+
+        def __getattr__(self, name):
+            return getattr(self.inner, name)
+
+    bucket = _shared(FlakySession, burst=1, retry_seconds=0.5)
+    # dos fallos de BD: espera y reintenta, nunca entrega tokens locales
+    assert bucket.acquire() == 1.0
+    assert clock.slept == [0.5, 0.5]
+    # el token entregado salió de la fila compartida
+    db = session_factory()
+    try:
+        assert db.query(models.RateLimitBucket).filter_by(name="vt").one().tokens == 0
+    finally:
+        db.close()
+    assert bucket.tokens == 0
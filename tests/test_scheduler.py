@@ -0,0 +1,82 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.services import scheduler
+from app.services.scheduler import next_fire_time, parse_days
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    # Bogotá no tiene horario de verano: para los cambios de hora usamos una zona que sí
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/New_York"))
+
+
+def test_parse_days_ignores_unknown_and_normalizes():
+    assert parse_days(" Mon,tue, xyz ,SUN,") == ["mon", "tue", "sun"]
+    assert parse_days(None) == []
+
+
+def test_next_fire_time_invalid_config():
+    after = datetime(2026, 10, 19, 12, 0)
+    assert next_fire_time("", "06:00", after) is None
+    assert next_fire_time("mon", None, after) is None
+    assert next_fire_time("mon", "6h", after) is None
+
+
+def test_next_fire_time_is_strictly_after(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/Bogota"))
+    # lunes 2026-10-19 06:00 Bogotá = 11:00 UTC
+    fire = next_fire_time("mon,tue", "06:00", datetime(2026, 10, 19, 10, 59))
+    assert fire == datetime(2026, 10, 19, 11, 0)
+    assert next_fire_time("mon,tue", "06:00", fire) == datetime(2026, 10, 20, 11, 0)
+
+
+def test_next_fire_time_wraps_to_next_week(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/Bogota"))
+    # ya pasó el disparo del lunes: el siguiente es el lunes de la otra semana
+    assert next_fire_time("mon", "06:00", datetime(2026, 10, 19, 11, 0)) == datetime(2026, 10, 26, 11, 0)
+    # domingo en la noche -> lunes siguiente
+    assert next_fire_time("mon", "06:00", datetime(2026, 10, 26, 4, 0)) == datetime(2026, 10, 26, 11, 0)
+
+
+def test_next_fire_time_uses_local_date_not_utc_date(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/Bogota"))
+    # 2026-10-20 03:00 UTC todavía es lunes 19 a las 22:00 en Bogotá
+    assert next_fire_time("tue", "06:00", datetime(2026, 10, 20, 3, 0)) == datetime(2026, 10, 20, 11, 0)
+    assert next_fire_time("mon", "23:00", datetime(2026, 10, 20, 3, 0)) == datetime(2026, 10, 20, 4, 0)
+
+
+def test_next_fire_time_keeps_local_wall_time_across_dst(new_york):
+    # 2026-03-08 EE.UU. pasa de EST (-5) a EDT (-4)
+    before = next_fire_time("sat", "06:00", datetime(2026, 3, 7, 0, 0))
+    after = next_fire_time("sun", "06:00", datetime(2026, 3, 7, 12, 0))
+    assert before == datetime(2026, 3, 7, 11, 0)
+    assert after == datetime(2026, 3, 8, 10, 0)
+
+
+def test_next_fire_time_in_spring_forward_gap(new_york):
+    # 02:30 no existe el 2026-03-08: se dispara a la hora UTC equivalente (03:30 EDT)
+    fire = next_fire_time("sun", "02:30", datetime(2026, 3, 8, 0, 0))
+    assert fire == datetime(2026, 3, 8, 7, 30)
+
+
+def test_next_fire_time_in_fall_back_overlap_fires_once(new_york):
+    # 01:30 ocurre dos veces el 2026-11-01: se toma la primera (EDT) y no se repite
+    fire = next_fire_time("sun", "01:30", datetime(2026, 11, 1, 0, 0))
+    assert fire == datetime(2026, 11, 1, 5, 30)
+    assert next_fire_time("sun", "01:30", fire) == datetime(2026, 11, 8, 6, 30)
+
+
+def test_next_fire_time_with_interval_ignores_time(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/Bogota"))
+    after = datetime(2026, 10, 19, 12, 7)
+    assert next_fire_time("mon,tue", None, after, interval_minutes=60) == datetime(2026, 10, 19, 13, 7)
+    assert next_fire_time("", "06:00", after, interval_minutes=60) is None
+
+
+def test_next_fire_time_with_interval_skips_to_next_scheduled_day(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_TZ", ZoneInfo("America/Bogota"))
+    # lunes 23:30 Bogotá + 60 min cae el martes: salta al inicio del miércoles (05:00 UTC)
+    assert next_fire_time("mon,wed", "06:00", datetime(2026, 10, 20, 4, 30), interval_minutes=60) == datetime(2026, 10, 21, 5, 0)